@@ -0,0 +1,94 @@
+from datetime import date
+import currency
+import database as db
+
+DEFAULT_LEVELS = (80, 100)
+TOTAL = None  # the month's budget, which has no category
+
+def parse_levels(text):
+    if not text: return DEFAULT_LEVELS
+    levels = sorted({int(float(p)) for p in str(text).replace('%', '').split(',') if p.strip()})
+    if not levels or levels[0] <= 0: raise ValueError("Alert levels must be positive percentages")
+    return tuple(levels)
+
+def following_months(month, year, count):
+    # The count months after month/year, as (month, year) pairs for copy_budget_plan
+    out = []
+    for _ in range(count):
+        month, year = (1, year + 1) if month == 12 else (month + 1, year)
+        out.append((month, year))
+    return out
+
+class BudgetAlerts:
+    # Month-to-date spending per category for one user, seeded from the rollups once and then
+    # kept current by record(), so a write checks its category's thresholds without a query.
+    # A category's budget covers its subcategories too. invalidate() after changes made
+    # elsewhere (edits, imports, budgets, categories) reseeds on next use.
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.period = None
+
+    def invalidate(self):
+        self.period = None
+
+    def load(self, today=None):
+        # True when it reseeded from the database
+        today = today or date.today()
+        period = f"{today.year}-{today.month:02d}"
+        if self.period == period: return False
+        self.limits = {r['category']: (r['amount'], parse_levels(r['alert_levels'])) for r in db.get_budget_plan(self.user_id, today.month, today.year)}
+        self.spent = db.get_month_expenses(self.user_id, today.month, today.year)
+        self.total = sum(self.spent.values())
+        self.fired = set(db.get_fired_alerts(self.user_id, period))
+        self.chains = db.category_chains(db.get_categories(self.user_id))
+        self.currencies = {a['account_id']: a['currency'] for a in db.get_accounts(self.user_id)}
+        self.period = period
+        return True
+
+    def chain(self, category):
+        # The name spending under category counts as, then its parents
+        return self.chains.get(category.lower(), (category,))
+
+    def covered(self, budget):
+        return sum(s for c, s in self.spent.items() if budget in self.chain(c))
+
+    def crossed(self, category, spent):
+        budget, levels = self.limits.get(category, (0, ()))
+        if budget <= 0: return []
+        return [(category, level, round(spent, 2), budget) for level in levels
+                if spent >= budget * level / 100 and (category, level) not in self.fired]
+
+    def check(self, category, amount, today=None):
+        # Alerts an expense of amount would fire, without recording it
+        self.load(today)
+        return [a for b in self.chain(category) for a in self.crossed(b, self.covered(b) + amount)] + self.crossed(TOTAL, self.total + amount)
+
+    def record(self, account_id, day, amount, trans_type, category):
+        # Call after the transaction is saved; returns the alerts it fired
+        reseeded = self.load()
+        if trans_type != 'Expense' or day[:7] != self.period: return []
+        chain = self.chain(category)
+        if not reseeded:
+            # A reseed read the rollups after the save, so they already hold this transaction
+            code = self.currencies.get(account_id, currency.BASE_CURRENCY)
+            amount = abs(float(amount))
+            base = db.convert_amount(amount, code, currency.BASE_CURRENCY, day)
+            amount = amount if base is None else base
+            self.spent[chain[0]] = self.spent.get(chain[0], 0.0) + amount
+            self.total += amount
+        fired = [a for b in chain for a in self.crossed(b, self.covered(b))] + self.crossed(TOTAL, self.total)
+        if fired:
+            db.save_budget_alerts(self.user_id, self.period, fired)
+            self.fired.update((c, level) for c, level, _, _ in fired)
+        return fired
+
+    def rows(self, today=None):
+        # Same shape as get_category_budgets_with_spending, from memory
+        self.load(today)
+        res = [{'category': c, 'budget': budget, 'spent': self.covered(c)} for c, (budget, _) in self.limits.items() if c is not TOTAL]
+        return res + [{'category': c, 'budget': 0, 'spent': s} for c, s in self.spent.items() if self.limits.keys().isdisjoint(self.chain(c))]
+
+def describe(alert):
+    category, level, spent, budget = alert
+    name = "Monthly budget" if category is TOTAL else f"{category} budget"
+    return f"{name} past {level}%: {currency.fmt(spent)} of {currency.fmt(budget)}"
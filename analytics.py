@@ -0,0 +1,78 @@
+import math
+from datetime import date, timedelta
+import database as db
+import scheduler
+
+# granularity -> (rollup table, SQL bucket expression over its period column)
+GRANULARITIES = {
+    'day': ('daily_rollups', "period"),
+    'week': ('daily_rollups', "date(period, '-' || ((CAST(strftime('%w', period) AS INTEGER) + 6) % 7) || ' days')"),
+    'month': ('monthly_rollups', "period"),
+    'quarter': ('monthly_rollups', "substr(period, 1, 4) || '-Q' || ((CAST(substr(period, 6, 2) AS INTEGER) + 2) / 3)"),
+    'year': ('monthly_rollups', "substr(period, 1, 4)"),
+}
+RANGES = [('Last 6 Months', 6), ('Last Year', 12), ('Last 3 Years', 36), ('Last 5 Years', 60), ('Last 10 Years', 120), ('All Time', None)]
+MAX_POINTS = 36
+
+def bucket_of(d, granularity):
+    if granularity == 'day': return d.isoformat()
+    if granularity == 'week': return (d - timedelta(days=d.weekday())).isoformat()
+    if granularity == 'month': return d.strftime('%Y-%m')
+    if granularity == 'quarter': return f"{d.year}-Q{(d.month + 2) // 3}"
+    return str(d.year)
+
+def bucket_labels(start, end, granularity):
+    labels, d = [], start
+    while d <= end:
+        b = bucket_of(d, granularity)
+        if not labels or labels[-1] != b: labels.append(b)
+        if granularity in ('day', 'week'): d += timedelta(days=1 if granularity == 'day' else 7 - d.weekday())
+        else: d = scheduler.add_months(d.replace(day=1), 1, 1)
+    return labels
+
+def auto_granularity(start, end, max_points=MAX_POINTS):
+    days = (end - start).days + 1
+    for g, per in [('day', 1), ('week', 7), ('month', 30.4), ('quarter', 91.3)]:
+        if days / per <= max_points: return g
+    return 'year'
+
+def range_start(user_id, months, today=None, conn=None):
+    today = today or date.today()
+    if months is None:
+        first = db.get_first_transaction_date(user_id, conn)
+        return date.fromisoformat(first) if first else today.replace(day=1)
+    return scheduler.add_months(today.replace(day=1), -(months - 1), 1)
+
+def get_series(user_id, start, end, granularity='month', conn=None):
+    table, bucket = GRANULARITIES[granularity]
+    if table == 'monthly_rollups': bounds = (start.strftime('%Y-%m'), end.strftime('%Y-%m'))
+    else: bounds = (start.isoformat(), end.isoformat())
+
+    periods = bucket_labels(start, end, granularity)
+    idx = {p: i for i, p in enumerate(periods)}
+    income, expense = [0.0] * len(periods), [0.0] * len(periods)
+    categories = {}
+    for r in db.get_rollup_series(user_id, table, bucket, *bounds, conn):
+        i = idx.get(r['bucket'])
+        if i is None: continue
+        if r['type'] == 'Income': income[i] += r['total']
+        else:
+            expense[i] += abs(r['total'])
+            categories.setdefault(r['category'], [0.0] * len(periods))[i] += abs(r['total'])
+    return {'periods': periods, 'income': income, 'expense': expense,
+            'net': [a - b for a, b in zip(income, expense)], 'categories': categories}
+
+def downsample(series, max_points=MAX_POINTS):
+    # Amounts are flows, so merging k neighbouring buckets is just their sum
+    n = len(series['periods'])
+    if n <= max_points: return series
+    k = math.ceil(n / max_points)
+    merge = lambda values: [sum(values[i:i + k]) for i in range(0, n, k)]
+    return {'periods': series['periods'][::k], 'income': merge(series['income']), 'expense': merge(series['expense']),
+            'net': merge(series['net']), 'categories': {c: merge(v) for c, v in series['categories'].items()}}
+
+def get_display_series(user_id, months=6, granularity=None, max_points=MAX_POINTS, today=None, conn=None):
+    today = today or date.today()
+    start = range_start(user_id, months, today, conn)
+    granularity = granularity or auto_granularity(start, today, max_points)
+    return downsample(get_series(user_id, start, today, granularity, conn), max_points)
@@ -0,0 +1,149 @@
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+import numpy as np
+import currency
+import database as db
+
+# Flags expenses that are unusually large for their merchant (or their category, while the
+# merchant has too little history) and probable duplicate charges. scan() looks only at the
+# transactions added since it last ran, against the sums the triggers keep in spending_stats;
+# backfill() recomputes every flag from the full history in a few array passes.
+
+WINDOW_MONTHS = 12         # the usual amount comes from the charge's month and the 11 before
+MIN_HISTORY = 5            # other charges needed before a baseline counts
+Z_SCORE = 3.0              # spreads above the usual amount
+MIN_RATIO = 2.0            # and at least this multiple of it, so a steady bill doesn't flag on a small rise
+SPREAD_FLOOR = 0.1         # the spread is at least this fraction of the usual amount
+DUPLICATE_DAYS = 1         # same account, merchant and amount at most this many days apart
+BACKFILL_OVER = 20_000     # a scan with more new rows than this runs a backfill instead
+ZERO = np.zeros(3)
+
+def month_index(period):
+    # 'YYYY-MM' or an ISO date
+    return int(period[:4]) * 12 + int(period[5:7]) - 1
+
+def period(index):
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+def outliers(x, n, total, total_sq):
+    # x with the count, sum and sum of squares of the window it falls in, itself included.
+    # Returns (flagged, score, usual amount), all arrays.
+    n, total, total_sq = n - 1, total - x, total_sq - x * x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        usual = total / n
+        spread = np.maximum(np.sqrt(np.maximum(total_sq - total * usual, 0) / (n - 1)), SPREAD_FLOOR * usual)
+        score = (x - usual) / spread
+    return (n >= MIN_HISTORY) & (x >= MIN_RATIO * usual) & (score >= Z_SCORE), score, usual
+
+def judge(x, merchant_sums, category_sums):
+    # The merchant's window where it has the history, else the category's
+    use = merchant_sums[0] - 1 >= MIN_HISTORY
+    return outliers(x, *(np.where(use, m, c) for m, c in zip(merchant_sums, category_sums)))
+
+def outlier_flags(tid, x, flagged, score, usual):
+    return [(int(tid[i]), 'outlier', round(float(score[i]), 2), round(float(usual[i]), 2), None) for i in np.flatnonzero(flagged)]
+
+def codes(values):
+    # Dense int codes for hashable values, in order of first appearance
+    seen = {}
+    return np.array([seen.setdefault(v, len(seen)) for v in values], dtype=np.int64)
+
+def combine(*columns):
+    # One dense code per distinct tuple of int codes
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    for c in columns:
+        key = np.unique(key * (int(c.max()) + 1) + c, return_inverse=True)[1].astype(np.int64)
+    return key
+
+def window_sums(key, month, x):
+    # Per row: count, sum and sum of squares of x over the rows with its key in its month and
+    # the WINDOW_MONTHS - 1 before. Rows are bucketed by (key, month) and each bucket's window
+    # is a difference of running sums, found by binary search in the sorted bucket codes.
+    bucket = key * 65536 + (month - month.min())
+    buckets, inv = np.unique(bucket, return_inverse=True)
+    first = np.searchsorted(buckets, np.maximum(buckets - (WINDOW_MONTHS - 1), buckets & ~0xFFFF))
+    out = []
+    for w in (np.ones_like(x), x, x * x):
+        run = np.concatenate(([0.0], np.cumsum(np.bincount(inv, weights=w, minlength=len(buckets)))))
+        out.append((run[1:] - run[first])[inv])
+    return out
+
+def columns(rows):
+    # get_expense_history rows as arrays: ids, account, month and day numbers, amount, category,
+    # merchant code, currency code
+    tid, account, dates, x, category, merchant, code = zip(*rows)
+    day = np.array(dates, dtype='datetime64[D]')
+    return (np.array(tid), np.array(account), day.astype('datetime64[M]').astype(np.int64), day.astype(np.int64),
+            np.array(x, dtype=float), np.array(category), codes(merchant), codes(code))
+
+def duplicate_flags(tid, account, day, x, merchant, after=0):
+    # Sorted so a repeat charge directly follows the one it repeats; only pairs with a row after `after`
+    cents = np.round(x * 100).astype(np.int64)
+    order = np.lexsort((tid, day, cents, merchant, account))
+    a, b = order[:-1], order[1:]
+    dup = (account[a] == account[b]) & (merchant[a] == merchant[b]) & (cents[a] == cents[b]) & (day[b] - day[a] <= DUPLICATE_DAYS)
+    dup &= (tid[a] > after) | (tid[b] > after)
+    return [(int(tid[j]), 'duplicate', None, None, int(tid[i])) for i, j in zip(a[dup], b[dup])]
+
+def detect(rows):
+    # Every flag for get_expense_history rows at once
+    tid, account, month, day, x, category, merchant, code = columns(rows)
+    flags = outlier_flags(tid, x, *judge(x, window_sums(combine(category, merchant, code), month, x), window_sums(combine(category, code), month, x)))
+    return flags + duplicate_flags(tid, account, day, x, merchant)
+
+def backfill(user_id):
+    # Recomputes all flags from the full history, keeping dismissals; returns (rows, flags)
+    rows = db.get_expense_history(user_id)
+    flags = detect(rows) if rows else []
+    db.save_anomalies(user_id, flags, rows[-1][0] if rows else 0, replace=True)
+    return len(rows), len(flags)
+
+def scan(user_id):
+    # Flags the expenses added since the last scan; returns how many it flagged
+    after = db.get_anomaly_watermark(user_id)
+    rows = db.get_expense_history(user_id, after)
+    if not rows: return 0
+    if len(rows) > BACKFILL_OVER: return backfill(user_id)[1]
+    months = [month_index(r[2]) for r in rows]
+    by_merchant, by_category = defaultdict(lambda: np.zeros(3)), defaultdict(lambda: np.zeros(3))
+    for c, m, code, p, n, total, total_sq in db.get_spending_stats(user_id, period(min(months) - WINDOW_MONTHS + 1), period(max(months))):
+        by_merchant[c, m, code, month_index(p)] += (n, total, total_sq)
+        by_category[c, code, month_index(p)] += (n, total, total_sq)
+    window = lambda stats, key, month: sum((stats.get(key + (i,), ZERO) for i in range(month - WINDOW_MONTHS + 1, month + 1)), ZERO)
+    merchant_sums = np.array([window(by_merchant, (r[4], r[5], r[6]), month) for r, month in zip(rows, months)]).T
+    category_sums = np.array([window(by_category, (r[4], r[6]), month) for r, month in zip(rows, months)]).T
+    x = np.array([r[3] for r in rows], dtype=float)
+    flags = outlier_flags([r[0] for r in rows], x, *judge(x, merchant_sums, category_sums))
+    # Repeats are looked for among all charges in the days the new ones span, which also
+    # catches an old charge that a backdated new one now precedes
+    first, last = (date.fromisoformat(f(r[2] for r in rows)) for f in (min, max))
+    pad = timedelta(days=DUPLICATE_DAYS)
+    tid, account, _, day, x, _, merchant, _ = columns(db.get_expense_history(user_id, dates=((first - pad).isoformat(), (last + pad).isoformat())))
+    flags += duplicate_flags(tid, account, day, x, merchant, after)
+    return db.save_anomalies(user_id, flags, rows[-1][0])
+
+def describe(a):
+    if a['kind'] == 'duplicate': return f"Same amount at the same merchant on {a['related_date'] or 'a deleted charge'}"
+    return f"{abs(a['amount']) / a['baseline']:.1f}x the usual {currency.fmt(a['baseline'], a['currency'])}" if a['baseline'] else "Unusually large"
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ('scan', 'backfill', 'list'):
+        print("usage: python anomalies.py scan USER_ID\n"
+              "       python anomalies.py backfill USER_ID\n"
+              "       python anomalies.py list USER_ID [LIMIT]")
+        sys.exit(1)
+    db.initialize_database()
+    user_id = int(args[1])
+    t = time.perf_counter()
+    if args[0] == 'scan':
+        print(f"{scan(user_id)} new flags in {time.perf_counter() - t:.2f} s")
+    elif args[0] == 'backfill':
+        rows, flags = backfill(user_id)
+        print(f"{rows} expenses checked, {flags} flagged in {time.perf_counter() - t:.2f} s")
+    else:
+        scan(user_id)
+        for a in db.get_anomalies(user_id, limit=int(args[2]) if len(args) > 2 else 50):
+            print(f"{a['date']}  {currency.fmt(abs(a['amount']), a['currency']):>14}  {(a['description'] or '')[:30]:<30}  {describe(a)}")
@@ -0,0 +1,82 @@
+import sys
+import csv
+import database as db
+
+class UndoStack:
+    # Undo/redo for one session over the audit log. sync() picks up actions made since the
+    # last look, from this window or the scheduler; a new action clears the redo side.
+    # Undo writes the inverse as an action of its own, and redo undoes that.
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.undo_ids, self.redo_ids = [], []
+        self.labels = {}
+        self.seen = db.get_last_action_id(user_id)
+
+    def sync(self):
+        # All of them: get_actions pages newest first, and a page limit would drop the oldest
+        actions = db.get_actions(self.user_id, after=self.seen, limit=-1)
+        if not actions: return
+        for a in reversed(actions):
+            self.undo_ids.append(a['action_id'])
+            self.labels[a['action_id']] = a['label']
+        self.redo_ids.clear()
+        self.seen = actions[0]['action_id']
+
+    def undo_label(self): return self.labels[self.undo_ids[-1]] if self.undo_ids else None
+
+    def redo_label(self): return self.labels[self.redo_ids[-1]] if self.redo_ids else None
+
+    def undo(self):
+        self.sync()
+        if not self.undo_ids: return False, "Nothing to undo"
+        return self.step(self.undo_ids, self.redo_ids)
+
+    def redo(self):
+        self.sync()
+        if not self.redo_ids: return False, "Nothing to redo"
+        return self.step(self.redo_ids, self.undo_ids)
+
+    def step(self, source, target):
+        ok, msg, new_id = db.undo_action(self.user_id, source[-1])
+        if not ok: return False, msg
+        source.pop()
+        target.append(new_id)
+        self.labels[new_id] = msg
+        self.seen = max(self.seen, new_id)
+        return True, msg
+
+def export_ledger_at(user_id, action_id, path):
+    # CSV of the ledger as it stood right after action_id; returns the row count
+    n = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(db.LEDGER_FIELDS)
+        with db.read_snapshot(user_id) as snap:
+            for r in db.iter_ledger_at(user_id, action_id, conn_ext=snap):
+                w.writerow(r)
+                n += 1
+    return n
+
+def resolve_action(user_id, when):
+    # '#123' is an action id, anything else an ISO time
+    return int(when[1:]) if when.startswith('#') else db.get_action_at(user_id, when)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ('log', 'ledger', 'undo') or (args[0] == 'ledger' and len(args) < 4) or (args[0] == 'undo' and len(args) < 3):
+        print("usage: python audit.py log USER_ID [LIMIT]\n"
+              "       python audit.py ledger USER_ID WHEN out.csv   (WHEN: 2026-10-01T18:00 or #action_id)\n"
+              "       python audit.py undo USER_ID ACTION_ID")
+        sys.exit(1)
+    db.initialize_database()
+    user_id = int(args[1])
+    if args[0] == 'log':
+        for a in db.get_actions(user_id, limit=int(args[2]) if len(args) > 2 else 50):
+            print(f"#{a['action_id']:<8} {a['at']}  {a['label']} ({a['changes']} rows)")
+    elif args[0] == 'ledger':
+        action_id = resolve_action(user_id, args[2])
+        print(f"{export_ledger_at(user_id, action_id, args[3])} transactions as of action #{action_id} written to {args[3]}")
+    else:
+        ok, msg, new_id = db.undo_action(user_id, int(args[2]))
+        print(f"{msg} (action #{new_id})" if ok else f"Failed: {msg}")
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,116 @@
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+import database as db
+
+BACKUP_DIR = None        # None: a backups folder beside the database file
+KEEP = 10
+STEP_PAGES = 1024        # pages copied per backup step; the source is unlocked between steps
+COMPRESS_LEVEL = 3
+# stem-timestamp-reason.db.gz; stems (my-finances) and reasons (pre-import) may hold dashes, the timestamp's shape is fixed
+SNAPSHOT_RE = re.compile(r'(?P<source>.+?)-(?P<at>\d{8}-\d{6}-\d{6})-(?P<reason>.+)\.db\.gz')
+
+def db_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def snapshot_name(path, reason):
+    return f"{db_stem(path)}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{reason}.db.gz"
+
+def snapshot_target(name):
+    # Snapshots are named after the file they came from: the main database or one shard
+    stem = SNAPSHOT_RE.fullmatch(name)['source']
+    return db.DB_NAME if stem == db_stem(db.DB_NAME) else os.path.join(db.SHARD_DIR, stem + '.db')
+
+def backup_dir():
+    # Resolved on use, so a database moved elsewhere (tests, benchmarks) keeps its snapshots with it
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(db.DB_NAME)), 'backups')
+
+def list_snapshots():
+    folder = backup_dir()
+    if not os.path.isdir(folder): return []
+    found = [m for m in map(SNAPSHOT_RE.fullmatch, os.listdir(folder)) if m]
+    found.sort(key=lambda m: m['at'], reverse=True)
+    return [{'name': m[0], 'path': os.path.join(folder, m[0]), 'size': os.path.getsize(os.path.join(folder, m[0])),
+             'source': m['source'], 'reason': m['reason']} for m in found]
+
+def rotate(keep=KEEP):
+    # Keep the newest snapshots of each database file
+    seen = {}
+    for s in list_snapshots():
+        seen[s['source']] = seen.get(s['source'], 0) + 1
+        if seen[s['source']] > keep: os.remove(s['path'])
+
+def copy_database(src, dst, progress=None):
+    # Page-stepped online copy: writers can get in between steps, and the copy restarts
+    # transparently if the source changes under it, so the result is always consistent
+    def on_step(status, remaining, total):
+        if progress: progress(total - remaining, total)
+    src.backup(dst, pages=STEP_PAGES, progress=on_step, sleep=0.005)
+
+def create_snapshot(reason='manual', progress=None, db_path=None):
+    db_path = db_path or db.DB_NAME
+    folder = backup_dir()
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.db', dir=folder)
+    os.close(fd)
+    path = os.path.join(folder, snapshot_name(db_path, reason))
+    try:
+        t = time.perf_counter()
+        src, dst = sqlite3.connect(db_path), sqlite3.connect(tmp)
+        try: copy_database(src, dst, progress)
+        finally:
+            src.close()
+            dst.close()
+        copied = time.perf_counter()
+        with open(tmp, 'rb') as f_in, gzip.open(path + '.part', 'wb', compresslevel=COMPRESS_LEVEL) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(path + '.part', path)
+        done = time.perf_counter()
+        size = os.path.getsize(tmp)
+    finally:
+        for p in (tmp, path + '.part'):
+            if os.path.exists(p): os.remove(p)
+    rotate()
+    mb = size / 1e6
+    return {'path': path, 'bytes': size, 'compressed_bytes': os.path.getsize(path), 'seconds': round(done - t, 3),
+            'copy_mb_s': round(mb / max(copied - t, 1e-6), 1), 'total_mb_s': round(mb / max(done - t, 1e-6), 1)}
+
+def restore_snapshot(path, progress=None):
+    target = snapshot_target(os.path.basename(path))
+    fd, tmp = tempfile.mkstemp(suffix='.db', dir=backup_dir())
+    os.close(fd)
+    try:
+        t = time.perf_counter()
+        with gzip.open(path, 'rb') as f_in, open(tmp, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        # Keep a way back from the restore itself. Taken after the read, since its rotation
+        # may delete the snapshot being restored when that is the oldest.
+        create_snapshot('pre-restore', db_path=target)
+        src, dst = sqlite3.connect(tmp), sqlite3.connect(target)
+        try: copy_database(src, dst, progress)
+        finally:
+            src.close()
+            dst.close()
+        size = os.path.getsize(tmp)
+        seconds = time.perf_counter() - t
+    finally: os.remove(tmp)
+    return {'bytes': size, 'seconds': round(seconds, 3), 'mb_s': round(size / 1e6 / max(seconds, 1e-6), 1)}
+
+if __name__ == '__main__':
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if cmd == 'create':
+        for p in db.get_all_db_paths():
+            r = create_snapshot(sys.argv[2] if len(sys.argv) > 2 else 'manual', db_path=p)
+            print(f"{r['path']}: {r['bytes'] / 1e6:.1f} MB -> {r['compressed_bytes'] / 1e6:.1f} MB in {r['seconds']} s "
+                  f"(copy {r['copy_mb_s']} MB/s, overall {r['total_mb_s']} MB/s)")
+    elif cmd == 'restore':
+        r = restore_snapshot(sys.argv[2])
+        print(f"Restored {r['bytes'] / 1e6:.1f} MB in {r['seconds']} s ({r['mb_s']} MB/s)")
+    else:
+        for s in list_snapshots(): print(f"{s['name']}  {s['size'] / 1e6:.1f} MB")
@@ -0,0 +1,461 @@
+import os
+import csv
+import json
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+from datetime import date
+import database as db
+import anomalies
+
+# Benchmarks that need a real database. They run against a throwaway directory,
+# never the user's financify.db.
+
+def configure(base_dir, sharded):
+    db.DB_NAME = os.path.join(base_dir, 'financify.db')
+    db.SHARD_DIR = os.path.join(base_dir, 'shards')
+    db.SHARDED, db.SHARD_BUCKETS = sharded, 0
+    db._ready_shards.clear()
+
+def percentile(values, q):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def heavy_importer(base_dir, sharded, user_id, account_id, rows, batch, results):
+    # Same shape as a CSV import: long write transactions of many inserts each
+    configure(base_dir, sharded)
+    latencies, errors, done = [], 0, 0
+    start = time.perf_counter()
+    while done < rows:
+        conn = db.get_db_connection(user_id)
+        t = time.perf_counter()
+        try:
+            conn.execute("BEGIN")
+            for i in range(min(batch, rows - done)):
+                ok, msg, _ = db.add_transaction(user_id, account_id, f"2024-01-{i % 28 + 1:02d}", random.uniform(1, 500),
+                                                'Expense', 'Shopping', f"IMPORT {done + i}", '', conn)
+                if not ok: raise sqlite3.OperationalError(msg)
+            conn.commit()
+            done += batch
+        except sqlite3.OperationalError:
+            conn.rollback()
+            errors += 1
+        finally: conn.close()
+        latencies.append((time.perf_counter() - t) * 1000)
+    results.put(('heavy', done, time.perf_counter() - start, latencies, errors))
+
+def light_writer(base_dir, sharded, user_id, account_id, rows, results):
+    # Interactive use: one small committed write at a time
+    configure(base_dir, sharded)
+    latencies, errors, done = [], 0, 0
+    start = time.perf_counter()
+    for i in range(rows):
+        t = time.perf_counter()
+        ok, msg, _ = db.add_transaction(user_id, account_id, '2024-01-15', 12.5, 'Expense', 'Food', f"Coffee {i}", '')
+        latencies.append((time.perf_counter() - t) * 1000)
+        if ok: done += 1
+        elif 'locked' in msg: errors += 1
+        time.sleep(0.002)
+    results.put(('light', done, time.perf_counter() - start, latencies, errors))
+
+def setup_users(users):
+    ids = []
+    for n in range(users):
+        db.register_user(f"bench{n}", "bench-password", "bench")
+        ok, msg, uid = db.login_user(f"bench{n}", "bench-password")
+        ids.append((uid, db.get_accounts(uid)[0]['account_id']))
+    return ids
+
+def bench_concurrent_writes(sharded, users=6, heavy_rows=20000, light_rows=200, batch=5000):
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, sharded)
+        db.initialize_database()
+        accounts = setup_users(users)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=heavy_importer, args=(base_dir, sharded, *accounts[0], heavy_rows, batch, results))]
+        procs += [multiprocessing.Process(target=light_writer, args=(base_dir, sharded, uid, acc, light_rows, results)) for uid, acc in accounts[1:]]
+        start = time.perf_counter()
+        for p in procs: p.start()
+        out = [results.get() for _ in procs]
+        for p in procs: p.join()
+        wall = time.perf_counter() - start
+    light = [r for r in out if r[0] == 'light']
+    heavy = next(r for r in out if r[0] == 'heavy')
+    light_lat = [ms for r in light for ms in r[3]]
+    return {'mode': 'sharded' if sharded else 'shared', 'wall_s': round(wall, 2),
+            'rows_per_s': round((heavy[1] + sum(r[1] for r in light)) / wall),
+            'light_p50_ms': round(percentile(light_lat, 0.5), 2), 'light_p95_ms': round(percentile(light_lat, 0.95), 2),
+            'light_max_ms': round(max(light_lat, default=0.0), 2), 'lock_errors': heavy[4] + sum(r[4] for r in light)}
+
+# Peak RSS any transaction-list path may reach on a 1M-row ledger, interpreter and imports
+# included. full_list is the old fetch-everything path, measured for comparison only.
+RSS_TARGET_MB = 120
+MEMORY_ROWS = 1_000_000
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def fill_ledger(user_id, account_id, rows, batch=20000):
+    conn = db.get_db_connection(user_id)
+    words = ['Coffee', 'Groceries', 'Fuel', 'Rent', 'Cinema', 'Pharmacy', 'Books', 'Taxi']
+    for start in range(0, rows, batch):
+        db.insert_transactions_bulk(user_id, account_id, [
+            {'date': f"{2000 + i % 25}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", 'amount': (i % 5000) / 10 + 1, 'type': 'Expense' if i % 7 else 'Income',
+             'category': 'Shopping', 'description': f"{words[i % len(words)]} #{i}", 'tags': 'bench' if i % 10 == 0 else ''}
+            for i in range(start, min(rows, start + batch))], conn)
+        conn.commit()
+    conn.close()
+
+def step_refresh(user_id, base_dir):
+    ids = db.get_transaction_ids(user_id)
+    db.get_transactions_by_ids(user_id, ids[:200])
+
+def step_edit(user_id, base_dir):
+    t = db.get_transaction_by_id(user_id, MEMORY_ROWS // 2)
+    db.update_transaction(t['transaction_id'], user_id, {'date': t['date'], 'type': t['type'], 'amount': abs(t['amount']) + 1, 'account_id': t['account_id'],
+                                                          'category': t['category'], 'description': t['description']})
+
+def step_clone(user_id, base_dir):
+    t = db.get_transaction_by_id(user_id, MEMORY_ROWS // 3)
+    db.add_transaction(user_id, t['account_id'], t['date'], abs(t['amount']), t['type'], t['category'], t['description'] + " (Clone)", t['tags'])
+
+def step_export(user_id, base_dir):
+    with open(os.path.join(base_dir, 'export.csv'), 'w', newline='', encoding='utf-8') as f:
+        w = csv.DictWriter(f, fieldnames=db.TRANSACTION_FIELDS)
+        w.writeheader()
+        for r in db.iter_transactions(user_id): w.writerow(dict(r))
+
+def step_full_list(user_id, base_dir):
+    conn = db.get_db_connection(user_id)
+    conn.execute(db.TRANSACTION_SELECT + db.TRANSACTION_ORDER, (user_id,)).fetchall()
+    conn.close()
+
+MEMORY_STEPS = {'baseline': lambda user_id, base_dir: None, 'refresh': step_refresh, 'edit': step_edit, 'clone': step_clone,
+                'export': step_export, 'full_list': step_full_list}
+
+def memory_step(base_dir, step, user_id, results):
+    # Each step runs in a fresh process so its peak is its own
+    configure(base_dir, False)
+    t = time.perf_counter()
+    MEMORY_STEPS[step](user_id, base_dir)
+    results.put((step, round(peak_rss_mb(), 1), round(time.perf_counter() - t, 2)))
+
+def bench_memory(rows=MEMORY_ROWS):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        (user_id, account_id), = setup_users(1)
+        t = time.perf_counter()
+        fill_ledger(user_id, account_id, rows)
+        print(f"filled {rows} rows in {time.perf_counter() - t:.1f} s")
+        out = []
+        for step in MEMORY_STEPS:
+            results = ctx.Queue()
+            p = ctx.Process(target=memory_step, args=(base_dir, step, user_id, results))
+            p.start()
+            name, peak, secs = results.get()
+            p.join()
+            out.append({'step': name, 'peak_rss_mb': peak, 'seconds': secs,
+                        'target_mb': RSS_TARGET_MB if name != 'full_list' else '-', 'ok': peak <= RSS_TARGET_MB if name != 'full_list' else '-'})
+    return out
+
+# Mixed writers on one ledger. A short busy timeout makes lock contention surface as
+# begin_write retries instead of hiding inside SQLite's busy handler.
+STRESS_OPS = [('add', 60), ('update', 15), ('delete', 10), ('import', 10), ('transfer', 5)]
+STRESS_BUSY_TIMEOUT_S = 0.05
+
+def stress_op(op, user_id, accounts, mine):
+    acc = random.choice(accounts)
+    day = f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}"
+    if op == 'update' and mine:
+        return db.update_transaction(random.choice(mine), user_id, {'date': day, 'type': 'Expense', 'amount': random.uniform(1, 200),
+                                                                     'account_id': acc, 'category': 'Food', 'description': 'stress edit'})[0]
+    if op == 'delete' and mine:
+        return db.delete_transaction(mine.pop(random.randrange(len(mine))), user_id)[0]
+    if op == 'import':
+        conn = db.get_db_connection(user_id)
+        try:
+            db.insert_transactions_bulk(user_id, acc, [{'date': day, 'amount': random.uniform(1, 300), 'type': random.choice(['Expense', 'Income']),
+                                                        'category': 'Shopping', 'description': f"stress import {random.random()}", 'tags': ''} for _ in range(50)], conn)
+            conn.commit()
+        finally: conn.close()
+        return True
+    if op == 'transfer':
+        return db.add_transfer(user_id, accounts[0], accounts[1], day, random.uniform(1, 100), 'stress transfer')[0]
+    ok, msg, tid = db.add_transaction(user_id, acc, day, random.uniform(1, 200), random.choice(['Expense', 'Income']), 'Food', 'stress add', '')
+    if ok: mine.append(tid)
+    return ok
+
+def stress_thread(user_id, accounts, ops, outcomes):
+    mine = []
+    names, weights = zip(*STRESS_OPS)
+    for op in random.choices(names, weights, k=ops):
+        try: ok = stress_op(op, user_id, accounts, mine)
+        except sqlite3.OperationalError: ok = False
+        outcomes.append(ok)
+
+def stress_worker(base_dir, user_id, accounts, threads, ops, results):
+    configure(base_dir, False)
+    db.BUSY_TIMEOUT_S = STRESS_BUSY_TIMEOUT_S
+    outcomes = []
+    pool = [threading.Thread(target=stress_thread, args=(user_id, accounts, ops, outcomes)) for _ in range(threads)]
+    for t in pool: t.start()
+    for t in pool: t.join()
+    metrics = db.instrumentation.snapshot()
+    results.put((sum(outcomes), len(outcomes) - sum(outcomes), metrics.get('database.busy_retry', {}).get('count', 0), metrics.get('database.begin_write', {})))
+
+def rollup_drift(user_id):
+    conn = db.get_db_connection(user_id)
+    rows = conn.execute('''SELECT l.period FROM (SELECT strftime('%Y-%m', date) as period, round(SUM(amount), 2) as total FROM transactions
+                               WHERE user_id = ? AND is_transfer = 0 GROUP BY period) l
+                            LEFT JOIN (SELECT period, round(SUM(total), 2) as total FROM monthly_rollups WHERE user_id = ? GROUP BY period) r USING (period)
+                            WHERE abs(l.total - COALESCE(r.total, 0)) >= 0.005''', (user_id, user_id)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+def bench_stress(procs=4, threads=4, ops=250):
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        (user_id, account_id), = setup_users(1)
+        accounts = [account_id, db.add_account(user_id, 'Savings', 'Savings', db.currency.BASE_CURRENCY)[2]]
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=stress_worker, args=(base_dir, user_id, accounts, threads, ops, results)) for _ in range(procs)]
+        start = time.perf_counter()
+        for p in workers: p.start()
+        out = [results.get() for _ in workers]
+        for p in workers: p.join()
+        wall = time.perf_counter() - start
+        check = db.reconcile_balances(user_id)
+        drift = rollup_drift(user_id)
+    done, failed = sum(r[0] for r in out), sum(r[1] for r in out)
+    waits = [r[3] for r in out if r[3]]
+    return [{'writers': procs * threads, 'ops': done, 'failed': failed, 'wall_s': round(wall, 2), 'ops_per_s': round(done / wall),
+             'busy_retries': sum(r[2] for r in out), 'lock_wait_p95_ms': max((w['p95_ms'] for w in waits), default=0.0),
+             'lock_wait_max_ms': max((w['max_ms'] for w in waits), default=0.0), 'balance_mismatches': len(check['accounts']),
+             'broken_transfers': len(check['transfers']), 'rollup_drift': len(drift)}]
+
+# Each search filter and the index its plan has to use
+QUERY_PLANS = {'category:Food': 'idx_transactions_category', 'account:Savings': 'idx_transactions_account', 'date:2010-03': 'idx_transactions_listing',
+               'date:2010-01..2010-03': 'idx_transactions_listing', 'amount>450': 'idx_transactions_amount', 'amount:100..120': 'idx_transactions_amount',
+               'category:Food date:2010': 'idx_transactions_category', 'account:Savings date>=2020': 'idx_transactions_account',
+               'type:income date>=2024-06 -desc:Rent': 'idx_transactions_listing', '#bench': 'sqlite_autoindex_tags_1'}
+
+def bench_query_plans(rows=200_000):
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        (user_id, account_id), = setup_users(1)
+        savings = db.add_account(user_id, 'Savings', 'Savings', db.currency.BASE_CURRENCY)[2]
+        fill_ledger(user_id, account_id, rows)
+        conn = db.get_db_connection(user_id)
+        conn.execute("UPDATE transactions SET category_id = (SELECT category_id FROM categories WHERE user_id = ? AND name = 'Food') WHERE transaction_id % 11 = 0", (user_id,))
+        conn.execute("UPDATE transactions SET account_id = ? WHERE transaction_id % 13 = 0", (savings,))
+        conn.commit()
+        conn.close()
+        out = []
+        for term, index in QUERY_PLANS.items():
+            plan = db.explain_transaction_filter(user_id, term)
+            t = time.perf_counter()
+            n = len(db.get_transaction_ids(user_id, term))
+            out.append({'filter': repr(term), 'rows': n, 'ms': round((time.perf_counter() - t) * 1000, 1), 'index': index,
+                        'ok': any(index in step for step in plan), 'plan': repr(plan[0])})
+    return out
+
+def bench_statements(users=1000, rows=300, fmt='pdf', workers=None):
+    # Monthly statements for many users through the process pool. Peak RSS is the largest
+    # any worker reached, read from the finished children after the pool shuts down.
+    import resource
+    import charts
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        accounts = setup_users(users)
+        categories = ['Food', 'Rent', 'Transport', 'Utilities', 'Shopping', 'Health']
+        for n, (uid, acc) in enumerate(accounts):
+            conn = db.get_db_connection(uid)
+            db.insert_transactions_bulk(uid, acc, [{'date': f"2024-{i % 6 + 1:02d}-{i % 28 + 1:02d}", 'amount': 20 + (i * 37 + n) % 400,
+                                                    'type': 'Income' if i % 15 == 0 else 'Expense', 'category': categories[i % len(categories)],
+                                                    'description': f"row {i}", 'tags': ''} for i in range(rows)], conn)
+            conn.commit()
+            conn.close()
+            db.set_category_budget(uid, 'Food', 2000, 6, 2024)
+        t = time.perf_counter()
+        results = list(charts.render_statements([uid for uid, _ in accounts], 6, 2024, os.path.join(base_dir, 'out'), fmt, workers))
+        wall = time.perf_counter() - t
+    ms = [r[2] for r in results]
+    return [{'users': users, 'format': fmt, 'workers': workers or os.cpu_count(), 'wall_s': round(wall, 1), 'per_statement_p50_ms': round(percentile(ms, 0.5)),
+             'per_statement_p95_ms': round(percentile(ms, 0.95)), 'failed': sum(1 for r in results if r[3]),
+             'worker_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}]
+
+# The write paths with the audit log off and on, each on a fresh database: single adds, edits
+# and deletes as the app makes them, then a bulk import. Commit latency is mostly fsync and
+# noisy, so each write also reports the WAL pages it committed. With the log on, also how long
+# undoing one import batch and reading the ledger back as of the first batch take.
+AUDIT_OPS = ('add', 'edit', 'delete')
+
+def audit_workload(ops, rows):
+    (user_id, account_id), = setup_users(1)
+    latencies, pages, ids = {op: [] for op in AUDIT_OPS}, {op: [] for op in AUDIT_OPS}, []
+    probe = sqlite3.connect(db.DB_NAME)
+    def timed(op, fn, *args):
+        probe.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        t = time.perf_counter()
+        res = fn(*args)
+        latencies[op].append((time.perf_counter() - t) * 1000)
+        pages[op].append(probe.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()[1])
+        return res
+    for i in range(ops):
+        ids.append(timed('add', db.add_transaction, user_id, account_id, f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", 10 + i % 90, 'Expense', 'Food',
+                         f"audit add {i}", 'bench' if i % 5 == 0 else '')[2])
+    for i, tid in enumerate(ids):
+        timed('edit', db.update_transaction, tid, user_id, {'date': '2024-06-15', 'type': 'Expense', 'amount': 5 + i % 40, 'account_id': account_id,
+                                                            'category': 'Shopping', 'description': f"audit edit {i}"})
+    for tid in ids: timed('delete', db.delete_transaction, tid, user_id)
+    t = time.perf_counter()
+    fill_ledger(user_id, account_id, rows)
+    res = {f"{op}_p50_ms": round(percentile(v, 0.5), 3) for op, v in latencies.items()}
+    res.update({f"{op}_p95_ms": round(percentile(v, 0.95), 3) for op, v in latencies.items()})
+    res.update({f"{op}_wal_pages": round(sum(v) / len(v), 1) for op, v in pages.items()})
+    probe.close()
+    res['import_rows_per_s'] = round(rows / (time.perf_counter() - t))
+    res['db_mb'] = round(sum(os.path.getsize(db.DB_NAME + ext) for ext in ('', '-wal') if os.path.exists(db.DB_NAME + ext)) / 1e6, 1)
+    if db.AUDIT_LOG:
+        imports = [a['action_id'] for a in db.get_actions(user_id, limit=1000) if a['label'] == 'Import']
+        t = time.perf_counter()
+        ok, msg, _ = db.undo_action(user_id, imports[0])
+        res['undo_import_batch_s'] = round(time.perf_counter() - t, 2) if ok else msg
+        t = time.perf_counter()
+        n = sum(1 for _ in db.iter_ledger_at(user_id, imports[-1]))
+        res['ledger_at_first_batch_s'] = round(time.perf_counter() - t, 2)
+        res['ledger_at_rows'] = n
+    return res
+
+def bench_audit(ops=1000, rows=200_000):
+    out, enabled = [], db.AUDIT_LOG
+    try:
+        for audit in (False, True):
+            with tempfile.TemporaryDirectory() as base_dir:
+                configure(base_dir, False)
+                db.AUDIT_LOG = audit
+                db.initialize_database()
+                out.append({'audit': 'on' if audit else 'off', **audit_workload(ops, rows)})
+    finally: db.AUDIT_LOG = enabled
+    off, on = out
+    out.append({'audit': 'overhead', **{k: f"{(on[k] / off[k] - 1) * 100:+.0f}%" for k in off if k != 'audit'}})
+    return out
+
+def bench_categories(rows=200_000):
+    # Rename and merge change categories rows only, so their cost shouldn't grow with the ledger
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        (user_id, account_id), = setup_users(1)
+        fill_ledger(user_id, account_id, rows)
+        cats = {c['name']: c['category_id'] for c in db.get_categories(user_id)}
+        conn = db.get_db_connection(user_id)
+        conn.execute("UPDATE transactions SET category_id = json_extract(?, '$[' || (transaction_id % ?) || ']') WHERE user_id = ?",
+                     (json.dumps(list(cats.values())), len(cats), user_id))
+        conn.commit()
+        size = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ('transactions', 'idx_transactions_category') GROUP BY name").fetchall())
+        t = time.perf_counter()
+        conn.execute(f"SELECT {db.CATEGORY_NAME}, SUM(t.amount) FROM transactions t {db.CATEGORY_JOIN.format(t='t')} WHERE t.user_id = ? GROUP BY 1", (user_id,)).fetchall()
+        res = {'rows': rows, 'row_bytes': round(size['transactions'] / rows, 1), 'category_index_bytes': round(size['idx_transactions_category'] / rows, 1),
+               'group_by_ms': round((time.perf_counter() - t) * 1000, 1)}
+        conn.close()
+        food, groceries = (len(db.get_transaction_ids(user_id, f"category:{c}")) for c in ('Food', 'Groceries'))
+        t = time.perf_counter()
+        db.rename_category(user_id, cats['Food'], 'Eating')
+        res['rename_ms'] = round((time.perf_counter() - t) * 1000, 2)
+        t = time.perf_counter()
+        db.merge_category(user_id, cats['Groceries'], cats['Shopping'])
+        res['merge_ms'] = round((time.perf_counter() - t) * 1000, 2)
+        # Groceries was under Food; merged into Shopping it no longer counts there
+        t = time.perf_counter()
+        n = len(db.get_transaction_ids(user_id, 'category:Eating'))
+        res['search_ms'] = round((time.perf_counter() - t) * 1000, 1)
+        res['search_ok'] = n == food - groceries
+    return [res]
+
+def anomaly_rows(rng, merchants, start, count, total, planted):
+    # Expenses spread evenly over ten years; every 100,000th row is an outlier and gets a
+    # same-day repeat, both marked by a 7-digit reference in place of the usual 4
+    day0 = date(2016, 1, 1).toordinal()
+    rows = []
+    for i in range(start, start + count):
+        name, category, base = merchants[rng.randrange(len(merchants))]
+        day = date.fromordinal(day0 + i * 3650 // total).isoformat()
+        row = {'date': day, 'amount': round(base * rng.lognormvariate(0, 0.25), 2), 'type': 'Expense', 'category': category,
+               'description': f"{name} {rng.randint(1000, 9999)}", 'tags': ''}
+        if i % 100_000 == 99_500:
+            planted.append(f"{name} {9_000_000 + len(planted)}")
+            rows.append(dict(row, amount=round(base * 12, 2), description=planted[-1]))
+            planted.append(f"{name} {9_000_000 + len(planted)}")
+            row = dict(rows[-1], description=planted[-1])
+        rows.append(row)
+    return rows
+
+def insert_rows(user_id, account_id, rows, batch=20000):
+    conn = db.get_db_connection(user_id)
+    t = time.perf_counter()
+    for s in range(0, len(rows), batch):
+        db.insert_transactions_bulk(user_id, account_id, rows[s:s + batch], conn)
+        conn.commit()
+    elapsed = time.perf_counter() - t
+    conn.close()
+    return elapsed
+
+def bench_anomalies(rows=1_000_000, added=1000, batch_rows=100_000):
+    # The backfill over the whole ledger, the incremental scan after a day's worth of new
+    # rows, and what keeping spending_stats in triggers costs an import
+    rng = random.Random(48)
+    with tempfile.TemporaryDirectory() as base_dir:
+        configure(base_dir, False)
+        db.initialize_database()
+        (user_id, account_id), = setup_users(1)
+        categories = [c['name'] for c in db.get_categories(user_id) if c['name'] != db.TRANSFER_CATEGORY and not c['merged_into']]
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        merchants = [(''.join(rng.choice(letters) for _ in range(6)), rng.choice(categories), round(rng.lognormvariate(3, 1), 2)) for _ in range(200)]
+        planted = []
+        insert_rows(user_id, account_id, anomaly_rows(rng, merchants, 0, rows, rows, planted))
+        res = {'rows': rows}
+        t = time.perf_counter()
+        checked, flagged = anomalies.backfill(user_id)
+        res.update(backfill_s=round(time.perf_counter() - t, 2), checked=checked, flagged=flagged)
+        insert_rows(user_id, account_id, anomaly_rows(rng, merchants, rows - added, added, rows, planted))
+        t = time.perf_counter()
+        res['new_flags'] = anomalies.scan(user_id)
+        res['scan_ms'] = round((time.perf_counter() - t) * 1000, 1)
+        found = {(a['description'], a['kind']) for a in db.get_anomalies(user_id, limit=-1)}
+        res['planted_found'] = all((d, kind) in found for d, kind in zip(planted, ['outlier', 'duplicate'] * len(planted)))
+        # Import speed with the stats triggers, then without
+        more = anomaly_rows(rng, merchants, 0, 2 * batch_rows, rows, [])
+        res['import_rows_per_s'] = round(batch_rows / insert_rows(user_id, account_id, more[:batch_rows]))
+        conn = db.get_db_connection(user_id)
+        for op in ('ins', 'del', 'upd'): conn.execute(f"DROP TRIGGER trg_spending_stats_{op}")
+        conn.commit()
+        conn.close()
+        res['import_rows_per_s_no_stats'] = round(batch_rows / insert_rows(user_id, account_id, more[batch_rows:]))
+    return [res]
+
+BENCHMARKS = {'sharding': lambda: [bench_concurrent_writes(False), bench_concurrent_writes(True)], 'memory': bench_memory, 'stress': bench_stress, 'query': bench_query_plans,
+              'statements': bench_statements, 'audit': bench_audit, 'categories': bench_categories,
+              'anomalies': bench_anomalies}
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else ''
+    if name not in BENCHMARKS:
+        print(f"usage: python bench.py [{'|'.join(BENCHMARKS)}]")
+        sys.exit(1)
+    results = BENCHMARKS[name]()
+    for r in results: print(*(f"{k}={v}" for k, v in r.items()))
+    # Checks that missed (a query plan off its index, a memory target) fail the run for CI
+    if any(r.get('ok') is False for r in results): sys.exit(1)
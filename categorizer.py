@@ -0,0 +1,85 @@
+import re
+from collections import defaultdict
+import database as db
+
+# A pattern becomes a rule once it has been seen this often and almost always with one category
+MIN_SUPPORT = 2
+MIN_CONFIDENCE = 0.8
+FALLBACK_CATEGORIES = ('', 'other')
+
+TOKEN_RE = re.compile(r"[a-z][a-z&']{2,}")
+STOP_WORDS = {'the', 'and', 'for', 'from', 'payment', 'purchase', 'pos', 'upi', 'neft', 'imps', 'txn', 'ref', 'debit', 'credit', 'card', 'transfer', 'clone'}
+
+_matchers = {}
+
+def normalize(description):
+    return ' '.join(t for t in TOKEN_RE.findall(description.lower()) if t not in STOP_WORDS)
+
+def candidate_patterns(description):
+    tokens = normalize(description).split()
+    patterns = set(tokens)
+    # The leading pair of words is usually the merchant name ("amazon pay", "uber trip")
+    if len(tokens) >= 2: patterns.add(' '.join(tokens[:2]))
+    return patterns
+
+def learn_rules(user_id):
+    # Only from categories the user chose: learning from the importer's own guesses would entrench them
+    votes = defaultdict(lambda: defaultdict(int))
+    for row in db.get_category_training_data(user_id):
+        if row['category'].lower() in FALLBACK_CATEGORIES: continue
+        for p in candidate_patterns(row['description']):
+            votes[p][row['category']] += row['n']
+
+    rules = []
+    for pattern, cats in votes.items():
+        total = sum(cats.values())
+        category, hits = max(cats.items(), key=lambda kv: kv[1])
+        if total >= MIN_SUPPORT and hits / total >= MIN_CONFIDENCE:
+            rules.append((pattern, category, hits))
+
+    db.save_learned_rules(user_id, rules)
+    _matchers.pop(user_id, None)
+    return len(rules)
+
+def record_correction(user_id, description, category):
+    tokens = normalize(description or '').split()
+    if not tokens or not category: return
+    db.set_category_rule(user_id, ' '.join(tokens[:2]), category)
+    _matchers.pop(user_id, None)
+
+class Matcher:
+    # All patterns are compiled into one alternation so each description is scanned once,
+    # whatever the number of rules. Overlaps are settled by rank: manual > longer > more hits.
+    def __init__(self, rules):
+        self.lookup = {}
+        for r in rules:
+            rank = (r['source'] == 'manual', r['pattern'].count(' '), r['hits'])
+            self.lookup[r['pattern']] = (rank, r['category'])
+        patterns = sorted(self.lookup, key=len, reverse=True)
+        self.regex = re.compile(r'\b(?:%s)\b' % '|'.join(map(re.escape, patterns))) if patterns else None
+
+    def __len__(self): return len(self.lookup)
+
+    def match(self, description):
+        if not self.regex or not description: return None
+        best = None
+        for m in self.regex.finditer(normalize(description)):
+            hit = self.lookup[m.group(0)]
+            if best is None or hit[0] > best[0]: best = hit
+        return best[1] if best else None
+
+def get_matcher(user_id):
+    matcher = _matchers.get(user_id)
+    if matcher is None:
+        rules = db.get_category_rules(user_id)
+        # Manual rules alone (a correction before the first import) still leave the rest to learn
+        if not any(r['source'] == 'learned' for r in rules):
+            learn_rules(user_id)
+            rules = db.get_category_rules(user_id)
+        matcher = _matchers[user_id] = Matcher(rules)
+    return matcher
+
+def categorize(matcher, category, description):
+    if category and category.strip().lower() not in FALLBACK_CATEGORIES: return category.strip(), False
+    found = matcher.match(description)
+    return (found, True) if found else ('Other', False)
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import calendar
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from matplotlib.figure import Figure
+import database as db
+import analytics
+import currency
+
+# Chart drawing on a plain Axes, shared by the GUI panels and headless statements. Nothing
+# here picks a backend: the panels put the Figure on a WXAgg canvas, savefig picks Agg,
+# SVG or PDF from the file format.
+
+PALETTE = ['#3498DB', '#E74C3C', '#2ECC71', '#F1C40F', '#9B59B6', '#E67E22', '#1ABC9C', '#34495E']
+INCOME_COLOR, EXPENSE_COLOR, NET_COLOR, REMAINING_COLOR = '#27AE60', '#C0392B', '#1565C0', '#BDC3C7'
+FORMATS = ('pdf', 'png', 'svg')
+PAGE_SIZE = (8.27, 11.69)          # A4 portrait, inches
+STATEMENT_DPI = 100
+TASKS_PER_WORKER = 250             # workers are replaced after this many statements, capping their memory
+
+def draw_budget_pie(ax, expense_data, total_budget, projected=None):
+    labels = [r['category'] for r in expense_data]
+    sizes = [r['total'] for r in expense_data]
+    colors = [PALETTE[i % len(PALETTE)] for i in range(len(sizes))]
+    suffix = f"\nProjected: {currency.fmt(projected, decimals=0)}" if projected is not None else ""
+    if total_budget > 0:
+        remaining = total_budget - sum(sizes)
+        if remaining > 0:
+            labels.append("Remaining")
+            sizes.append(remaining)
+            colors.append(REMAINING_COLOR)
+        ax.set_title(f'Monthly Budget: {currency.fmt(total_budget, decimals=0)}' + suffix)
+    else:
+        ax.set_title('Spending Breakdown' + suffix)
+
+    if not sizes:
+        ax.text(0.5, 0.5, 'No Data', ha='center', va='center')
+        return
+    autopct = lambda pct: '%1.1f%%' % pct if pct > 5 else ''
+    wedges, texts, autotexts = ax.pie(sizes, labels=None, autopct=autopct, startangle=90, colors=colors)
+    ax.legend(wedges, labels, title="Categories", loc="center left", bbox_to_anchor=(0.9, 0, 0.5, 1))
+
+def draw_trend(ax, series):
+    if not any(series['income']) and not any(series['expense']):
+        ax.text(0.5, 0.5, 'No Data Available', ha='center')
+        return
+    x = range(len(series['periods']))
+    width = 0.35
+    ax.bar([i - width / 2 for i in x], series['income'], width, label='Income', color=INCOME_COLOR)
+    ax.bar([i + width / 2 for i in x], series['expense'], width, label='Expense', color=EXPENSE_COLOR)
+    ax.plot(list(x), series['net'], color=NET_COLOR, marker='o', markersize=3, label='Net')
+    ax.set_ylabel(f'Amount ({currency.BASE_CURRENCY})')
+    ax.set_title('Income vs Expenses Trend')
+    ax.set_xticks(list(x))
+    # Not autofmt_xdate: on a multi-chart page it hides the labels of all but the bottom row
+    ax.set_xticklabels(series['periods'], rotation=30, ha='right')
+    ax.legend()
+
+def draw_budget_table(ax, budgets):
+    ax.axis('off')
+    rows = [[b['category'], currency.fmt(b['budget']) if b['budget'] else '-', currency.fmt(b['spent']),
+             currency.fmt(b['budget'] - b['spent']) if b['budget'] else '-'] for b in sorted(budgets, key=lambda b: -b['spent'])]
+    if not rows:
+        ax.text(0.5, 0.5, 'No spending this month', ha='center', va='center')
+        return
+    table = ax.table(cellText=rows, colLabels=['Category', 'Budget', 'Spent', 'Left'], loc='upper center', cellLoc='left')
+    table.auto_set_font_size(False)
+    table.set_fontsize(9)
+    for i, b in enumerate(sorted(budgets, key=lambda b: -b['spent']), start=1):
+        if b['budget'] and b['spent'] > b['budget']: table[i, 3].get_text().set_color(EXPENSE_COLOR)
+
+def statement_data(user_id, month, year):
+    last_day = date(year, month, calendar.monthrange(year, month)[1])
+    return {'username': db.get_username(user_id), 'numbers': db.get_dashboard_numbers(user_id, month, year),
+            'expenses': db.get_expense_data_for_pie_chart(user_id, month, year),
+            'budgets': db.get_category_budgets_with_spending(user_id, month, year),
+            'series': analytics.get_display_series(user_id, 6, 'month', today=last_day)}
+
+def draw_statement(fig, data, month, year):
+    n = data['numbers']
+    fig.suptitle(f"{data['username']}: statement for {calendar.month_name[month]} {year}", fontsize=14, fontweight='bold')
+    fig.text(0.08, 0.905, f"Income {currency.fmt(n['income'])}    Spent {currency.fmt(n['spent'])}    Net {currency.fmt(n['net'])}"
+             + (f"    Budget {currency.fmt(n['budget'])}" if n['budget'] else ""), fontsize=10)
+    grid = fig.add_gridspec(3, 1, height_ratios=[1.1, 1, 1], hspace=0.45, top=0.87, bottom=0.06, left=0.1, right=0.8)
+    draw_budget_pie(fig.add_subplot(grid[0]), data['expenses'], n['budget'])
+    draw_trend(fig.add_subplot(grid[1]), data['series'])
+    draw_budget_table(fig.add_subplot(grid[2]), data['budgets'])
+
+def render_statement(user_id, month, year, path, fig=None):
+    # Pass fig to reuse one Figure across statements; it is cleared, not rebuilt
+    fig = fig or Figure(figsize=PAGE_SIZE)
+    fig.clear()
+    draw_statement(fig, statement_data(user_id, month, year), month, year)
+    fig.savefig(path, dpi=STATEMENT_DPI)
+    return path
+
+_figure = None
+
+def _init_worker(db_name, shard_dir, sharded, buckets):
+    global _figure
+    db.DB_NAME, db.SHARD_DIR, db.SHARDED, db.SHARD_BUCKETS = db_name, shard_dir, sharded, buckets
+    _figure = Figure(figsize=PAGE_SIZE)
+
+def _render_task(user_id, month, year, path):
+    t = time.perf_counter()
+    try:
+        render_statement(user_id, month, year, path, _figure)
+        return user_id, path, (time.perf_counter() - t) * 1000, None
+    except Exception as e:
+        return user_id, None, (time.perf_counter() - t) * 1000, str(e)
+
+def statement_path(out_dir, user_id, month, year, fmt):
+    return os.path.join(out_dir, f"statement-{year}-{month:02d}-user{user_id}.{fmt}")
+
+def render_statements(user_ids, month, year, out_dir, fmt='pdf', workers=None):
+    # Yields (user_id, path, ms, error) in order. Spawned workers start clean of the parent's
+    # GUI backend. Each batch gets a fresh pool, so no worker renders more than about
+    # TASKS_PER_WORKER statements (max_tasks_per_child can hang the pool on Python 3.11).
+    if fmt not in FORMATS: raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+    os.makedirs(out_dir, exist_ok=True)
+    user_ids, workers = list(user_ids), workers or os.cpu_count()
+    batch = TASKS_PER_WORKER * workers
+    for start in range(0, len(user_ids), batch):
+        ids = user_ids[start:start + batch]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                                 initargs=(db.DB_NAME, db.SHARD_DIR, db.SHARDED, db.SHARD_BUCKETS)) as pool:
+            paths = [statement_path(out_dir, uid, month, year, fmt) for uid in ids]
+            yield from pool.map(_render_task, ids, [month] * len(ids), [year] * len(ids), paths)
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    opts = dict(a[2:].split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+    if len(args) < 3 or args[0] != 'statements':
+        print("usage: python charts.py statements YYYY-MM out_dir [--format=pdf|png|svg] [--workers=N] [--users=1,2,3]")
+        sys.exit(1)
+    year, month = (int(p) for p in args[1].split('-'))
+    db.initialize_database()
+    users = [int(u) for u in opts['users'].split(',')] if 'users' in opts else db.get_user_ids()
+    t, failed = time.perf_counter(), 0
+    for uid, path, ms, error in render_statements(users, month, year, args[2], opts.get('format', 'pdf'), int(opts['workers']) if 'workers' in opts else None):
+        if error:
+            failed += 1
+            print(f"user {uid}: {error}")
+    print(f"{len(users) - failed} statements in {time.perf_counter() - t:.1f} s, {failed} failed")
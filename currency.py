@@ -0,0 +1,91 @@
+import os
+import sys
+import csv
+import numpy as np
+
+# Amounts are stored in their account's currency; totals are shown in the base currency.
+BASE_CURRENCY = os.environ.get('FINANCIFY_BASE_CURRENCY', 'INR').upper()
+SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'AUD': 'A$', 'CAD': 'C$', 'SGD': 'S$', 'CHF': 'CHF ', 'AED': 'AED '}
+CURRENCIES = sorted(SYMBOLS)
+
+def symbol(code=None):
+    code = code or BASE_CURRENCY
+    return SYMBOLS.get(code, code + ' ')
+
+def fmt(amount, code=None, decimals=2):
+    return f"{symbol(code)}{amount:.{decimals}f}"
+
+def day_numbers(days):
+    return np.array(days, dtype='datetime64[D]').astype(np.int64)
+
+class RateCache:
+    # Rates to the base currency as sorted day/rate arrays per currency, so converting a column
+    # of rollup totals is a searchsorted per currency however long the history is. Daily
+    # periods use the latest rate on or before the day, monthly periods the month's average.
+    def __init__(self, rows, base=BASE_CURRENCY):
+        self.base, self.series, self.missing = base, {}, set()
+        grouped = {}
+        for code, quote, day, rate in rows: grouped.setdefault((code, quote), []).append((day, rate))
+        self.pairs = {}
+        for pair, points in grouped.items():
+            points.sort()
+            self.pairs[pair] = (day_numbers([d for d, _ in points]), np.array([r for _, r in points], dtype=float))
+
+    def build(self, code):
+        if (code, self.base) in self.pairs: return self.pairs[(code, self.base)]
+        if (self.base, code) in self.pairs:
+            days, rates = self.pairs[(self.base, code)]
+            return days, 1.0 / rates
+        # Cross rate through a shared quote currency, e.g. USD->EUR and INR->EUR for USD->INR
+        for (c, quote), (days, rates) in self.pairs.items():
+            if c == code and (self.base, quote) in self.pairs:
+                b_days, b_rates = self.pairs[(self.base, quote)]
+                return days, rates / b_rates[np.clip(np.searchsorted(b_days, days, 'right') - 1, 0, None)]
+        return None
+
+    def get(self, code):
+        if code not in self.series:
+            s = self.build(code)
+            self.series[code] = s and (s[0], s[1], np.concatenate(([0.0], np.cumsum(s[1]))))
+        return self.series[code]
+
+    def factors(self, code, periods):
+        s = self.get(code)
+        if s is None:
+            self.missing.add(code)
+            return np.ones(len(periods))
+        days, rates, cum = s
+        if len(periods[0]) == 7:
+            months = np.array(periods, dtype='datetime64[M]')
+            lo = np.searchsorted(days, months.astype('datetime64[D]').astype(np.int64), 'left')
+            hi = np.searchsorted(days, (months + 1).astype('datetime64[D]').astype(np.int64), 'left')
+            carried = rates[np.clip(lo - 1, 0, None)]
+            return np.where(hi > lo, (cum[hi] - cum[lo]) / np.maximum(hi - lo, 1), carried)
+        return rates[np.clip(np.searchsorted(days, day_numbers(periods), 'right') - 1, 0, None)]
+
+    def to_base(self, totals, currencies, periods):
+        out = np.array(totals, dtype=float)
+        if not len(out): return out
+        currencies, periods = np.array(currencies, dtype=object), np.array(periods, dtype=object)
+        for code in set(currencies.tolist()) - {self.base}:
+            mask = currencies == code
+            out[mask] *= self.factors(code, periods[mask].tolist())
+        return out
+
+def read_rates_file(path, quote=BASE_CURRENCY):
+    # CSV with date,currency,rate[,quote] meaning 1 currency = rate quote on that date
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.lower().strip() for name in reader.fieldnames]
+        for r in reader:
+            if not r.get('rate'): continue
+            yield r['currency'].strip().upper(), (r.get('quote') or quote).strip().upper(), r['date'].strip(), float(r['rate'])
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'load':
+        print("usage: python currency.py load rates.csv [quote currency]")
+        sys.exit(1)
+    import database as db
+    db.initialize_database()
+    n = db.save_fx_rates(read_rates_file(sys.argv[2], (sys.argv[3] if len(sys.argv) > 3 else BASE_CURRENCY).upper()))
+    print(f"Loaded {n} rates")
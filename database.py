@@ -1,18 +1,132 @@
 import sqlite3
 import hashlib
+import json
 import os
+import time
+from array import array
 from datetime import datetime
+import instrumentation
+import currency
+import query
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_NAME = os.path.join(BASE_DIR, 'financify.db')
 SECRET_SALT = "s0m3_r4nd0m_s4lt_v4lu3" 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Optional per-user storage: FINANCIFY_STORAGE=sharded keeps the users table in DB_NAME and
+# each user's ledger in its own file under shards/; FINANCIFY_SHARDS=N groups users into N files
+SHARDED = os.environ.get('FINANCIFY_STORAGE') == 'sharded'
+SHARD_BUCKETS = int(os.environ.get('FINANCIFY_SHARDS', '0'))
+SHARD_DIR = os.path.join(BASE_DIR, 'shards')
+_ready_shards = set()
+
+# Called on every new app connection; maintenance uses it to back off from long reads
+CONNECT_HOOKS = []
+# How long a connection waits on a locked database, and how often begin_write retries after that
+BUSY_TIMEOUT_S = 5.0
+WRITE_RETRIES = 10
+# Exchange rates to the base currency, built on first use and dropped when rates are loaded
+_rate_cache = None
+
+# Per-period totals kept in sync with transactions by triggers: table -> period expression
+ROLLUPS = {'monthly_rollups': "strftime('%Y-%m', {d})", 'daily_rollups': "date({d})"}
+# A description's merchant: without trailing reference numbers, so "ACME 0412" and "ACME #0519"
+# are one merchant. SQL so the spending_stats triggers can use it; see anomalies.py
+MERCHANT = "lower(rtrim(trim({d}), '0123456789#*/-.: '))"
+
+# Audit log: triggers record each change to these tables as the row before the change, under the
+# action begin_write opened for it; changes made outside an action aren't logged. table -> (key columns, owning user). FINANCIFY_AUDIT=off drops
+# the triggers, for benchmarks only: undo and iter_ledger_at can't see past a gap in the log.
+AUDIT_LOG = os.environ.get('FINANCIFY_AUDIT') != 'off'
+AUDITED = {'transactions': (('transaction_id',), "{r}.user_id"), 'transfers': (('transfer_id',), "{r}.user_id"),
+           'tags': (('tag_id',), "{r}.user_id"), 'transaction_tags': (('transaction_id', 'tag_id'), "(SELECT user_id FROM tags WHERE tag_id = {r}.tag_id)"),
+           'categories': (('category_id',), "{r}.user_id"), 'budgets': (('budget_id',), "{r}.user_id"), 'budget_alerts': (('alert_id',), "{r}.user_id"),
+           'category_rules': (('rule_id',), "{r}.user_id"), 'recurring_rules': (('rule_id',), "{r}.user_id")}
+# Most writes to these happen outside any action (budget edits, the scheduler advancing next_due):
+# an update is logged, checked and undone only for these columns, which merges and moves change
+AUDIT_UPDATE_COLUMNS = {t: ('category_id',) for t in ('budgets', 'budget_alerts', 'category_rules', 'recurring_rules')}
+
+# Categories a new user starts with, as (name, parent)
+DEFAULT_CATEGORIES = [('Food', None), ('Groceries', 'Food'), ('Transport', None), ('Rent', None), ('Utilities', None), ('Salary', None),
+                      ('Entertainment', None), ('Shopping', None), ('Health', None), ('Education', None), ('Other', None)]
+TRANSFER_CATEGORY = 'Transfer'
+
+def get_db_path(user_id=None):
+    if not SHARDED or user_id is None: return DB_NAME
+    name = f"bucket_{user_id % SHARD_BUCKETS}" if SHARD_BUCKETS else f"user_{user_id}"
+    return os.path.join(SHARD_DIR, name + '.db')
+
+def get_user_db_paths(user_id):
+    return list(dict.fromkeys([DB_NAME, get_db_path(user_id)]))
+
+def get_all_db_paths():
+    if not SHARDED or not os.path.isdir(SHARD_DIR): return [DB_NAME]
+    return [DB_NAME] + sorted(os.path.join(SHARD_DIR, n) for n in os.listdir(SHARD_DIR) if n.endswith('.db'))
+
+class read_snapshot:
+    # A read transaction giving a multi-query report or export one point-in-time view. Under
+    # WAL, writes carry on meanwhile and the snapshot doesn't see them
+    def __init__(self, user_id=None): self.user_id = user_id
+
+    def __enter__(self):
+        self.conn = get_db_connection(self.user_id)
+        t = time.perf_counter()
+        self.conn.execute("BEGIN")
+        # The snapshot is fixed by the first read, not by BEGIN
+        self.conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+        self.opened = time.perf_counter()
+        instrumentation.record('snapshot.lock_wait', (self.opened - t) * 1000)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.rollback()
+        self.conn.close()
+        # How long the view was held; old snapshots keep the WAL from being checkpointed
+        instrumentation.record('snapshot.age', (time.perf_counter() - self.opened) * 1000)
+
+def get_db_connection(user_id=None):
+    path = get_db_path(user_id)
+    if path != DB_NAME and path not in _ready_shards: initialize_shard(path)
+    if instrumentation.SQL_TRACE: conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, factory=instrumentation.TracedConnection)
+    else: conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S)
     conn.row_factory = sqlite3.Row
+    for hook in CONNECT_HOOKS: hook()
     return conn
 
+def begin_write(conn, user_id=None, action=None, resume=None):
+    # Every read-modify-write takes the write lock before its first read. Under WAL a
+    # transaction that reads and then writes can't wait for the lock: it fails outright
+    # if another writer committed in between. action labels the transaction in the audit
+    # log (writes without one go unlogged); a caller already in a transaction has opened its own.
+    # resume is an action an earlier transaction opened, for work committed in parts (imports);
+    # returns the action the changes are logged under.
+    if conn.in_transaction: return None
+    for attempt in range(WRITE_RETRIES):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == WRITE_RETRIES - 1: raise
+            instrumentation.record('database.busy_retry', 0)
+            time.sleep(min(0.5, 0.005 * 2 ** attempt))
+    # The marker an earlier action left behind; it only counts in the transaction that set it
+    if AUDIT_LOG: conn.execute("DELETE FROM audit_open")
+    _category_ids.clear()
+    if resume and AUDIT_LOG:
+        conn.execute("INSERT INTO audit_open (action_id) VALUES (?)", (resume,))
+        return resume
+    if action: return _log_action(conn, user_id, action)
+    return None
+
+def _log_action(conn, user_id, label, undoes=None):
+    # The triggers file each change under the action in audit_open, which is this one until the next begin_write
+    if not AUDIT_LOG: return None
+    action_id = conn.execute("INSERT INTO audit_actions (user_id, at, label, undoes) VALUES (?, ?, ?, ?)",
+                             (user_id, datetime.now().isoformat(timespec='seconds'), label, undoes)).lastrowid
+    conn.execute("INSERT OR REPLACE INTO audit_open (action_id) VALUES (?)", (action_id,))
+    return action_id
+
 def hash_data(data):
     salted = data + SECRET_SALT
     return hashlib.sha256(salted.encode()).hexdigest()
@@ -20,26 +134,201 @@ def hash_data(data):
 def verify_hash(stored_hash, provided_data):
     return stored_hash == hash_data(provided_data)
 
-def initialize_database():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Updated Users Table with Security Question
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            security_hash TEXT NOT NULL
-        )
-    ''')
-    
+def create_rollup(cursor, table, period):
+    # Totals stay in the account's currency; readers convert them with the rate cache
+    columns = {r[1] for r in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+    trigger = cursor.execute("SELECT sql FROM sqlite_master WHERE name = ?", (f"trg_{table}_ins",)).fetchone()
+    if trigger and 'is_transfer' not in trigger[0]:
+        # Triggers from before transfers; there are no transfer rows yet, so the totals stand
+        for t in ('ins', 'del', 'upd'): cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{t}")
+    if columns and not {'currency', 'category_id'} <= columns:
+        # Rollups from before currencies or category ids: derived data, so drop and rebuild below
+        for t in ('ins', 'del', 'upd'): cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{t}")
+        cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+        user_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        total REAL DEFAULT 0,
+        n INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, period, category_id, type, currency)
+    ) WITHOUT ROWID''')
+
+    # Transfer legs move money between accounts and are neither income nor expense
+    new_cur, old_cur = "(SELECT currency FROM accounts WHERE account_id = NEW.account_id)", "(SELECT currency FROM accounts WHERE account_id = OLD.account_id)"
+    add = f'''INSERT INTO {table} (user_id, period, category_id, type, currency, total, n) SELECT NEW.user_id, {period.format(d='NEW.date')}, NEW.category_id, NEW.type, {new_cur}, NEW.amount, 1 WHERE NEW.is_transfer = 0
+        ON CONFLICT (user_id, period, category_id, type, currency) DO UPDATE SET total = round(total + excluded.total, 2), n = n + 1;'''
+    remove = f'''UPDATE {table} SET total = round(total - OLD.amount, 2), n = n - 1
+        WHERE user_id = OLD.user_id AND period = {period.format(d='OLD.date')} AND category_id = OLD.category_id AND type = OLD.type AND currency = {old_cur} AND OLD.is_transfer = 0;
+        DELETE FROM {table} WHERE user_id = OLD.user_id AND period = {period.format(d='OLD.date')} AND category_id = OLD.category_id AND type = OLD.type AND currency = {old_cur} AND n <= 0;'''
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_ins AFTER INSERT ON transactions BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_del AFTER DELETE ON transactions BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_upd AFTER UPDATE OF user_id, account_id, date, amount, type, category_id, is_transfer ON transactions BEGIN {remove} {add} END")
+
+    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+    if not cursor.fetchone(): rebuild_rollup(cursor, table, period)
+
+def rebuild_rollup(cursor, table, period):
+    cursor.execute(f"DELETE FROM {table}")
+    cursor.execute(f'''INSERT INTO {table} (user_id, period, category_id, type, currency, total, n)
+        SELECT t.user_id, {period.format(d='t.date')}, t.category_id, t.type, a.currency, round(SUM(t.amount), 2), COUNT(*)
+        FROM transactions t JOIN accounts a ON a.account_id = t.account_id WHERE t.is_transfer = 0 GROUP BY 1, 2, 3, 4, 5''')
+
+def shift_rollup(cursor, table, period, user_id, account_id, sign):
+    # Adds (sign 1) or takes out (sign -1) one account's rows, under the account's currency now
+    cursor.execute(f'''INSERT INTO {table} (user_id, period, category_id, type, currency, total, n)
+        SELECT t.user_id, {period.format(d='t.date')}, t.category_id, t.type, a.currency, round(? * SUM(t.amount), 2), ? * COUNT(*)
+        FROM transactions t JOIN accounts a ON a.account_id = t.account_id WHERE t.user_id = ? AND t.account_id = ? AND t.is_transfer = 0 GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (user_id, period, category_id, type, currency) DO UPDATE SET total = round(total + excluded.total, 2), n = n + excluded.n''',
+                   (sign, sign, user_id, account_id))
+    cursor.execute(f"DELETE FROM {table} WHERE user_id = ? AND n <= 0", (user_id,))
+
+def create_anomaly_tables(cursor):
+    # Expense counts, sums and sums of squares per category, merchant, currency and month, kept
+    # by triggers like the rollups. Sums, unlike running means, can take an edited or deleted
+    # row back out, and a window of months is a range of rows.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS spending_stats (
+        user_id INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        merchant TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        period TEXT NOT NULL,
+        n INTEGER DEFAULT 0,
+        total REAL DEFAULT 0,
+        total_sq REAL DEFAULT 0,
+        PRIMARY KEY (user_id, category_id, merchant, currency, period)
+    ) WITHOUT ROWID''')
+    key = lambda r: (f"{r}.user_id, {r}.category_id, {MERCHANT.format(d=r + '.description')}, "
+                     f"(SELECT currency FROM accounts WHERE account_id = {r}.account_id), strftime('%Y-%m', {r}.date)")
+    add = f'''INSERT INTO spending_stats (user_id, category_id, merchant, currency, period, n, total, total_sq)
+        SELECT {key('NEW')}, 1, abs(NEW.amount), NEW.amount * NEW.amount WHERE NEW.type = 'Expense' AND NEW.is_transfer = 0
+        ON CONFLICT (user_id, category_id, merchant, currency, period) DO UPDATE SET n = n + 1, total = total + excluded.total, total_sq = total_sq + excluded.total_sq;'''
+    match = f"(user_id, category_id, merchant, currency, period) = ({key('OLD')})"
+    remove = f'''UPDATE spending_stats SET n = n - 1, total = total - abs(OLD.amount), total_sq = total_sq - OLD.amount * OLD.amount
+        WHERE {match} AND OLD.type = 'Expense' AND OLD.is_transfer = 0;
+        DELETE FROM spending_stats WHERE {match} AND n <= 0;'''
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_spending_stats_ins AFTER INSERT ON transactions BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_spending_stats_del AFTER DELETE ON transactions BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_spending_stats_upd AFTER UPDATE OF user_id, account_id, date, amount, type, category_id, description, is_transfer "
+                   f"ON transactions BEGIN {remove} {add} END")
+    cursor.execute("SELECT 1 FROM spending_stats LIMIT 1")
+    if not cursor.fetchone(): rebuild_spending_stats(cursor)
+
+    # Flagged expenses: kind 'outlier' with score (spreads above the usual amount) and baseline
+    # (that usual amount), or 'duplicate' with related_id, the earlier charge
+    cursor.execute('''CREATE TABLE IF NOT EXISTS anomalies (
+        transaction_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        score REAL,
+        baseline REAL,
+        related_id INTEGER,
+        dismissed INTEGER DEFAULT 0,
+        PRIMARY KEY (transaction_id, kind)
+    ) WITHOUT ROWID''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_user ON anomalies(user_id, dismissed)")
+    # How far the incremental scan has got
+    cursor.execute('''CREATE TABLE IF NOT EXISTS anomaly_scans (
+        user_id INTEGER PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        scanned_at TEXT
+    )''')
+
+def rebuild_spending_stats(cursor):
+    cursor.execute("DELETE FROM spending_stats")
+    cursor.execute(f'''INSERT INTO spending_stats (user_id, category_id, merchant, currency, period, n, total, total_sq)
+        SELECT t.user_id, t.category_id, {MERCHANT.format(d='t.description')}, a.currency, strftime('%Y-%m', t.date), COUNT(*), SUM(abs(t.amount)), SUM(t.amount * t.amount)
+        FROM transactions t JOIN accounts a ON a.account_id = t.account_id WHERE t.type = 'Expense' AND t.is_transfer = 0 GROUP BY 1, 2, 3, 4, 5''')
+
+def shift_spending_stats(cursor, user_id, account_id, sign):
+    # As shift_rollup, for spending_stats
+    cursor.execute(f'''INSERT INTO spending_stats (user_id, category_id, merchant, currency, period, n, total, total_sq)
+        SELECT t.user_id, t.category_id, {MERCHANT.format(d='t.description')}, a.currency, strftime('%Y-%m', t.date), ? * COUNT(*), ? * SUM(abs(t.amount)), ? * SUM(t.amount * t.amount)
+        FROM transactions t JOIN accounts a ON a.account_id = t.account_id WHERE t.user_id = ? AND t.account_id = ? AND t.type = 'Expense' AND t.is_transfer = 0 GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (user_id, category_id, merchant, currency, period) DO UPDATE SET n = n + excluded.n, total = total + excluded.total, total_sq = total_sq + excluded.total_sq''',
+                   (sign, sign, sign, user_id, account_id))
+    cursor.execute("DELETE FROM spending_stats WHERE user_id = ? AND n <= 0", (user_id,))
+
+def table_columns(cursor, table):
+    return [r[1] for r in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def audit_triggers(cursor):
+    # name -> CREATE TRIGGER, built from the current columns. A logged row is a JSON array of its
+    # values in column order: half the size of an object, and still readable after ADD COLUMN,
+    # which only appends. Inserts log just the key, enough to take the row out again.
+    triggers = {}
+    for table, (keys, owner) in AUDITED.items():
+        columns = table_columns(cursor, table)
+        for op, event, ref in (('I', 'INSERT', 'NEW'), ('U', 'UPDATE', 'OLD'), ('D', 'DELETE', 'OLD')):
+            logged = keys[1:] if op == 'I' else columns
+            data = "json_array(" + ", ".join(f"{ref}.{c}" for c in logged) + ")" if logged else "NULL"
+            name = f"trg_audit_{table}_{op.lower()}"
+            tracked = AUDIT_UPDATE_COLUMNS.get(table) if op == 'U' else None
+            when = " WHEN " + " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in tracked) if tracked else ""
+            triggers[name] = (f"CREATE TRIGGER {name} AFTER {event} ON {table}{when} BEGIN "
+                              f"INSERT INTO audit_log (action_id, seq, tbl, op, row_id, data) SELECT a.action_id, "
+                              f"COALESCE((SELECT MAX(seq) FROM audit_log WHERE action_id = a.action_id), 0) + 1, '{table}', '{op}', {ref}.{keys[0]}, {data} "
+                              f"FROM audit_open o JOIN audit_actions a ON a.action_id = o.action_id WHERE a.user_id = {owner.format(r=ref)}; END")
+    return triggers
+
+def create_audit_log(cursor):
+    # One row per user operation, and the rows it changed. Undo is a new action, never an edit
+    # here. No secondary indexes: each is another page written on every commit, and the log's
+    # key already groups changes by action in order.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS audit_actions (
+        action_id INTEGER PRIMARY KEY, -- not AUTOINCREMENT, which writes sqlite_sequence too; actions are never deleted
+        user_id INTEGER NOT NULL,
+        at TEXT NOT NULL,
+        label TEXT NOT NULL,
+        undoes INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS audit_log (
+        action_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        tbl TEXT NOT NULL,
+        op TEXT NOT NULL, -- I, U or D
+        row_id INTEGER NOT NULL,
+        data TEXT, -- JSON array of the row's values before an update or delete; for an insert the other key columns, if any
+        PRIMARY KEY (action_id, seq)
+    ) WITHOUT ROWID''')
+    # The action the current write transaction opened, if any: begin_write empties it and _log_action fills it
+    cursor.execute("CREATE TABLE IF NOT EXISTS audit_open (action_id INTEGER PRIMARY KEY)")
+    existing = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_audit_%'").fetchall())
+    wanted = audit_triggers(cursor) if AUDIT_LOG else {}
+    for name, sql in existing.items():
+        if wanted.get(name) != sql: cursor.execute(f"DROP TRIGGER {name}")
+    for name, sql in wanted.items():
+        if existing.get(name) != sql: cursor.execute(sql)
+
+def create_ledger_schema(cursor):
+    # The last action's marker outlives its commit; cleared so the migrations below go unlogged
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'audit_open'").fetchone(): cursor.execute("DELETE FROM audit_open")
     cursor.execute('''CREATE TABLE IF NOT EXISTS accounts (
         account_id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         account_name TEXT NOT NULL,
         account_type TEXT,
         current_balance REAL DEFAULT 0,
+        currency TEXT NOT NULL DEFAULT 'INR',
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    # Accounts from before currencies were all rupees
+    if 'currency' not in {r[1] for r in cursor.execute("PRAGMA table_info(accounts)").fetchall()}:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN currency TEXT NOT NULL DEFAULT 'INR'")
+
+    # Category names once per user, like tags; everything else holds the id, so a rename is one
+    # row. A merged category stays on as an alias of the one it went into: its rows and its name
+    # in imports count toward that one without being rewritten.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS categories (
+        category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL COLLATE NOCASE,
+        parent_id INTEGER REFERENCES categories(category_id),
+        merged_into INTEGER REFERENCES categories(category_id),
+        UNIQUE(user_id, name),
         FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
     )''')
     
@@ -50,23 +339,302 @@ def initialize_database():
         date TEXT NOT NULL,
         amount REAL NOT NULL,
         type TEXT NOT NULL,
-        category TEXT NOT NULL,
         description TEXT,
-        tags TEXT,
+        tags TEXT, -- unused, tags live in transaction_tags
+        fingerprint INTEGER,
+        fingerprint_seq INTEGER,
+        transfer_id INTEGER REFERENCES transfers(transfer_id),
+        is_transfer INTEGER NOT NULL DEFAULT 0,
+        category_id INTEGER REFERENCES categories(category_id),
+        category_auto INTEGER NOT NULL DEFAULT 0, -- 1 while the category is the importer's guess
         FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
         FOREIGN KEY (account_id) REFERENCES accounts(account_id)
     )''')
+    # Rows are unique by content hash plus occurrence number, so two identical coffees on one day
+    # are (hash, 1) and (hash, 2) and re-importing the same statement collides on both
+    if 'fingerprint' not in {r[1] for r in cursor.execute("PRAGMA table_info(transactions)").fetchall()}:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN fingerprint INTEGER")
+        cursor.execute("ALTER TABLE transactions ADD COLUMN fingerprint_seq INTEGER")
+        started, t = datetime.now(), time.perf_counter()
+        repeats = backfill_fingerprints(cursor)
+        # Rows that were already exact copies stay, numbered as repeats; `python maintenance.py` lists this
+        cursor.execute("INSERT INTO maintenance_log (task, started_at, duration_ms, result) VALUES ('fingerprint_backfill', ?, ?, ?)",
+                       (started.isoformat(timespec='seconds'), round((time.perf_counter() - t) * 1000, 3), f"{repeats} duplicate rows kept as repeats"))
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fingerprint ON transactions(fingerprint, fingerprint_seq) WHERE fingerprint IS NOT NULL")
+
+    # A transfer is one row here plus two linked legs in transactions: a debit on the source
+    # account and a credit on the destination, in each account's own currency
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transfers (
+        transfer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        from_account_id INTEGER NOT NULL,
+        to_account_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        amount REAL NOT NULL,
+        to_amount REAL NOT NULL,
+        description TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (from_account_id) REFERENCES accounts(account_id),
+        FOREIGN KEY (to_account_id) REFERENCES accounts(account_id)
+    )''')
+    if 'transfer_id' not in {r[1] for r in cursor.execute("PRAGMA table_info(transactions)").fetchall()}:
+        cursor.execute("ALTER TABLE transactions ADD COLUMN transfer_id INTEGER REFERENCES transfers(transfer_id)")
+        cursor.execute("ALTER TABLE transactions ADD COLUMN is_transfer INTEGER NOT NULL DEFAULT 0")
+    if 'category' in table_columns(cursor, 'transactions'): migrate_transaction_categories(cursor)
+    # Rows imported before this can't be told apart and count as set by the user
+    if 'category_auto' not in table_columns(cursor, 'transactions'):
+        cursor.execute("ALTER TABLE transactions ADD COLUMN category_auto INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_flow ON transactions(user_id, is_transfer, date)")
+    # Newest-first listing is an index walk rather than a sort of the whole ledger
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_listing ON transactions(user_id, date DESC, transaction_id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_transfer ON transactions(transfer_id) WHERE transfer_id IS NOT NULL")
+    # For search filters: category and account equality, each then by date, and amount ranges
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions(user_id, category_id, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(user_id, account_id, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions(user_id, abs(amount))")
+
+    # Tag names once per user plus a join table; its primary key answers "transactions with
+    # tag X" and the second index "tags of transaction Y"
+    new_tags = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'tags'").fetchone() is None
+    cursor.execute('''CREATE TABLE IF NOT EXISTS tags (
+        tag_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL COLLATE NOCASE,
+        UNIQUE(user_id, name),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transaction_tags (
+        tag_id INTEGER NOT NULL,
+        transaction_id INTEGER NOT NULL,
+        PRIMARY KEY (tag_id, transaction_id),
+        FOREIGN KEY (tag_id) REFERENCES tags(tag_id) ON DELETE CASCADE,
+        FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id) ON DELETE CASCADE
+    ) WITHOUT ROWID''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transaction_tags_txn ON transaction_tags(transaction_id)")
+    cursor.execute("CREATE TRIGGER IF NOT EXISTS trg_transaction_tags_del AFTER DELETE ON transactions BEGIN DELETE FROM transaction_tags WHERE transaction_id = OLD.transaction_id; END")
+    if new_tags: migrate_tag_text(cursor)
     
+    # Budgets and alerts keyed by category name are set aside, and copied into the tables below
+    legacy = [t for t in ('budgets', 'budget_alerts') if 'category' in table_columns(cursor, t)]
+    for table in legacy: cursor.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+    # No category is the budget for the whole month; it gets its own unique index, as NULLs
+    # never conflict in the table's
     cursor.execute('''CREATE TABLE IF NOT EXISTS budgets (
         budget_id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
-        category TEXT NOT NULL,
+        category_id INTEGER REFERENCES categories(category_id),
         amount REAL NOT NULL,
         month INTEGER NOT NULL,
         year INTEGER NOT NULL,
-        UNIQUE(user_id, category, month, year),
+        alert_levels TEXT, -- percentages like '50,90'; NULL uses the defaults in alerts.py
+        UNIQUE(user_id, category_id, month, year),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_budgets_month ON budgets(user_id, month, year) WHERE category_id IS NULL")
+    # One row per budget threshold crossed, so each alert is shown once per month
+    cursor.execute('''CREATE TABLE IF NOT EXISTS budget_alerts (
+        alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        category_id INTEGER REFERENCES categories(category_id), -- NULL for the month's budget
+        level INTEGER NOT NULL,
+        spent REAL NOT NULL,
+        budget REAL NOT NULL,
+        fired_at TEXT NOT NULL,
+        UNIQUE(user_id, period, category_id, level),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_budget_alerts_month ON budget_alerts(user_id, period, level) WHERE category_id IS NULL")
+    for table in legacy: migrate_legacy_budgets(cursor, table)
+
+    # Auto-categorization rules: learned from history or set by the user on edit
+    cursor.execute('''CREATE TABLE IF NOT EXISTS category_rules (
+        rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        pattern TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        source TEXT DEFAULT 'learned',
+        category_id INTEGER REFERENCES categories(category_id),
+        UNIQUE(user_id, pattern),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    if 'category' in table_columns(cursor, 'category_rules'): migrate_category_names(cursor, 'category_rules')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS recurring_rules (
+        rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        account_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        type TEXT NOT NULL,
+        description TEXT,
+        frequency TEXT NOT NULL,
+        interval INTEGER DEFAULT 1,
+        anchor_day INTEGER NOT NULL,
+        next_due TEXT NOT NULL,
+        end_date TEXT,
+        active INTEGER DEFAULT 1,
+        category_id INTEGER REFERENCES categories(category_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+    )''')
+    if 'category' in table_columns(cursor, 'recurring_rules'): migrate_category_names(cursor, 'recurring_rules')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recurring_due ON recurring_rules(user_id, next_due) WHERE active = 1")
+
+    # One row per materialized occurrence, so re-running the scheduler never posts twice
+    cursor.execute('''CREATE TABLE IF NOT EXISTS recurring_occurrences (
+        rule_id INTEGER NOT NULL,
+        due_date TEXT NOT NULL,
+        transaction_id INTEGER,
+        PRIMARY KEY (rule_id, due_date),
+        FOREIGN KEY (rule_id) REFERENCES recurring_rules(rule_id) ON DELETE CASCADE
+    )''')
+
+    # Checkpointed CSV imports, keyed by file content so a finished file is never re-read
+    cursor.execute('''CREATE TABLE IF NOT EXISTS import_jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        file_hash TEXT NOT NULL,
+        file_name TEXT,
+        byte_offset INTEGER DEFAULT 0,
+        rows_done INTEGER DEFAULT 0,
+        added INTEGER DEFAULT 0,
+        skipped INTEGER DEFAULT 0,
+        auto INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'running',
+        updated_at TEXT,
+        action_id INTEGER, -- every part of the import is logged under this one action
+        UNIQUE(user_id, file_hash),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )''')
+    if 'action_id' not in table_columns(cursor, 'import_jobs'): cursor.execute("ALTER TABLE import_jobs ADD COLUMN action_id INTEGER")
+
+    # Column mappings for bank exports that don't use our CSV headers; column names are lowercase
+    cursor.execute('''CREATE TABLE IF NOT EXISTS import_profiles (
+        profile_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        date_col TEXT NOT NULL,
+        amount_col TEXT,
+        debit_col TEXT,
+        credit_col TEXT,
+        description_col TEXT,
+        category_col TEXT,
+        type_col TEXT,
+        date_format TEXT,
+        invert_sign INTEGER DEFAULT 0,
+        UNIQUE(user_id, name),
         FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
     )''')
+
+    for table, period in ROLLUPS.items(): create_rollup(cursor, table, period)
+    create_anomaly_tables(cursor)
+    create_audit_log(cursor)
+
+def backfill_fingerprints(cursor):
+    seen, updates = {}, []
+    for r in cursor.execute("SELECT transaction_id, account_id, date, amount, description FROM transactions ORDER BY transaction_id").fetchall():
+        fp = _fingerprint(r[1], r[2], r[3], r[4])
+        seen[fp] = seen.get(fp, 0) + 1
+        updates.append((fp, seen[fp], r[0]))
+    cursor.executemany("UPDATE transactions SET fingerprint = ?, fingerprint_seq = ? WHERE transaction_id = ?", updates)
+    return sum(n - 1 for n in seen.values())
+
+def migrate_tag_text(cursor):
+    # Comma-separated tags from the old free-text column
+    for tid, uid, text in cursor.execute("SELECT transaction_id, user_id, tags FROM transactions WHERE tags IS NOT NULL AND tags != ''").fetchall():
+        _tag_transactions(cursor, uid, [tid], parse_tags(text))
+    cursor.execute("UPDATE transactions SET tags = NULL WHERE tags IS NOT NULL")
+
+def migrate_category_names(cursor, table):
+    # A category name column becomes an id; names differing only in case become one category
+    cursor.execute(f"INSERT OR IGNORE INTO categories (user_id, name) SELECT DISTINCT user_id, category FROM {table}")
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN category_id INTEGER REFERENCES categories(category_id)")
+    cursor.execute(f"UPDATE {table} SET category_id = (SELECT category_id FROM categories c WHERE c.user_id = {table}.user_id AND c.name = {table}.category)")
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN category")
+
+def migrate_transaction_categories(cursor):
+    # The index and triggers naming the old column go first; the rollups are rebuilt and the
+    # triggers recreated further on. With the audit triggers gone the rewrite isn't logged.
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_category")
+    for name, in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_audit_%'").fetchall():
+        cursor.execute(f"DROP TRIGGER {name}")
+    for table in ROLLUPS:
+        for t in ('ins', 'del', 'upd'): cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{t}")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    columns = table_columns(cursor, 'transactions')
+    # New users get the defaults at registration; existing ones get the names the old form offered
+    cursor.execute("INSERT OR IGNORE INTO categories (user_id, name) SELECT a.user_id, d.value FROM (SELECT DISTINCT user_id FROM accounts) a, json_each(?) d",
+                   (json.dumps([name for name, _ in DEFAULT_CATEGORIES]),))
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'audit_log'").fetchone():
+        # Logged rows are arrays in column order: the name comes out and the id goes on the end,
+        # as they will be in the table
+        user, name = (f"json_extract(data, '$[{columns.index(c)}]')" for c in ('user_id', 'category'))
+        where = "WHERE tbl = 'transactions' AND op != 'I'"
+        cursor.execute(f"INSERT OR IGNORE INTO categories (user_id, name) SELECT DISTINCT {user}, {name} FROM audit_log {where}")
+        cursor.execute(f"UPDATE audit_log SET data = json_remove(json_insert(data, '$[#]', (SELECT category_id FROM categories c WHERE c.user_id = {user} AND c.name = {name})), "
+                       f"'$[{columns.index('category')}]') {where}")
+    migrate_category_names(cursor, 'transactions')
+
+def migrate_legacy_budgets(cursor, table):
+    # From a legacy_ table keyed by name; the old '##TOTAL##' name is no category, the month's budget
+    old = f"legacy_{table}"
+    columns = [c for c in table_columns(cursor, old) if c != 'category']
+    cursor.execute(f"INSERT OR IGNORE INTO categories (user_id, name) SELECT DISTINCT user_id, category FROM {old} WHERE category != '##TOTAL##'")
+    cursor.execute(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}, category_id) SELECT {', '.join('o.' + c for c in columns)}, "
+                   f"(SELECT category_id FROM categories c WHERE c.user_id = o.user_id AND c.name = o.category AND o.category != '##TOTAL##') FROM {old} o")
+    cursor.execute(f"DROP TABLE {old}")
+
+def create_maintenance_log(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS maintenance_log (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        result TEXT
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_maintenance_task ON maintenance_log(task, started_at)")
+
+def initialize_shard(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    create_maintenance_log(cursor)
+    create_ledger_schema(cursor)
+    conn.commit()
+    conn.close()
+    _ready_shards.add(path)
+
+def initialize_database():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Only takes effect on a new file; existing databases are converted with `python maintenance.py convert`
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Readers see a snapshot and never block writers (see read_snapshot); persists in the file
+    cursor.execute("PRAGMA journal_mode = WAL")
+    
+    # Updated Users Table with Security Question
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            security_hash TEXT NOT NULL
+        )
+    ''')
+    
+    create_maintenance_log(cursor)
+    # Shared reference data: 1 unit of currency = rate units of quote on that date
+    cursor.execute('''CREATE TABLE IF NOT EXISTS fx_rates (
+        currency TEXT NOT NULL,
+        quote TEXT NOT NULL,
+        date TEXT NOT NULL,
+        rate REAL NOT NULL,
+        PRIMARY KEY (currency, quote, date)
+    ) WITHOUT ROWID''')
+    # In sharded mode the ledger tables live in the per-user files instead
+    if not SHARDED: create_ledger_schema(cursor)
     
     conn.commit()
     conn.close()
@@ -89,8 +657,14 @@ def register_user(username, password, security_ans):
                        (username, p_hash, s_hash))
         new_id = cursor.lastrowid
         
-        cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (?, ?, ?, ?)", 
-                       (new_id, 'Checking', 'Checking', 0))
+        ledger = get_db_connection(new_id) if SHARDED else conn
+        begin_write(ledger)
+        ledger.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance, currency) VALUES (?, ?, ?, ?, ?)", 
+                       (new_id, 'Checking', 'Checking', 0, currency.BASE_CURRENCY))
+        _add_default_categories(ledger.cursor(), new_id)
+        if ledger is not conn:
+            ledger.commit()
+            ledger.close()
         conn.commit()
         return True, "Success"
     except sqlite3.IntegrityError:
@@ -116,6 +690,12 @@ def login_user(username, password):
         return True, "Success", user['user_id']
     return False, "Invalid credentials", None
 
+def get_user_ids():
+    conn = get_db_connection()
+    res = [r[0] for r in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+    conn.close()
+    return res
+
 def get_username(user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -150,58 +730,358 @@ def reset_password(username, new_password):
         conn.close()
 
 # --- HELPER FUNCTIONS ---
-def check_and_create_default_account(user_id):
+def get_rate_cache():
+    global _rate_cache
+    if _rate_cache is None: _rate_cache = currency.RateCache(get_fx_rates())
+    return _rate_cache
+
+def convert_rollups(rows):
+    # Rows need period, currency and total; returns the totals in the base currency
+    return get_rate_cache().to_base([r['total'] for r in rows], [r['currency'] for r in rows], [r['period'] for r in rows])
+
+def sum_by(rows, totals, key):
+    res = {}
+    for r, t in zip(rows, totals): res[r[key]] = res.get(r[key], 0.0) + float(t)
+    return res
+
+def convert_amount(amount, src, dst, day):
+    # None when either currency has no rates
+    if src == dst: return amount
+    cache = get_rate_cache()
+    if any(c != cache.base and cache.get(c) is None for c in (src, dst)): return None
+    rate = lambda c: 1.0 if c == cache.base else float(cache.factors(c, [day])[0])
+    return round(amount * rate(src) / rate(dst), 2)
+
+def get_fx_rates():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT currency, quote, date, rate FROM fx_rates")
+    res = [tuple(r) for r in cursor.fetchall()]
+    conn.close()
+    return res
+
+def get_fx_summary():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT currency, quote, MIN(date) as first, MAX(date) as last, COUNT(*) as days FROM fx_rates GROUP BY currency, quote")
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def save_fx_rates(rows):
+    global _rate_cache
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO fx_rates (currency, quote, date, rate) VALUES (?, ?, ?, ?)", rows)
+    n = cursor.rowcount
+    conn.commit()
+    conn.close()
+    _rate_cache = None
+    return n
+
+def check_and_create_default_account(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    begin_write(conn)
     cursor.execute("SELECT 1 FROM accounts WHERE user_id = ?", (user_id,))
     if not cursor.fetchone():
-        cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance) VALUES (?, ?, ?, ?)", (user_id, 'Checking', 'Checking', 0))
-        conn.commit()
+        cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance, currency) VALUES (?, ?, ?, ?, ?)", (user_id, 'Checking', 'Checking', 0, currency.BASE_CURRENCY))
+        _add_default_categories(cursor, user_id)
+    conn.commit()
     conn.close()
 
 def get_accounts(user_id):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("SELECT account_id, account_name, current_balance FROM accounts WHERE user_id = ?", (user_id,))
+    cursor.execute("SELECT account_id, account_name, account_type, current_balance, currency FROM accounts WHERE user_id = ?", (user_id,))
     data = cursor.fetchall()
     conn.close()
     return data
 
+def add_account(user_id, name, acc_type, code):
+    if not name: return False, "Account name is required", None
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO accounts (user_id, account_name, account_type, current_balance, currency) VALUES (?, ?, ?, 0, ?)", (user_id, name, acc_type, code))
+    conn.commit()
+    conn.close()
+    return True, "Added", cursor.lastrowid
+
+def set_account_currency(account_id, user_id, code):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn)
+        # The rollups key totals by currency: the account's rows move from the old one to the new
+        for table, period in ROLLUPS.items(): shift_rollup(cursor, table, period, user_id, account_id, -1)
+        shift_spending_stats(cursor, user_id, account_id, -1)
+        cursor.execute("UPDATE accounts SET currency = ? WHERE account_id = ? AND user_id = ?", (code, account_id, user_id))
+        for table, period in ROLLUPS.items(): shift_rollup(cursor, table, period, user_id, account_id, 1)
+        shift_spending_stats(cursor, user_id, account_id, 1)
+        conn.commit()
+        return True, "Updated"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally: conn.close()
+
 def wipe_user_data(user_id):
-    conn = get_db_connection()
+    import backup
+    backup.create_snapshot('pre-wipe', db_path=get_db_path(user_id))
+    conn = get_db_connection(user_id)
+    begin_write(conn, user_id, "Reset all data")
     cursor = conn.cursor()
     cursor.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM transfers WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM tags WHERE user_id = ?", (user_id,))
     cursor.execute("DELETE FROM budgets WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM budget_alerts WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM recurring_occurrences WHERE rule_id IN (SELECT rule_id FROM recurring_rules WHERE user_id = ?)", (user_id,))
+    cursor.execute("DELETE FROM recurring_rules WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM import_jobs WHERE user_id = ?", (user_id,))
     cursor.execute("UPDATE accounts SET current_balance = 0 WHERE user_id = ?", (user_id,))
     conn.commit()
     conn.close()
 
+# --- CATEGORY FUNCTIONS ---
+# A category name as the canonical id, for use as a value in SQL with params (user_id, name);
+# the name of an alias gives the category it was merged into
+CATEGORY_ID = "(SELECT COALESCE(merged_into, category_id) FROM categories WHERE user_id = ? AND name = ?)"
+# Joined to a table holding category_id, {t} being its alias; CATEGORY_NAME is then the name a
+# row shows under, which for a merged category's rows is the one it went into
+CATEGORY_JOIN = "JOIN categories c ON c.category_id = {t}.category_id LEFT JOIN categories cm ON cm.category_id = c.merged_into"
+CATEGORY_NAME = "COALESCE(cm.name, c.name)"
+
+def _add_categories(cursor, user_id, names):
+    # Creates the names not seen before; CATEGORY_ID then finds them
+    cursor.executemany("INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)", [(user_id, n) for n in names])
+
+def _add_default_categories(cursor, user_id):
+    _add_categories(cursor, user_id, [name for name, _ in DEFAULT_CATEGORIES])
+    cursor.executemany(f"UPDATE categories SET parent_id = {CATEGORY_ID} WHERE user_id = ? AND name = ?",
+                       [(user_id, parent, user_id, name) for name, parent in DEFAULT_CATEGORIES if parent])
+
+def get_categories(user_id, conn_ext=None):
+    # Every category, aliases included (merged_into set), with the parent's name
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT c.category_id, c.name, c.parent_id, p.name as parent, c.merged_into FROM categories c
+                      LEFT JOIN categories p ON p.category_id = c.parent_id WHERE c.user_id = ? ORDER BY c.name''', (user_id,))
+    data = cursor.fetchall()
+    if not conn_ext: conn.close()
+    return data
+
+def get_category_usage(user_id):
+    # category_id -> transactions filed under it or its aliases, from the rollups
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT COALESCE(c.merged_into, c.category_id), SUM(r.n) FROM monthly_rollups r JOIN categories c ON c.category_id = r.category_id
+                      WHERE r.user_id = ? GROUP BY 1''', (user_id,))
+    res = {r[0]: r[1] for r in cursor.fetchall()}
+    conn.close()
+    return res
+
+# (user_id, names) -> get_category_ids result; any write in this process may change it, so begin_write empties it
+_category_ids = {}
+
+def get_category_ids(user_id, names):
+    # The named categories' ids, then their subcategories' and aliases', down the tree; only
+    # those with transactions (transfers too), so an empty subcategory doesn't widen the search
+    if not names: return []
+    key = (user_id, tuple(names))
+    if key in _category_ids: return _category_ids[key]
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f'''WITH RECURSIVE tree(id) AS (SELECT COALESCE(merged_into, category_id) FROM categories WHERE user_id = ? AND name IN ({", ".join("?" * len(names))})
+                       UNION SELECT c.category_id FROM categories c JOIN tree ON tree.id IN (c.parent_id, c.merged_into) WHERE c.user_id = ?)
+                      SELECT id FROM tree WHERE EXISTS (SELECT 1 FROM transactions t WHERE t.user_id = ? AND t.category_id = tree.id)''',
+                   [user_id] + list(names) + [user_id, user_id])
+    res = _category_ids[key] = [r[0] for r in cursor.fetchall()]
+    conn.close()
+    return res
+
+def category_chains(categories):
+    # Lowercased name -> (the name its rows count under, then that one's parents up to the top),
+    # from get_categories rows
+    by_id = {c['category_id']: c for c in categories}
+    res = {}
+    for c in categories:
+        k, chain = by_id.get(c['merged_into'], c), []
+        while k and k['name'] not in chain:
+            chain.append(k['name'])
+            k = by_id.get(k['parent_id'])
+        res[c['name'].lower()] = tuple(chain)
+    return res
+
+def category_path(category, categories):
+    # "Food > Groceries" for display
+    by_id = {c['category_id']: c for c in categories}
+    names, k = [], category
+    while k and k['name'] not in names:
+        names.insert(0, k['name'])
+        k = by_id.get(k['parent_id'])
+    return " > ".join(names)
+
+def _category_write(user_id, label, fn):
+    # Runs fn(cursor) as one logged write; fn returns (ok, msg)
+    conn = get_db_connection(user_id)
+    try:
+        begin_write(conn, user_id, label)
+        ok, msg = fn(conn.cursor())
+        if ok: conn.commit()
+        else: conn.rollback()
+        return ok, msg
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False, "A category with that name already exists; merge into it instead"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally: conn.close()
+
+def _live_category(cursor, user_id, category_id):
+    cursor.execute("SELECT * FROM categories WHERE category_id = ? AND user_id = ? AND merged_into IS NULL", (category_id, user_id))
+    return cursor.fetchone()
+
+def add_category(user_id, name, parent_id=None):
+    name = (name or '').strip()
+    if not name: return False, "Category name is required"
+    def add(cursor):
+        if parent_id and not _live_category(cursor, user_id, parent_id): return False, "Parent not found"
+        cursor.execute("INSERT INTO categories (user_id, name, parent_id) VALUES (?, ?, ?)", (user_id, name, parent_id))
+        return True, "Added"
+    return _category_write(user_id, f"Add category {name}", add)
+
+def rename_category(user_id, category_id, name):
+    # One row: transactions, budgets and rules hold the id
+    name = (name or '').strip()
+    if not name: return False, "Category name is required"
+    def rename(cursor):
+        cursor.execute("UPDATE categories SET name = ? WHERE category_id = ? AND user_id = ?", (name, category_id, user_id))
+        return (True, "Renamed") if cursor.rowcount else (False, "Not found")
+    return _category_write(user_id, f"Rename category to {name}", rename)
+
+def set_category_parent(user_id, category_id, parent_id=None):
+    def move(cursor):
+        if not _live_category(cursor, user_id, category_id): return False, "Not found"
+        k = parent_id
+        while k:
+            if k == category_id: return False, "A category can't go under itself or its own subcategories"
+            row = _live_category(cursor, user_id, k)
+            if not row: return False, "Parent not found"
+            k = row['parent_id']
+        cursor.execute("UPDATE categories SET parent_id = ? WHERE category_id = ?", (parent_id, category_id))
+        return True, "Moved"
+    return _category_write(user_id, "Move category", move)
+
+def merge_category(user_id, source_id, target_id):
+    # source becomes an alias of target. Its transactions and rollups keep pointing at it and
+    # read as target through CATEGORY_JOIN, so this touches categories, budgets and rules only.
+    def merge(cursor):
+        source, target = _live_category(cursor, user_id, source_id), _live_category(cursor, user_id, target_id)
+        if not source or not target or source_id == target_id: return False, "Choose two different categories"
+        # Merging into one of its own subcategories: that one takes its place in the tree first
+        k = target
+        while k and k['parent_id']:
+            if k['parent_id'] == source_id:
+                cursor.execute("UPDATE categories SET parent_id = ? WHERE category_id = ?", (source['parent_id'], target_id))
+                break
+            k = _live_category(cursor, user_id, k['parent_id'])
+        cursor.execute("UPDATE categories SET merged_into = ?, parent_id = NULL WHERE user_id = ? AND (category_id = ? OR merged_into = ?)", (target_id, user_id, source_id, source_id))
+        cursor.execute("UPDATE categories SET parent_id = ? WHERE user_id = ? AND parent_id = ?", (target_id, user_id, source_id))
+        # A month both have a budget for keeps target's
+        for table in ('budgets', 'budget_alerts'):
+            cursor.execute(f"UPDATE OR IGNORE {table} SET category_id = ? WHERE user_id = ? AND category_id = ?", (target_id, user_id, source_id))
+            cursor.execute(f"DELETE FROM {table} WHERE user_id = ? AND category_id = ?", (user_id, source_id))
+        for table in ('category_rules', 'recurring_rules'):
+            cursor.execute(f"UPDATE {table} SET category_id = ? WHERE user_id = ? AND category_id = ?", (target_id, user_id, source_id))
+        return True, f"Merged {source['name']} into {target['name']}"
+    return _category_write(user_id, "Merge categories", merge)
+
 # --- TRANSACTION FUNCTIONS ---
-def check_transaction_exists(user_id, date, amount, description, conn):
+# A transaction as the UI and exports see it
+TRANSACTION_FIELDS = ('transaction_id', 'date', 'type', 'amount', 'category', 'description', 'account_name', 'account_id', 'currency', 'transfer_id', 'tags')
+TRANSACTION_SELECT = f'''SELECT t.transaction_id, t.date, t.type, t.amount, {CATEGORY_NAME} as category, t.description, a.account_name, t.account_id, a.currency, t.transfer_id,
+    (SELECT GROUP_CONCAT(g.name, ', ') FROM transaction_tags tt JOIN tags g ON g.tag_id = tt.tag_id WHERE tt.transaction_id = t.transaction_id) as tags
+    FROM transactions t JOIN accounts a ON t.account_id = a.account_id {CATEGORY_JOIN.format(t='t')} WHERE t.user_id = ?'''
+TRANSACTION_ORDER = " ORDER BY t.date DESC, t.transaction_id DESC"
+FETCH_ROWS = 1000
+
+def signed_amount(amount, trans_type):
+    amt = abs(float(amount))
+    return round(-amt if trans_type == 'Expense' else amt, 2)
+
+def _fingerprint(account_id, date, amount, description):
+    # 64-bit hash of the normalized row; amount is the signed value as stored
+    key = f"{account_id}|{date}|{amount:.2f}|{' '.join((description or '').lower().split())}"
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+def _next_fingerprint_seq(cursor, fp):
+    cursor.execute("SELECT COALESCE(MAX(fingerprint_seq), 0) + 1 FROM transactions WHERE fingerprint = ?", (fp,))
+    return cursor.fetchone()[0]
+
+def insert_transactions_bulk(user_id, account_id, rows, conn, seen=None):
+    # The k-th copy of a row within one import gets fingerprint_seq k, so rows already in the
+    # ledger hit the unique index and ON CONFLICT drops them. seen carries the copy counts
+    # across batches. Returns the indexes of the rows actually inserted.
+    seen = {} if seen is None else seen
+    params, keys = [], {}
+    for i, r in enumerate(rows):
+        amt = signed_amount(r['amount'], r['type'])
+        fp = _fingerprint(account_id, r['date'], amt, r['description'])
+        seen[fp] = seen.get(fp, 0) + 1
+        keys[(fp, seen[fp])] = i
+        params.append((user_id, account_id, r['date'], amt, r['type'], user_id, r['category'], int(r.get('category_auto', 0)), r['description'], fp, seen[fp]))
+    # The balance update and the result below select by transaction_id > last, which only
+    # covers this batch while no one else can insert
+    begin_write(conn, user_id, "Import")
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions")
+    last = cursor.fetchone()[0]
+    _add_categories(cursor, user_id, {r['category'] for r in rows})
+    cursor.executemany("INSERT INTO transactions (user_id, account_id, date, amount, type, category_id, category_auto, description, fingerprint, fingerprint_seq) "
+                       f"VALUES (?, ?, ?, ?, ?, {CATEGORY_ID}, ?, ?, ?, ?) ON CONFLICT DO NOTHING", params)
+    # One set-based balance update for the whole batch instead of a read and write per row
+    cursor.execute("UPDATE accounts SET current_balance = round(current_balance + (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE transaction_id > ? AND account_id = ?), 2) WHERE account_id = ?",
+                   (last, account_id, account_id))
+    cursor.execute("SELECT fingerprint, fingerprint_seq, transaction_id FROM transactions WHERE transaction_id > ?", (last,))
+    inserted = [(keys[(r[0], r[1])], r[2]) for r in cursor.fetchall()]
+    by_tags = {}
+    for i, tid in inserted:
+        if rows[i].get('tags'): by_tags.setdefault(rows[i]['tags'], []).append(tid)
+    for text, ids in by_tags.items(): _tag_transactions(cursor, user_id, ids, parse_tags(text))
+    return [i for i, _ in inserted]
+
+def get_duplicate_report(user_id):
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM transactions WHERE user_id=? AND date=? AND amount=? AND description=?", (user_id, date, amount, description))
-    return cursor.fetchone() is not None
+    cursor.execute("""SELECT account_id, date, amount, description, COUNT(*) AS copies, GROUP_CONCAT(transaction_id) AS transaction_ids
+                      FROM transactions WHERE user_id = ? AND fingerprint IS NOT NULL
+                      GROUP BY fingerprint HAVING COUNT(*) > 1 ORDER BY date DESC""", (user_id,))
+    data = cursor.fetchall()
+    conn.close()
+    return data
 
 def add_transaction(user_id, account_id, date, amount, trans_type, category, description, tags, conn_ext=None):
-    try:
-        amt = float(amount)
-        if trans_type == 'Expense': amt = -abs(amt)
-        else: amt = abs(amt)
-        amt = round(amt, 2)
+    try: amt = signed_amount(amount, trans_type)
     except ValueError: return False, "Invalid amount", None
     
-    conn = conn_ext if conn_ext else get_db_connection()
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT current_balance FROM accounts WHERE account_id = ?", (account_id,))
-        row = cursor.fetchone()
-        if not row: return False, "Account error", None
-        old_bal = row['current_balance']
+        begin_write(conn, user_id, f"Add {trans_type.lower()}: {category} {abs(amt):.2f}")
+        # Relative update: concurrent writers add to the balance instead of overwriting it
+        cursor.execute("UPDATE accounts SET current_balance = round(current_balance + ?, 2) WHERE account_id = ?", (amt, account_id))
+        if cursor.rowcount == 0:
+            if not conn_ext: conn.rollback()
+            return False, "Account error", None
+        fp = _fingerprint(account_id, date, amt, description)
         
-        cursor.execute("INSERT INTO transactions (user_id, account_id, date, amount, type, category, description, tags) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
-                       (user_id, account_id, date, amt, trans_type, category, description, tags))
+        _add_categories(cursor, user_id, [category])
+        cursor.execute(f"INSERT INTO transactions (user_id, account_id, date, amount, type, category_id, description, fingerprint, fingerprint_seq) VALUES (?, ?, ?, ?, ?, {CATEGORY_ID}, ?, ?, ?)", 
+                       (user_id, account_id, date, amt, trans_type, user_id, category, description, fp, _next_fingerprint_seq(cursor, fp)))
         new_id = cursor.lastrowid
-        cursor.execute("UPDATE accounts SET current_balance = ? WHERE account_id = ?", (round(old_bal + amt, 2), account_id))
+        if tags: _tag_transactions(cursor, user_id, [new_id], parse_tags(tags))
         
         if not conn_ext: conn.commit()
         return True, "Added", new_id
@@ -212,12 +1092,18 @@ def add_transaction(user_id, account_id, date, amount, trans_type, category, des
         if not conn_ext: conn.close()
 
 def delete_transaction(transaction_id, user_id):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT account_id, amount FROM transactions WHERE transaction_id = ? AND user_id = ?", (transaction_id, user_id))
+        begin_write(conn, user_id, f"Delete transaction #{transaction_id}")
+        cursor.execute("SELECT account_id, amount, transfer_id FROM transactions WHERE transaction_id = ? AND user_id = ?", (transaction_id, user_id))
         trans = cursor.fetchone()
         if not trans: return False, "Not found"
+        if trans['transfer_id']:
+            # Never leave half a transfer behind
+            _delete_transfer(cursor, trans['transfer_id'], user_id)
+            conn.commit()
+            return True, "Transfer deleted"
         cursor.execute("UPDATE accounts SET current_balance = round(current_balance - ?, 2) WHERE account_id = ?", (trans['amount'], trans['account_id']))
         cursor.execute("DELETE FROM transactions WHERE transaction_id = ?", (transaction_id,))
         conn.commit()
@@ -228,22 +1114,28 @@ def delete_transaction(transaction_id, user_id):
     finally: conn.close()
 
 def update_transaction(transaction_id, user_id, new_details):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT account_id, amount FROM transactions WHERE transaction_id = ? AND user_id = ?", (transaction_id, user_id))
+        begin_write(conn, user_id, f"Edit transaction #{transaction_id}")
+        cursor.execute("SELECT account_id, amount, fingerprint, fingerprint_seq, transfer_id FROM transactions WHERE transaction_id = ? AND user_id = ?", (transaction_id, user_id))
         old = cursor.fetchone()
         if not old: raise Exception("Not found")
+        if old['transfer_id']: raise Exception("This is part of a transfer; delete it and enter the transfer again")
         cursor.execute("UPDATE accounts SET current_balance = round(current_balance - ?, 2) WHERE account_id = ?", (old['amount'], old['account_id']))
         
-        new_amt = float(new_details['amount'])
-        if new_details['type'] == 'Expense': new_amt = -abs(new_amt)
-        else: new_amt = abs(new_amt)
-        new_amt = round(new_amt, 2)
+        new_amt = signed_amount(new_details['amount'], new_details['type'])
+        fp = _fingerprint(new_details['account_id'], new_details['date'], new_amt, new_details['description'])
+        seq = old['fingerprint_seq'] if fp == old['fingerprint'] else _next_fingerprint_seq(cursor, fp)
         
         cursor.execute("UPDATE accounts SET current_balance = round(current_balance + ?, 2) WHERE account_id = ?", (new_amt, new_details['account_id']))
-        cursor.execute("UPDATE transactions SET date=?, amount=?, type=?, category=?, description=?, account_id=? WHERE transaction_id=?", 
-                       (new_details['date'], new_amt, new_details['type'], new_details['category'], new_details['description'], new_details['account_id'], transaction_id))
+        _add_categories(cursor, user_id, [new_details['category']])
+        # A changed category is the user's correction and no longer a guess
+        cursor.execute(f"UPDATE transactions SET date=?, amount=?, type=?, category_id={CATEGORY_ID}, category_auto=category_auto AND category_id IS {CATEGORY_ID}, description=?, account_id=?, fingerprint=?, fingerprint_seq=? WHERE transaction_id=?", 
+                       (new_details['date'], new_amt, new_details['type'], user_id, new_details['category'], user_id, new_details['category'], new_details['description'], new_details['account_id'], fp, seq, transaction_id))
+        if 'tags' in new_details:
+            cursor.execute("DELETE FROM transaction_tags WHERE transaction_id = ?", (transaction_id,))
+            _tag_transactions(cursor, user_id, [transaction_id], parse_tags(new_details['tags']))
         conn.commit()
         return True, "Updated"
     except Exception as e:
@@ -251,107 +1143,806 @@ def update_transaction(transaction_id, user_id, new_details):
         return False, str(e)
     finally: conn.close()
 
-def get_transactions_by_filter(user_id, search_term=""):
-    conn = get_db_connection()
+class TransactionRow:
+    # One slotted object per row instead of a sqlite3.Row and its tuple. Indexable by name
+    # like a Row, and usable directly as a cursor row_factory
+    __slots__ = TRANSACTION_FIELDS
+    def __init__(self, cursor, values):
+        for field, v in zip(TRANSACTION_FIELDS, values): setattr(self, field, v)
+    def __getitem__(self, key): return getattr(self, key)
+    def keys(self): return TRANSACTION_FIELDS
+
+def _transaction_filter(user_id, search_term):
+    # Search box text is a filter expression, see query.py; raises ValueError on bad input
+    where, params = query.compile_filter(search_term, lambda names: get_category_ids(user_id, names))
+    return where, [user_id] + [user_id if p is query.USER else p for p in params]
+
+def get_transaction_ids(user_id, search_term=""):
+    # The transaction list keeps only these, 8 bytes a row, and fetches rows a page at a time
+    where, params = _transaction_filter(user_id, search_term)
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    query = "SELECT t.transaction_id, t.date, t.type, t.amount, t.category, t.description, a.account_name, t.account_id FROM transactions t JOIN accounts a ON t.account_id = a.account_id WHERE t.user_id = ?"
-    params = [user_id]
-    if search_term:
-        query += " AND (t.category LIKE ? OR t.description LIKE ? OR a.account_name LIKE ?)"
-        term = f"%{search_term}%"
-        params.extend([term, term, term])
-    query += " ORDER BY t.date DESC, t.transaction_id DESC"
-    cursor.execute(query, tuple(params))
-    res = cursor.fetchall()
+    cursor.row_factory = None
+    cursor.execute("SELECT t.transaction_id FROM transactions t WHERE t.user_id = ?" + where + TRANSACTION_ORDER, params)
+    ids = array('q')
+    for batch in iter(lambda: cursor.fetchmany(FETCH_ROWS), []): ids.extend(r[0] for r in batch)
+    conn.close()
+    return ids
+
+def explain_transaction_filter(user_id, search_term):
+    # Plan details for the id query behind the transaction list, for checking index use
+    where, params = _transaction_filter(user_id, search_term)
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("EXPLAIN QUERY PLAN SELECT t.transaction_id FROM transactions t WHERE t.user_id = ?" + where + TRANSACTION_ORDER, params)
+    res = [r['detail'] for r in cursor.fetchall()]
     conn.close()
     return res
 
+def get_transactions_by_ids(user_id, ids):
+    # Rows for the given ids in the same order; ids deleted meanwhile are left out
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.row_factory = TransactionRow
+    cursor.execute(TRANSACTION_SELECT + " AND t.transaction_id IN (SELECT value FROM json_each(?))", (user_id, json.dumps(list(ids))))
+    rows = {r.transaction_id: r for r in cursor.fetchall()}
+    conn.close()
+    return [rows[i] for i in ids if i in rows]
+
+def get_transaction_by_id(user_id, transaction_id):
+    rows = get_transactions_by_ids(user_id, [transaction_id])
+    return rows[0] if rows else None
+
+def iter_transactions(user_id, search_term="", conn_ext=None):
+    # For exports: streams the ledger holding one fetchmany batch at a time
+    where, params = _transaction_filter(user_id, search_term)
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = TransactionRow
+        cursor.execute(TRANSACTION_SELECT + where + TRANSACTION_ORDER, params)
+        for batch in iter(lambda: cursor.fetchmany(FETCH_ROWS), []): yield from batch
+    finally:
+        if not conn_ext: conn.close()
+
+def get_transactions_by_filter(user_id, search_term=""):
+    return list(iter_transactions(user_id, search_term))
+
+# --- TAG FUNCTIONS ---
+def parse_tags(text):
+    # "Trip, #work, trip" -> ['Trip', 'work']; names compare case-insensitively
+    names = {}
+    for name in (text or '').split(','):
+        name = name.strip().lstrip('#').strip()
+        if name: names.setdefault(name.lower(), name)
+    return list(names.values())
+
+def _tag_transactions(cursor, user_id, transaction_ids, names):
+    cursor.executemany("INSERT OR IGNORE INTO tags (user_id, name) VALUES (?, ?)", [(user_id, n) for n in names])
+    ids, n = json.dumps(list(transaction_ids)), 0
+    for name in names:
+        cursor.execute('''INSERT OR IGNORE INTO transaction_tags (tag_id, transaction_id)
+                          SELECT (SELECT tag_id FROM tags WHERE user_id = ? AND name = ?), transaction_id FROM transactions
+                          WHERE user_id = ? AND transaction_id IN (SELECT value FROM json_each(?))''', (user_id, name, user_id, ids))
+        n += cursor.rowcount
+    return n
+
+def add_tags(user_id, transaction_ids, tags):
+    names = parse_tags(tags)
+    if not names or not transaction_ids: return False, "Nothing to tag", 0
+    conn = get_db_connection(user_id)
+    try:
+        begin_write(conn, user_id, f"Tag {len(transaction_ids)} transactions: {', '.join(names)}")
+        n = _tag_transactions(conn.cursor(), user_id, transaction_ids, names)
+        conn.commit()
+        return True, f"Tagged {n}", n
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), 0
+    finally: conn.close()
+
+def remove_tags(user_id, transaction_ids, tags):
+    names = parse_tags(tags)
+    if not names or not transaction_ids: return False, "Nothing to untag", 0
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn, user_id, f"Untag {len(transaction_ids)} transactions: {', '.join(names)}")
+        ids, n = json.dumps(list(transaction_ids)), 0
+        for name in names:
+            cursor.execute('''DELETE FROM transaction_tags WHERE tag_id = (SELECT tag_id FROM tags WHERE user_id = ? AND name = ?)
+                              AND transaction_id IN (SELECT value FROM json_each(?))''', (user_id, name, ids))
+            n += cursor.rowcount
+            # Drop the name once nothing carries it
+            cursor.execute("DELETE FROM tags WHERE user_id = ? AND name = ? AND NOT EXISTS (SELECT 1 FROM transaction_tags tt WHERE tt.tag_id = tags.tag_id)", (user_id, name))
+        conn.commit()
+        return True, f"Untagged {n}", n
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), 0
+    finally: conn.close()
+
+def get_tags(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT g.name, COUNT(tt.transaction_id) as n FROM tags g LEFT JOIN transaction_tags tt ON tt.tag_id = g.tag_id WHERE g.user_id = ? GROUP BY g.tag_id ORDER BY g.name", (user_id,))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+def get_tag_spending(user_id, start_period, end_period, tag=None):
+    # Expense per tag per month, walking the tag's index range rather than every transaction
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    query = '''SELECT g.name as tag, strftime('%Y-%m', t.date) as period, a.currency, SUM(t.amount) as total
+               FROM tags g JOIN transaction_tags tt ON tt.tag_id = g.tag_id
+               JOIN transactions t ON t.transaction_id = tt.transaction_id JOIN accounts a ON a.account_id = t.account_id
+               WHERE g.user_id = ? AND t.type = 'Expense' AND t.is_transfer = 0 AND t.date >= ? AND t.date < date(?, '+1 month')'''
+    params = [user_id, f"{start_period}-01", f"{end_period}-01"]
+    if tag:
+        query += " AND g.name = ?"
+        params.append(tag)
+    cursor.execute(query + " GROUP BY g.tag_id, period, a.currency", params)
+    rows = cursor.fetchall()
+    conn.close()
+    res = {}
+    for r, t in zip(rows, convert_rollups(rows)): res[(r['tag'], r['period'])] = res.get((r['tag'], r['period']), 0.0) + abs(float(t))
+    return [{'tag': tag, 'period': period, 'spent': round(v, 2)} for (tag, period), v in sorted(res.items())]
+
+# --- TRANSFER FUNCTIONS ---
+def add_transfer(user_id, from_account_id, to_account_id, date, amount, description, to_amount=None):
+    try: amount = round(abs(float(amount)), 2)
+    except ValueError: return False, "Invalid amount", None
+    if not amount: return False, "Invalid amount", None
+    if from_account_id == to_account_id: return False, "Choose two different accounts", None
+
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn, user_id, f"Transfer {amount:.2f}")
+        cursor.execute("SELECT account_id, currency FROM accounts WHERE user_id = ? AND account_id IN (?, ?)", (user_id, from_account_id, to_account_id))
+        cur = {r['account_id']: r['currency'] for r in cursor.fetchall()}
+        if len(cur) != 2:
+            conn.rollback()
+            return False, "Account error", None
+        if to_amount is None:
+            to_amount = convert_amount(amount, cur[from_account_id], cur[to_account_id], date)
+            if to_amount is None:
+                conn.rollback()
+                return False, f"No exchange rate for {cur[from_account_id]} to {cur[to_account_id]}; enter the amount received", None
+        to_amount = round(abs(float(to_amount)), 2)
+
+        cursor.execute("INSERT INTO transfers (user_id, from_account_id, to_account_id, date, amount, to_amount, description) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (user_id, from_account_id, to_account_id, date, amount, to_amount, description))
+        transfer_id = cursor.lastrowid
+        _add_categories(cursor, user_id, [TRANSFER_CATEGORY])
+        for account_id, amt, trans_type in ((from_account_id, -amount, 'Expense'), (to_account_id, to_amount, 'Income')):
+            fp = _fingerprint(account_id, date, amt, description)
+            cursor.execute("INSERT INTO transactions (user_id, account_id, date, amount, type, category_id, description, fingerprint, fingerprint_seq, transfer_id, is_transfer) "
+                           f"VALUES (?, ?, ?, ?, ?, {CATEGORY_ID}, ?, ?, ?, ?, 1)", (user_id, account_id, date, amt, trans_type, user_id, TRANSFER_CATEGORY, description, fp, _next_fingerprint_seq(cursor, fp), transfer_id))
+            cursor.execute("UPDATE accounts SET current_balance = round(current_balance + ?, 2) WHERE account_id = ?", (amt, account_id))
+        conn.commit()
+        return True, "Transferred", transfer_id
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), None
+    finally: conn.close()
+
+def _delete_transfer(cursor, transfer_id, user_id):
+    cursor.execute("UPDATE accounts SET current_balance = round(current_balance - (SELECT COALESCE(SUM(amount), 0) FROM transactions t WHERE t.transfer_id = ? AND t.account_id = accounts.account_id), 2) "
+                   "WHERE account_id IN (SELECT account_id FROM transactions WHERE transfer_id = ?)", (transfer_id, transfer_id))
+    cursor.execute("DELETE FROM transactions WHERE transfer_id = ? AND user_id = ?", (transfer_id, user_id))
+    cursor.execute("DELETE FROM transfers WHERE transfer_id = ? AND user_id = ?", (transfer_id, user_id))
+
+def delete_transfer(transfer_id, user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn, user_id, f"Delete transfer #{transfer_id}")
+        _delete_transfer(cursor, transfer_id, user_id)
+        conn.commit()
+        return True, "Deleted"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally: conn.close()
+
+def get_transfers(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT tr.transfer_id, tr.date, tr.amount, tr.to_amount, tr.description, f.account_name as from_name, f.currency as from_currency,
+                      t.account_name as to_name, t.currency as to_currency FROM transfers tr
+                      JOIN accounts f ON f.account_id = tr.from_account_id JOIN accounts t ON t.account_id = tr.to_account_id
+                      WHERE tr.user_id = ? ORDER BY tr.date DESC, tr.transfer_id DESC''', (user_id,))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+def reconcile_balances(user_id, fix=False):
+    # Stored balances against the ledger, and transfers whose legs don't match the transfer row
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT a.account_id, a.account_name, a.current_balance, round(COALESCE(SUM(t.amount), 0), 2) as ledger
+                      FROM accounts a LEFT JOIN transactions t ON t.account_id = a.account_id
+                      WHERE a.user_id = ? GROUP BY a.account_id HAVING abs(a.current_balance - ledger) >= 0.005''', (user_id,))
+    accounts = cursor.fetchall()
+    cursor.execute('''SELECT tr.transfer_id, tr.date, tr.description FROM transfers tr WHERE tr.user_id = ? AND NOT (
+                          (SELECT COUNT(*) FROM transactions t WHERE t.transfer_id = tr.transfer_id) = 2
+                          AND EXISTS (SELECT 1 FROM transactions t WHERE t.transfer_id = tr.transfer_id AND t.account_id = tr.from_account_id AND t.amount = -tr.amount)
+                          AND EXISTS (SELECT 1 FROM transactions t WHERE t.transfer_id = tr.transfer_id AND t.account_id = tr.to_account_id AND t.amount = tr.to_amount))''', (user_id,))
+    transfers = cursor.fetchall()
+    if fix and accounts:
+        # Recomputed in the statement itself so a write since the check can't be undone
+        cursor.executemany("UPDATE accounts SET current_balance = (SELECT round(COALESCE(SUM(amount), 0), 2) FROM transactions t WHERE t.account_id = accounts.account_id) WHERE account_id = ?",
+                           [(r['account_id'],) for r in accounts])
+        conn.commit()
+    conn.close()
+    return {'accounts': accounts, 'transfers': transfers}
+
 def get_dashboard_numbers(user_id, month, year):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    m, y = f"{month:02d}", str(year)
-    cursor.execute("SELECT amount FROM budgets WHERE user_id=? AND month=? AND year=? AND category='##TOTAL##'", (user_id, month, year))
+    cursor.execute("SELECT amount FROM budgets WHERE user_id=? AND month=? AND year=? AND category_id IS NULL", (user_id, month, year))
     row = cursor.fetchone()
     bud = row['amount'] if row else 0.0
     
-    cursor.execute("SELECT SUM(amount) FROM transactions WHERE user_id=? AND type='Income' AND strftime('%Y', date)=? AND strftime('%m', date)=?", (user_id, y, m))
-    row = cursor.fetchone()
-    inc = row[0] if row[0] else 0.0
-    
-    cursor.execute("SELECT SUM(abs(amount)) FROM transactions WHERE user_id=? AND type='Expense' AND strftime('%Y', date)=? AND strftime('%m', date)=?", (user_id, y, m))
-    row = cursor.fetchone()
-    spn = row[0] if row[0] else 0.0
+    cursor.execute("SELECT period, type, currency, SUM(total) as total FROM monthly_rollups WHERE user_id=? AND period=? GROUP BY type, currency", (user_id, f"{year}-{month:02d}"))
+    rows = cursor.fetchall()
     conn.close()
+    totals = convert_rollups(rows)
+    inc = float(sum(t for r, t in zip(rows, totals) if r['type'] == 'Income'))
+    spn = float(sum(abs(t) for r, t in zip(rows, totals) if r['type'] == 'Expense'))
     return {'budget': bud, 'income': inc, 'spent': spn, 'remaining': bud - spn, 'net': inc - spn}
 
 def get_expense_data_for_pie_chart(user_id, month, year):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("SELECT category, SUM(abs(amount)) as total FROM transactions WHERE user_id=? AND type='Expense' AND strftime('%Y', date)=? AND strftime('%m', date)=? GROUP BY category HAVING total > 0", (user_id, str(year), f"{month:02d}"))
-    res = cursor.fetchall()
+    cursor.execute(f"SELECT r.period, {CATEGORY_NAME} as category, r.currency, r.total FROM monthly_rollups r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=? AND r.period=? AND r.type='Expense' AND abs(r.total) > 0",
+                   (user_id, f"{year}-{month:02d}"))
+    rows = cursor.fetchall()
     conn.close()
-    return res
+    return [{'category': c, 'total': abs(float(t))} for c, t in sum_by(rows, convert_rollups(rows), 'category').items()]
 
-def get_monthly_comparison_data(user_id):
-    conn = get_db_connection()
+def get_monthly_comparison_data(user_id, months=6):
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT strftime('%Y-%m', date) as month, 
-               SUM(CASE WHEN type='Income' THEN amount ELSE 0 END) as income,
-               SUM(CASE WHEN type='Expense' THEN abs(amount) ELSE 0 END) as expense
-        FROM transactions 
-        WHERE user_id=? AND date >= date('now', '-6 months') 
-        GROUP BY month ORDER BY month ASC
-    """, (user_id,))
-    res = cursor.fetchall()
+        SELECT period, type, currency, SUM(total) as total
+        FROM monthly_rollups 
+        WHERE user_id=? AND period >= strftime('%Y-%m', 'now', 'start of month', ?) 
+        GROUP BY period, type, currency
+    """, (user_id, f"-{months} months"))
+    rows = cursor.fetchall()
     conn.close()
-    return res
+    res = {}
+    for r, t in zip(rows, convert_rollups(rows)):
+        m = res.setdefault(r['period'], {'month': r['period'], 'income': 0.0, 'expense': 0.0})
+        if r['type'] == 'Income': m['income'] += t
+        else: m['expense'] += abs(t)
+    return [res[p] for p in sorted(res)]
+
+def get_rollup_series(user_id, table, bucket, start_period, end_period, conn_ext=None):
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {bucket} as bucket, r.period, {CATEGORY_NAME} as category, r.type, r.currency, r.total FROM {table} r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=? AND r.period BETWEEN ? AND ?",
+                   (user_id, start_period, end_period))
+    rows = cursor.fetchall()
+    if not conn_ext: conn.close()
+    return [{'bucket': r['bucket'], 'category': r['category'], 'type': r['type'], 'total': float(t)} for r, t in zip(rows, convert_rollups(rows))]
+
+def get_first_transaction_date(user_id, conn_ext=None):
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(period) FROM daily_rollups WHERE user_id=?", (user_id,))
+    row = cursor.fetchone()
+    if not conn_ext: conn.close()
+    return row[0]
 
 def get_recent_transactions(user_id, limit=5):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("SELECT date, category, amount, type FROM transactions WHERE user_id = ? ORDER BY date DESC, transaction_id DESC LIMIT ?", (user_id, limit))
+    cursor.execute(f"SELECT t.date, {CATEGORY_NAME} as category, t.amount, t.type FROM transactions t {CATEGORY_JOIN.format(t='t')} WHERE t.user_id = ? ORDER BY t.date DESC, t.transaction_id DESC LIMIT ?", (user_id, limit))
     data = cursor.fetchall()
     conn.close()
     return data
 
 def set_monthly_budget(user_id, month, year, amount):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("REPLACE INTO budgets (user_id, category, amount, month, year) VALUES (?, '##TOTAL##', ?, ?, ?)", (user_id, amount, month, year))
+    begin_write(conn)
+    cursor.execute("REPLACE INTO budgets (user_id, category_id, amount, month, year) VALUES (?, NULL, ?, ?, ?)", (user_id, amount, month, year))
     conn.commit()
     conn.close()
 
-def set_category_budget(user_id, category, amount, month, year):
-    conn = get_db_connection()
+def set_category_budget(user_id, category, amount, month, year, alert_levels=None):
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("REPLACE INTO budgets (user_id, category, amount, month, year) VALUES (?, ?, ?, ?, ?)", (user_id, category, amount, month, year))
+    begin_write(conn)
+    _add_categories(cursor, user_id, [category])
+    cursor.execute(f"REPLACE INTO budgets (user_id, category_id, amount, month, year, alert_levels) VALUES (?, {CATEGORY_ID}, ?, ?, ?, ?)", (user_id, user_id, category, amount, month, year, alert_levels))
     conn.commit()
     conn.close()
     return True, "Saved"
 
 def delete_category_budget(user_id, category, month, year):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM budgets WHERE user_id=? AND category=? AND month=? AND year=?", (user_id, category, month, year))
+    begin_write(conn)
+    cursor.execute(f"DELETE FROM budgets WHERE user_id=? AND category_id={CATEGORY_ID} AND month=? AND year=?", (user_id, user_id, category, month, year))
     conn.commit()
     conn.close()
     return True, "Deleted"
 
 def get_category_budgets_with_spending(user_id, month, year):
-    conn = get_db_connection()
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT r.period, {CATEGORY_NAME} as category, r.currency, r.total FROM monthly_rollups r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=? AND r.period=? AND r.type='Expense'",
+                   (user_id, f"{year}-{month:02d}"))
+    rows = cursor.fetchall()
+    cursor.execute("SELECT c.name as category, b.amount FROM budgets b JOIN categories c ON c.category_id = b.category_id WHERE b.user_id=? AND b.month=? AND b.year=?", (user_id, month, year))
+    budgets = cursor.fetchall()
+    chains = category_chains(get_categories(user_id, conn))
+    conn.close()
+    # Budgets are in the base currency, so spending is converted before comparing. A budget
+    # covers its subcategories too; spending no budget covers is listed on its own
+    spent = sum_by(rows, convert_rollups(rows), 'category')
+    chain = lambda c: chains.get(c.lower(), (c,))
+    res = [{'category': b['category'], 'budget': b['amount'], 'spent': abs(sum(t for c, t in spent.items() if b['category'] in chain(c)))} for b in budgets]
+    budgeted = {b['category'] for b in budgets}
+    return res + [{'category': c, 'budget': 0, 'spent': abs(t)} for c, t in spent.items() if budgeted.isdisjoint(chain(c))]
+
+def get_budget_plan(user_id, month, year):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    # category is None for the month's budget
+    cursor.execute("SELECT c.name as category, b.amount, b.alert_levels FROM budgets b LEFT JOIN categories c ON c.category_id = b.category_id WHERE b.user_id=? AND b.month=? AND b.year=?",
+                   (user_id, month, year))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def copy_budget_plan(user_id, month, year, targets, overwrite=False):
+    # One INSERT ... SELECT fans the month's budgets out to every (month, year) in targets. OR
+    # rather than ON CONFLICT, which names one unique index and the month's budget has its own
+    conflict = "REPLACE" if overwrite else "IGNORE"
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'''INSERT OR {conflict} INTO budgets (user_id, category_id, amount, month, year, alert_levels)
+                           SELECT b.user_id, b.category_id, b.amount, json_extract(j.value, '$[0]'), json_extract(j.value, '$[1]'), b.alert_levels
+                           FROM budgets b, json_each(?) j WHERE b.user_id = ? AND b.month = ? AND b.year = ?''', (json.dumps([list(t) for t in targets]), user_id, month, year))
+        n = cursor.rowcount
+        conn.commit()
+        return True, f"Copied {n} budgets", n
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), 0
+    finally: conn.close()
+
+def get_month_expenses(user_id, month, year):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT r.period, {CATEGORY_NAME} as category, r.currency, r.total FROM monthly_rollups r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=? AND r.period=? AND r.type='Expense'",
+                   (user_id, f"{year}-{month:02d}"))
+    rows = cursor.fetchall()
+    conn.close()
+    return {c: abs(float(t)) for c, t in sum_by(rows, convert_rollups(rows), 'category').items()}
+
+def get_fired_alerts(user_id, period):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT c.name, a.level FROM budget_alerts a LEFT JOIN categories c ON c.category_id = a.category_id WHERE a.user_id=? AND a.period=?", (user_id, period))
+    res = [tuple(r) for r in cursor.fetchall()]
+    conn.close()
+    return res
+
+def save_budget_alerts(user_id, period, alerts):
+    # alerts are (category, level, spent, budget), category None for the month's budget; OR
+    # IGNORE keeps a second window from repeating one
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    now = datetime.now().isoformat(timespec='seconds')
+    begin_write(conn)
+    _add_categories(cursor, user_id, {a[0] for a in alerts if a[0] is not None})
+    cursor.executemany(f"INSERT OR IGNORE INTO budget_alerts (user_id, period, category_id, level, spent, budget, fired_at) VALUES (?, ?, {CATEGORY_ID}, ?, ?, ?, ?)",
+                       [(user_id, period, user_id, c, level, spent, budget, now) for c, level, spent, budget in alerts])
+    n = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return n
+
+def get_monthly_expense_rollups(user_id, start_period, end_period):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT r.period, {CATEGORY_NAME} as category, r.currency, r.total FROM monthly_rollups r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=? AND r.period BETWEEN ? AND ? AND r.type='Expense'",
+                   (user_id, start_period, end_period))
+    rows = cursor.fetchall()
+    conn.close()
+    return [{'period': r['period'], 'category': r['category'], 'spent': abs(float(t))} for r, t in zip(rows, convert_rollups(rows))]
+
+# --- CATEGORY RULE FUNCTIONS ---
+def get_category_training_data(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT t.description, {CATEGORY_NAME} as category, COUNT(*) as n FROM transactions t {CATEGORY_JOIN.format(t='t')}
+                       WHERE t.user_id=? AND t.is_transfer = 0 AND t.category_auto = 0 AND t.description != '' GROUP BY t.description, category''', (user_id,))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def get_category_rules(user_id):
+    conn = get_db_connection(user_id)
     cursor = conn.cursor()
-    query = """
-    WITH Spending AS (SELECT category, SUM(abs(amount)) as spent FROM transactions WHERE user_id=? AND type='Expense' AND strftime('%Y', date)=? AND strftime('%m', date)=? GROUP BY category)
-    SELECT b.category, b.amount as budget, COALESCE(s.spent, 0) as spent FROM budgets b LEFT JOIN Spending s ON b.category = s.category WHERE b.user_id=? AND b.month=? AND b.year=? AND b.category != '##TOTAL##'
-    UNION ALL
-    SELECT s.category, 0 as budget, s.spent FROM Spending s LEFT JOIN budgets b ON s.category = b.category AND b.user_id=? AND b.month=? AND b.year=? WHERE b.budget_id IS NULL
-    """
-    params = (user_id, str(year), f"{month:02d}", user_id, month, year, user_id, month, year)
-    cursor.execute(query, params)
+    cursor.execute(f"SELECT r.pattern, {CATEGORY_NAME} as category, r.hits, r.source FROM category_rules r {CATEGORY_JOIN.format(t='r')} WHERE r.user_id=?", (user_id,))
     res = cursor.fetchall()
     conn.close()
     return res
 
+def save_learned_rules(user_id, rules):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn)
+        cursor.execute("DELETE FROM category_rules WHERE user_id=? AND source='learned'", (user_id,))
+        _add_categories(cursor, user_id, {c for _, c, _ in rules})
+        cursor.executemany(f"INSERT OR IGNORE INTO category_rules (user_id, pattern, category_id, hits, source) VALUES (?, ?, {CATEGORY_ID}, ?, 'learned')",
+                           [(user_id, p, user_id, c, h) for p, c, h in rules])
+        conn.commit()
+        return True, "Saved"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally: conn.close()
+
+def set_category_rule(user_id, pattern, category):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    begin_write(conn)
+    _add_categories(cursor, user_id, [category])
+    cursor.execute(f"REPLACE INTO category_rules (user_id, pattern, category_id, hits, source) VALUES (?, ?, {CATEGORY_ID}, 1, 'manual')", (user_id, pattern, user_id, category))
+    conn.commit()
+    conn.close()
+    return True, "Saved"
+
+# --- RECURRING FUNCTIONS ---
+def add_recurring_rule(user_id, account_id, amount, trans_type, category, description, frequency, interval, anchor_day, next_due, end_date=None):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn)
+        _add_categories(cursor, user_id, [category])
+        cursor.execute(f"INSERT INTO recurring_rules (user_id, account_id, amount, type, category_id, description, frequency, interval, anchor_day, next_due, end_date) VALUES (?, ?, ?, ?, {CATEGORY_ID}, ?, ?, ?, ?, ?, ?)",
+                       (user_id, account_id, round(abs(float(amount)), 2), trans_type, user_id, category, description, frequency, interval, anchor_day, next_due, end_date))
+        conn.commit()
+        return True, "Saved", cursor.lastrowid
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), None
+    finally: conn.close()
+
+def delete_recurring_rule(rule_id, user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    begin_write(conn)
+    cursor.execute("UPDATE recurring_rules SET active = 0 WHERE rule_id = ? AND user_id = ?", (rule_id, user_id))
+    conn.commit()
+    conn.close()
+    return True, "Deleted"
+
+def get_recurring_rules(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT r.*, {CATEGORY_NAME} as category, a.currency FROM recurring_rules r JOIN accounts a ON a.account_id = r.account_id {CATEGORY_JOIN.format(t='r')} "
+                   "WHERE r.user_id = ? AND r.active = 1 ORDER BY r.next_due", (user_id,))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def get_recurring_schedule(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT next_due, rule_id FROM recurring_rules WHERE user_id = ? AND active = 1", (user_id,))
+    res = [tuple(r) for r in cursor.fetchall()]
+    conn.close()
+    return res
+
+def get_recurring_rules_by_id(rule_ids, conn):
+    cursor = conn.cursor()
+    res = {}
+    ids = list(rule_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(f"SELECT r.*, {CATEGORY_NAME} as category FROM recurring_rules r {CATEGORY_JOIN.format(t='r')} WHERE r.active = 1 AND r.rule_id IN ({','.join('?' * len(chunk))})", chunk)
+        for r in cursor.fetchall(): res[r['rule_id']] = r
+    return res
+
+def claim_recurring_occurrence(rule_id, due_date, conn):
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO recurring_occurrences (rule_id, due_date) VALUES (?, ?)", (rule_id, due_date))
+    return cursor.rowcount == 1
+
+def set_recurring_occurrence_transaction(rule_id, due_date, transaction_id, conn):
+    conn.execute("UPDATE recurring_occurrences SET transaction_id = ? WHERE rule_id = ? AND due_date = ?", (transaction_id, rule_id, due_date))
+
+def get_recurring_posted_expenses(user_id, start_date, end_date):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT {CATEGORY_NAME} as category, t.date as period, a.currency, SUM(abs(t.amount)) as total FROM recurring_rules r
+        JOIN recurring_occurrences o ON o.rule_id = r.rule_id AND o.due_date BETWEEN ? AND ?
+        JOIN transactions t ON t.transaction_id = o.transaction_id
+        JOIN accounts a ON a.account_id = t.account_id {CATEGORY_JOIN.format(t='t')}
+        WHERE r.user_id = ? AND t.type = 'Expense' GROUP BY t.category_id, t.date, a.currency''', (start_date, end_date, user_id))
+    rows = cursor.fetchall()
+    conn.close()
+    return [{'category': c, 'total': t} for c, t in sum_by(rows, convert_rollups(rows), 'category').items()]
+
+def advance_recurring_rules(updates, conn):
+    conn.executemany("UPDATE recurring_rules SET next_due = ?, active = ? WHERE rule_id = ?", updates)
+
+# --- IMPORT JOB FUNCTIONS ---
+def get_import_job(user_id, file_hash):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM import_jobs WHERE user_id = ? AND file_hash = ?", (user_id, file_hash))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def start_import_job(user_id, file_hash, file_name):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO import_jobs (user_id, file_hash, file_name, updated_at) VALUES (?, ?, ?, datetime('now'))",
+                   (user_id, file_hash, file_name))
+    conn.commit()
+    conn.close()
+    return cursor.lastrowid
+
+def checkpoint_import_job(job_id, byte_offset, rows_done, added, skipped, auto, status, action_id, conn):
+    # Written in the same transaction as the rows it covers, so offset and data always agree
+    conn.execute("UPDATE import_jobs SET byte_offset = ?, rows_done = ?, added = ?, skipped = ?, auto = ?, status = ?, action_id = ?, updated_at = datetime('now') WHERE job_id = ?",
+                 (byte_offset, rows_done, added, skipped, auto, status, action_id, job_id))
+
+# --- IMPORT PROFILE FUNCTIONS ---
+def get_import_profiles(user_id):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM import_profiles WHERE user_id = ? ORDER BY name", (user_id,))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+def save_import_profile(user_id, p):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""INSERT INTO import_profiles (user_id, name, date_col, amount_col, debit_col, credit_col, description_col, category_col, type_col, date_format, invert_sign)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                          ON CONFLICT (user_id, name) DO UPDATE SET date_col = excluded.date_col, amount_col = excluded.amount_col,
+                              debit_col = excluded.debit_col, credit_col = excluded.credit_col, description_col = excluded.description_col,
+                              category_col = excluded.category_col, type_col = excluded.type_col, date_format = excluded.date_format,
+                              invert_sign = excluded.invert_sign""",
+                       (user_id, p['name'], p['date_col'], p.get('amount_col'), p.get('debit_col'), p.get('credit_col'), p.get('description_col'),
+                        p.get('category_col'), p.get('type_col'), p.get('date_format'), int(bool(p.get('invert_sign')))))
+        conn.commit()
+        return True, "Saved"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally: conn.close()
+
+def delete_import_profile(profile_id, user_id):
+    conn = get_db_connection(user_id)
+    conn.execute("DELETE FROM import_profiles WHERE profile_id = ? AND user_id = ?", (profile_id, user_id))
+    conn.commit()
+    conn.close()
+
+# --- ANOMALY FUNCTIONS ---
+def get_expense_history(user_id, after_id=0, dates=None):
+    # Expenses after after_id, or dated within dates=(first, last), as plain tuples (transaction_id,
+    # account_id, date, amount, category_id, merchant, currency), oldest first: amount positive,
+    # category the one the row counts under
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    where, params = ("t.date BETWEEN ? AND ?", dates) if dates else ("t.transaction_id > ?", (after_id,))
+    cursor.execute(f'''SELECT t.transaction_id, t.account_id, t.date, abs(t.amount), COALESCE(c.merged_into, c.category_id), {MERCHANT.format(d='t.description')}, a.currency
+                       FROM transactions t JOIN accounts a ON a.account_id = t.account_id JOIN categories c ON c.category_id = t.category_id
+                       WHERE t.user_id = ? AND {where} AND t.type = 'Expense' AND t.is_transfer = 0 ORDER BY t.transaction_id''', (user_id, *params))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def get_spending_stats(user_id, start_period, end_period):
+    # (category_id, merchant, currency, period, n, total, total_sq), merged categories folded into their target
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute('''SELECT COALESCE(c.merged_into, c.category_id), s.merchant, s.currency, s.period, SUM(s.n), SUM(s.total), SUM(s.total_sq)
+                      FROM spending_stats s JOIN categories c ON c.category_id = s.category_id
+                      WHERE s.user_id = ? AND s.period BETWEEN ? AND ? GROUP BY 1, 2, 3, 4''', (user_id, start_period, end_period))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def get_anomaly_watermark(user_id):
+    conn = get_db_connection(user_id)
+    row = conn.execute("SELECT last_id FROM anomaly_scans WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def save_anomalies(user_id, flags, last_id, replace=False):
+    # flags are (transaction_id, kind, score, baseline, related_id); last_id is the newest
+    # transaction looked at. replace drops the old flags first, keeping dismissals.
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    if replace: cursor.execute("DELETE FROM anomalies WHERE user_id = ? AND dismissed = 0", (user_id,))
+    cursor.executemany("INSERT OR IGNORE INTO anomalies (transaction_id, kind, user_id, score, baseline, related_id) VALUES (?, ?, ?, ?, ?, ?)",
+                       [(tid, kind, user_id, score, baseline, related) for tid, kind, score, baseline, related in flags])
+    cursor.execute("INSERT INTO anomaly_scans (user_id, last_id, scanned_at) VALUES (?, ?, ?) "
+                   "ON CONFLICT (user_id) DO UPDATE SET last_id = MAX(last_id, excluded.last_id), scanned_at = excluded.scanned_at",
+                   (user_id, last_id, datetime.now().isoformat(timespec='seconds')))
+    conn.commit()
+    conn.close()
+    return len(flags)
+
+def get_anomalies(user_id, limit=200, dismissed=False):
+    # Newest first; flags on transactions deleted since drop out with the join
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT an.transaction_id, an.kind, an.score, an.baseline, an.related_id, r.date as related_date, t.date, t.amount, t.description,
+                       {CATEGORY_NAME} as category, a.account_name, a.currency
+                       FROM anomalies an JOIN transactions t ON t.transaction_id = an.transaction_id JOIN accounts a ON a.account_id = t.account_id
+                       {CATEGORY_JOIN.format(t='t')} LEFT JOIN transactions r ON r.transaction_id = an.related_id
+                       WHERE an.user_id = ? AND an.dismissed = ? ORDER BY t.date DESC, an.transaction_id DESC LIMIT ?''', (user_id, int(dismissed), limit))
+    res = cursor.fetchall()
+    conn.close()
+    return res
+
+def dismiss_anomaly(user_id, transaction_id, kind):
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE anomalies SET dismissed = 1 WHERE user_id = ? AND transaction_id = ? AND kind = ?", (user_id, transaction_id, kind))
+    conn.commit()
+    conn.close()
+    return (True, "Dismissed") if cursor.rowcount else (False, "Not found")
+
+# --- AUDIT FUNCTIONS ---
+# The ledger as of an action, same columns as the transactions table shows them
+LEDGER_FIELDS = ('transaction_id', 'date', 'type', 'amount', 'category', 'description', 'account_id', 'transfer_id')
+LEDGER_COLUMNS = tuple('category_id' if f == 'category' else f for f in LEDGER_FIELDS)
+CHANGED_SINCE = "These rows have changed since; undo the later changes first"
+
+def get_last_action_id(user_id):
+    conn = get_db_connection(user_id)
+    row = conn.execute("SELECT action_id FROM audit_actions WHERE user_id = ? ORDER BY action_id DESC LIMIT 1", (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def get_actions(user_id, after=0, limit=200):
+    # Newest first; actions that changed nothing (a failed edit, an import of duplicates) are left out
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT a.action_id, a.at, a.label, a.undoes, (SELECT COUNT(*) FROM audit_log l WHERE l.action_id = a.action_id) as changes
+                      FROM audit_actions a WHERE a.user_id = ? AND a.action_id > ? AND EXISTS (SELECT 1 FROM audit_log l WHERE l.action_id = a.action_id)
+                      ORDER BY a.action_id DESC LIMIT ?''', (user_id, after, limit))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+def get_action_at(user_id, when):
+    # The last action at or before an ISO time, 0 if there is none
+    conn = get_db_connection(user_id)
+    row = conn.execute("SELECT COALESCE(MAX(action_id), 0) FROM audit_actions WHERE user_id = ? AND at <= ?", (user_id, when)).fetchone()
+    conn.close()
+    return row[0]
+
+def _revert_change(cursor, table, op, row_id, data, columns):
+    # Puts one logged row back as it was before the change, keeping the account balance in step
+    keys = AUDITED[table][0]
+    if table not in columns: columns[table] = table_columns(cursor, table)
+    if table == 'transactions' and op != 'D':
+        cursor.execute("UPDATE accounts SET current_balance = round(current_balance - (SELECT amount FROM transactions WHERE transaction_id = ?), 2) "
+                       "WHERE account_id = (SELECT account_id FROM transactions WHERE transaction_id = ?)", (row_id, row_id))
+    if table == 'categories' and op == 'I':
+        # Made in passing by the first row to use the name; stays while later rows still use it
+        cursor.execute('''DELETE FROM categories WHERE category_id = ? AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.user_id = categories.user_id AND t.category_id = ?)
+                          AND NOT EXISTS (SELECT 1 FROM categories k WHERE ? IN (k.parent_id, k.merged_into))''', (row_id, row_id, row_id))
+        return
+    if op == 'I':
+        key = dict(zip(keys, [row_id] + json.loads(data or '[]')))
+        cursor.execute(f"DELETE FROM {table} WHERE " + " AND ".join(f"{k} = ?" for k in key), list(key.values()))
+        return
+    # Rows logged before a column was added are shorter; the new column takes its default
+    old = dict(zip(columns[table], json.loads(data)))
+    if op == 'D':
+        cursor.execute(f"INSERT INTO {table} ({', '.join(old)}) VALUES ({', '.join('?' * len(old))})", list(old.values()))
+    else:
+        restore = {k: v for k, v in old.items() if k in AUDIT_UPDATE_COLUMNS.get(table, old)}
+        cursor.execute(f"UPDATE {table} SET {', '.join(f'{k} = ?' for k in restore)} WHERE {keys[0]} = ?", list(restore.values()) + [row_id])
+        if cursor.rowcount == 0: return  # deleted since; undoing that delete brings it back
+    if table == 'transactions':
+        cursor.execute("UPDATE accounts SET current_balance = round(current_balance + ?, 2) WHERE account_id = ?", (old['amount'], old['account_id']))
+
+def _changed_since(cursor, action_id, columns):
+    # True if a row the action changed is no longer as the action left it. That state is the
+    # before-image of the row's first later log entry; rows no later action touched are as left.
+    # Tag links are only added or removed whole, and reverting them stays safe.
+    first = {}
+    cursor.execute("SELECT tbl, op, row_id, data FROM audit_log WHERE action_id > ? AND tbl != 'transaction_tags' "
+                   "AND (tbl, row_id) IN (SELECT tbl, row_id FROM audit_log WHERE action_id = ?) ORDER BY action_id DESC, seq DESC", (action_id, action_id))
+    for r in cursor.fetchall(): first[r['tbl'], r['row_id']] = r
+    for (table, row_id), r in first.items():
+        if table not in columns: columns[table] = table_columns(cursor, table)
+        cursor.execute(f"SELECT json_array({', '.join(columns[table])}) FROM {table} WHERE {AUDITED[table][0][0]} = ?", (row_id,))
+        current = cursor.fetchone()
+        if r['op'] == 'I':
+            if current: return True
+            continue
+        if not current: return True
+        logged, now = json.loads(r['data']), json.loads(current[0])
+        tracked = AUDIT_UPDATE_COLUMNS.get(table)
+        if tracked: logged, now = ([v for c, v in zip(columns[table], row) if c in tracked] for row in (logged, now))
+        if now[:len(logged)] != logged: return True
+    return False
+
+def undo_action(user_id, action_id):
+    # Reverts an action's changes, newest first, as a new action; undoing that one is redo.
+    # Returns (ok, label or error, new action id).
+    conn = get_db_connection(user_id)
+    cursor = conn.cursor()
+    try:
+        begin_write(conn)
+        cursor.execute("SELECT label, undoes FROM audit_actions WHERE action_id = ? AND user_id = ?", (action_id, user_id))
+        action = cursor.fetchone()
+        if not action:
+            conn.rollback()
+            return False, "Not found", None
+        columns, before = {}, None
+        if _changed_since(cursor, action_id, columns):
+            conn.rollback()
+            return False, CHANGED_SINCE, None
+        base = action['label'].split(": ", 1)[1] if action['undoes'] else action['label']
+        label = f"{'Redo' if action['label'].startswith('Undo: ') else 'Undo'}: {base}"
+        new_id = _log_action(conn, user_id, label, action_id)
+        # Paged, as reverting appends to the log being read
+        while True:
+            cursor.execute("SELECT seq, tbl, op, row_id, data FROM audit_log WHERE action_id = ? AND seq < COALESCE(?, seq + 1) "
+                           "ORDER BY seq DESC LIMIT ?", (action_id, before, FETCH_ROWS))
+            changes = cursor.fetchall()
+            if not changes: break
+            for c in changes: _revert_change(cursor, c['tbl'], c['op'], c['row_id'], c['data'], columns)
+            before = changes[-1]['seq']
+        conn.commit()
+        return True, label, new_id
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False, CHANGED_SINCE, None
+    except Exception as e:
+        conn.rollback()
+        return False, str(e), None
+    finally: conn.close()
+
+def iter_ledger_at(user_id, action_id, conn_ext=None):
+    # The user's transactions as they stood right after action_id. A row changed since then is
+    # read from its first later log entry, which holds the row as it was; the rest are current.
+    # Categories show under their current names.
+    conn = conn_ext if conn_ext else get_db_connection(user_id)
+    try:
+        cursor = conn.cursor()
+        position = {c: i for i, c in enumerate(table_columns(cursor, 'transactions'))}
+        cursor.execute(f'''WITH later AS (SELECT row_id, op, data, ROW_NUMBER() OVER (PARTITION BY row_id ORDER BY action_id, seq) as n FROM audit_log
+                                           WHERE tbl = 'transactions' AND action_id IN (SELECT action_id FROM audit_actions WHERE user_id = ? AND action_id > ?)),
+                           ledger AS (SELECT {', '.join(LEDGER_COLUMNS)} FROM transactions WHERE user_id = ? AND transaction_id NOT IN (SELECT row_id FROM later)
+                                      UNION ALL
+                                      SELECT row_id, {', '.join(f"json_extract(data, '$[{position[f]}]')" for f in LEDGER_COLUMNS[1:])} FROM later WHERE n = 1 AND op != 'I')
+                           SELECT {', '.join(CATEGORY_NAME if f == 'category' else 't.' + f for f in LEDGER_FIELDS)} FROM ledger t
+                           LEFT {CATEGORY_JOIN.format(t='t')} ORDER BY t.date, t.transaction_id''', (user_id, action_id, user_id))
+        for batch in iter(lambda: cursor.fetchmany(FETCH_ROWS), []): yield from batch
+    finally:
+        if not conn_ext: conn.close()
+
+# Every public function above is timed; see instrumentation.py
+instrumentation.instrument_module(globals())
+
 if __name__ == '__main__':
     initialize_database()
\ No newline at end of file
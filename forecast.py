@@ -0,0 +1,61 @@
+import calendar
+from datetime import date
+import numpy as np
+import database as db
+import scheduler
+
+HISTORY_MONTHS = 12
+
+def month_periods(today, months):
+    return [scheduler.add_months(today.replace(day=1), -i, 1).strftime('%Y-%m') for i in range(months, -1, -1)]
+
+def upcoming_recurring(user_id, today, month_end):
+    # Occurrences still to be posted between tomorrow and the end of the month, at today's rates
+    rows = []
+    for r in db.get_recurring_rules(user_id):
+        if r['type'] != 'Expense': continue
+        due = date.fromisoformat(r['next_due'])
+        while due <= month_end and (not r['end_date'] or due.isoformat() <= r['end_date']):
+            if due > today: rows.append({'category': r['category'], 'currency': r['currency'], 'total': r['amount'], 'period': today.isoformat()})
+            due = scheduler.next_occurrence(due, r['frequency'], r['interval'], r['anchor_day'])
+    return db.sum_by(rows, db.convert_rollups(rows), 'category')
+
+def project_month(user_id, today=None):
+    today = today or date.today()
+    days = calendar.monthrange(today.year, today.month)[1]
+    month_start, month_end = today.replace(day=1), today.replace(day=days)
+    periods = month_periods(today, HISTORY_MONTHS)
+
+    rows = db.get_monthly_expense_rollups(user_id, periods[0], periods[-1])
+    posted = {r['category']: r['total'] for r in db.get_recurring_posted_expenses(user_id, month_start.isoformat(), month_end.isoformat())}
+    upcoming = upcoming_recurring(user_id, today, month_end)
+    categories = sorted({r['category'] for r in rows} | set(upcoming))
+    if not categories: return {'categories': [], 'spent': {}, 'projected': {}, 'total_spent': 0.0, 'total_projected': 0.0}
+
+    # month x category matrix, current month in the last row
+    p_idx = {p: i for i, p in enumerate(periods)}
+    c_idx = {c: i for i, c in enumerate(categories)}
+    m = np.zeros((len(periods), len(categories)))
+    np.add.at(m, ([p_idx[r['period']] for r in rows], [c_idx[r['category']] for r in rows]), [r['spent'] for r in rows])
+    rec_posted = np.array([posted.get(c, 0.0) for c in categories])
+    rec_upcoming = np.array([upcoming.get(c, 0.0) for c in categories])
+
+    history, mtd = m[:-1], m[-1]
+    active = history.sum(axis=1) > 0
+    baseline = history[active].mean(axis=0) if active.any() else mtd
+
+    # Recurring charges are known exactly; only the discretionary remainder is extrapolated,
+    # blending this month's run-rate with the historical norm as the month progresses.
+    frac = today.day / days
+    rec_total = rec_posted + rec_upcoming
+    disc_mtd = np.maximum(mtd - rec_posted, 0)
+    disc_run = disc_mtd / frac
+    disc_hist = np.maximum(baseline - rec_total, 0)
+    disc_proj = np.maximum(frac * disc_run + (1 - frac) * disc_hist, disc_mtd)
+    projected = np.round(rec_total + disc_proj, 2)
+
+    return {'categories': categories,
+            'spent': dict(zip(categories, mtd.tolist())),
+            'projected': dict(zip(categories, projected.tolist())),
+            'total_spent': float(mtd.sum()),
+            'total_projected': float(projected.sum())}
@@ -0,0 +1,316 @@
+import os
+import re
+import sys
+import csv
+import html
+import codecs
+import hashlib
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, date, timedelta
+import database as db
+import categorizer
+import backup
+
+CHECKPOINT_ROWS = 5000
+BATCH_ROWS = 1000
+DEFAULT_COLUMNS = {'date', 'amount'}
+# Mappable fields of an import profile, in the order the profile dialog shows them
+PROFILE_FIELDS = [('date_col', 'Date'), ('amount_col', 'Amount'), ('debit_col', 'Debit (money out)'), ('credit_col', 'Credit (money in)'),
+                  ('description_col', 'Description'), ('category_col', 'Category'), ('type_col', 'Type')]
+INCOME_WORDS = {'income', 'credit', 'cr', 'deposit'}
+EXCEL_EPOCH = date(1899, 12, 30)
+AMOUNT_JUNK = re.compile(r"[^\d.\-]")
+
+def smart_date_parse(date_str):
+    # Excel stores dates as day serials; they reach us as plain numbers
+    if re.fullmatch(r'\d{5}(\.\d+)?', date_str): return (EXCEL_EPOCH + timedelta(days=int(float(date_str)))).isoformat()
+    formats = ['%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%y']
+    for fmt in formats:
+        try: return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
+        except ValueError: pass
+    return datetime.now().strftime('%Y-%m-%d')
+
+def parse_amount(value):
+    # Bank exports write "1,234.56", "₹ 1,234.56", "(12.50)" or "12.50-"
+    s = str(value).strip()
+    negative = (s.startswith('(') and s.endswith(')')) or s.endswith('-')
+    amount = float(AMOUNT_JUNK.sub('', s.rstrip('-')))
+    return -abs(amount) if negative else amount
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''): h.update(chunk)
+    return h.hexdigest()
+
+# --- READERS ---
+# A reader is built as Reader(path, offset), yields raw rows as dicts and keeps .offset at the
+# resume position just past the last row handed out (bytes for CSV, rows for the others).
+# header() returns the lowercase column names, or None when rows come out already normalized.
+
+class CsvReader:
+    def __init__(self, path, offset=0):
+        self.path, self.offset, self.pos = path, offset, 0
+
+    def header(self):
+        with open(self.path, 'rb') as f:
+            return [name.lower().strip() for name in next(csv.reader([f.readline().decode('utf-8-sig')]), [])]
+
+    def lines(self, f):
+        for line in iter(f.readline, b''):
+            self.pos += len(line)
+            yield line.decode('utf-8')
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+            fieldnames = [name.lower().strip() for name in next(csv.reader([header.decode('utf-8-sig')]))]
+            self.pos = max(self.offset, len(header))
+            f.seek(self.pos)
+            # csv.reader pulls only the lines of one record at a time, so pos is exact between rows
+            for values in csv.reader(self.lines(f)):
+                self.offset = self.pos
+                if values: yield dict(zip(fieldnames, values))
+
+class OfxReader:
+    # OFX 1.x is SGML with unclosed leaf tags (<TRNAMT>-12.50), 2.x is XML (<TRNAMT>-12.50</TRNAMT>).
+    # Scanning tags and taking the text after each opening tag reads both the same way,
+    # a chunk at a time, without building a tree.
+    TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)[^>]*>([^<]*)')
+    CHUNK = 1 << 16
+
+    def __init__(self, path, offset=0):
+        self.path, self.start, self.offset = path, offset, offset
+
+    def header(self): return None
+
+    def chunks(self):
+        with open(self.path, 'rb') as f:
+            first = f.read(self.CHUNK)
+            charset = 'cp1252' if re.search(rb'CHARSET:\s*1252|encoding="windows-1252"', first[:1024], re.I) else 'utf-8'
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            chunk = first
+            while chunk:
+                yield decoder.decode(chunk)
+                chunk = f.read(self.CHUNK)
+            yield decoder.decode(b'', final=True) + '<'
+
+    def to_row(self, t):
+        amount = parse_amount(t.get('TRNAMT', '0'))
+        name, memo = t.get('NAME', ''), t.get('MEMO', '')
+        return {'date': datetime.strptime(t['DTPOSTED'][:8], '%Y%m%d').strftime('%Y-%m-%d'), 'amount': amount,
+                'type': 'Income' if amount > 0 else 'Expense', 'category': '',
+                'description': f"{name} {memo}".strip() if memo and memo != name else name or memo}
+
+    def __iter__(self):
+        txn, n, buf = None, 0, ''
+        for chunk in self.chunks():
+            buf += chunk
+            # The text after the last '<' may be a tag cut in half; keep it for the next round
+            cut = buf.rfind('<')
+            if cut <= 0: continue
+            text, buf = buf[:cut], buf[cut:]
+            for closing, tag, value in self.TAG_RE.findall(text):
+                tag = tag.upper()
+                if tag == 'STMTTRN':
+                    if not closing: txn = {}
+                    elif txn is not None:
+                        n += 1
+                        if n > self.start and 'DTPOSTED' in txn:
+                            self.offset = n
+                            yield self.to_row(txn)
+                        txn = None
+                elif txn is not None and not closing and value.strip(): txn[tag] = html.unescape(value.strip())
+
+class XlsxReader:
+    # Reads the first worksheet straight out of the zip with iterparse, dropping each row once
+    # it is yielded, so memory stays flat however long the sheet is. Only the shared string
+    # table is held in full, as Excel requires.
+    NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+    def __init__(self, path, offset=0):
+        self.path, self.start, self.offset = path, offset, offset
+
+    def sheet_path(self, zf):
+        try:
+            sheet = ET.fromstring(zf.read('xl/workbook.xml')).find(f'{self.NS}sheets/{self.NS}sheet')
+            rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+            target = next(r.get('Target') for r in rels if r.get('Id') == sheet.get(f'{self.REL_NS}id'))
+            return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+        except (KeyError, AttributeError, StopIteration): return 'xl/worksheets/sheet1.xml'
+
+    def shared_strings(self, zf):
+        if 'xl/sharedStrings.xml' not in zf.namelist(): return []
+        strings = []
+        with zf.open('xl/sharedStrings.xml') as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag == f'{self.NS}si':
+                    strings.append(''.join(t.text or '' for t in elem.iter(f'{self.NS}t')))
+                    elem.clear()
+        return strings
+
+    @staticmethod
+    def column_index(ref):
+        n = 0
+        for ch in ref:
+            if not ch.isalpha(): break
+            n = n * 26 + ord(ch.upper()) - 64
+        return n - 1
+
+    def rows(self):
+        with zipfile.ZipFile(self.path) as zf:
+            strings = self.shared_strings(zf)
+            with zf.open(self.sheet_path(zf)) as f:
+                sheet_data = None
+                for event, elem in ET.iterparse(f, events=('start', 'end')):
+                    if event == 'start':
+                        if elem.tag == f'{self.NS}sheetData': sheet_data = elem
+                        continue
+                    if elem.tag != f'{self.NS}row': continue
+                    values = {}
+                    for c in elem.iter(f'{self.NS}c'):
+                        kind = c.get('t')
+                        if kind == 'inlineStr': v = ''.join(t.text or '' for t in c.iter(f'{self.NS}t'))
+                        else:
+                            v = c.findtext(f'{self.NS}v')
+                            if v is None: continue
+                            if kind == 's': v = strings[int(v)]
+                        values[self.column_index(c.get('r')) if c.get('r') else len(values)] = v
+                    yield [values.get(i, '') for i in range(max(values) + 1)] if values else []
+                    (sheet_data if sheet_data is not None else elem).clear()
+
+    def header(self):
+        rows = self.rows()
+        try: return [str(v).lower().strip() for v in next(rows, [])]
+        finally: rows.close()
+
+    def __iter__(self):
+        rows = self.rows()
+        try:
+            fieldnames = [str(v).lower().strip() for v in next(rows, [])]
+            n = 0
+            for values in rows:
+                if not any(values): continue
+                n += 1
+                if n <= self.start: continue
+                self.offset = n
+                yield dict(zip(fieldnames, values))
+        finally: rows.close()
+
+# New formats plug in here
+READERS = {'.csv': CsvReader, '.ofx': OfxReader, '.qfx': OfxReader, '.xlsx': XlsxReader}
+
+def get_reader(path, offset=0):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS: raise ValueError(f"Unsupported file type: {ext or os.path.basename(path)}")
+    return READERS[ext](path, offset)
+
+# --- PROFILES ---
+def detect_profile(user_id, columns):
+    # The profile whose mapped columns are all present; the most specific one wins
+    columns, best = set(columns), None
+    for p in db.get_import_profiles(user_id):
+        mapped = {p[f] for f, _ in PROFILE_FIELDS if p[f]}
+        if mapped <= columns and (best is None or len(mapped) > best[0]): best = (len(mapped), p)
+    return best[1] if best else None
+
+def needs_profile(user_id, path):
+    # The file's columns when neither our own headers nor a saved profile can read it, else None
+    columns = get_reader(path).header()
+    if columns is None or DEFAULT_COLUMNS <= set(columns) or detect_profile(user_id, columns): return None
+    return columns
+
+def apply_profile(r, p):
+    col = lambda field: (r.get(p[field]) or '').strip() if p[field] else ''
+    if p['debit_col'] or p['credit_col']:
+        amount = (parse_amount(col('credit_col')) if col('credit_col') else 0.0) - (abs(parse_amount(col('debit_col'))) if col('debit_col') else 0.0)
+    else: amount = parse_amount(col('amount_col'))
+    if p['invert_sign']: amount = -amount
+    if col('type_col'): t_type = 'Income' if col('type_col').lower() in INCOME_WORDS else 'Expense'
+    else: t_type = 'Income' if amount > 0 else 'Expense'
+    d = col('date_col')
+    if p['date_format'] and d: d = datetime.strptime(d, p['date_format']).strftime('%Y-%m-%d')
+    return {'date': d, 'amount': amount, 'type': t_type, 'category': col('category_col'), 'description': col('description_col')}
+
+def normalize_row(r):
+    t_type = (r.get('type') or 'Expense').capitalize()
+    if t_type not in ['Income', 'Expense']: t_type = 'Expense'
+    return {'date': smart_date_parse(str(r['date'])), 'amount': abs(parse_amount(r['amount'])), 'type': t_type,
+            'category': r.get('category') or '', 'description': r.get('description') or '', 'tags': r.get('tags') or ''}
+
+# --- IMPORT ---
+def insert_batch(user_id, acc, batch, guessed, seen, conn):
+    inserted = db.insert_transactions_bulk(user_id, acc, batch, conn, seen)
+    return len(inserted), len(batch) - len(inserted), sum(guessed[i] for i in inserted)
+
+def import_rows(user_id, rows, account_id=None, job=None, profile=None):
+    # With a job, rows must be a reader (see READERS): progress is committed every
+    # CHECKPOINT_ROWS rows and a crash loses at most that many
+    acc = account_id or db.get_accounts(user_id)[0]['account_id']
+    matcher = categorizer.get_matcher(user_id)
+    totals = [job['added'], job['skipped'], job['auto']] if job else [0, 0, 0]
+    done = job['rows_done'] if job else 0
+    if not done: backup.create_snapshot('pre-import', db_path=db.get_db_path(user_id))
+    # Copy counts restart on resume, so identical rows split across a checkpoint can be
+    # taken for duplicates; rare enough to accept for not keeping them in the job row
+    seen, batch, guessed = {}, [], []
+    label = f"Import {job['file_name']}" if job else "Import"
+    conn = db.get_db_connection(user_id)
+    try:
+        # One action for the whole file, across checkpoints and resumes, so one undo takes it all out
+        action_id = db.begin_write(conn, user_id, label, resume=job and job['action_id'])
+        for r in rows:
+            n = normalize_row(apply_profile(r, profile) if profile else r)
+            n['category'], g = categorizer.categorize(matcher, n['category'], n['description'])
+            n['category_auto'] = g
+            batch.append(n)
+            guessed.append(g)
+            done += 1
+            checkpoint = job and done % CHECKPOINT_ROWS == 0
+            if len(batch) < BATCH_ROWS and not checkpoint: continue
+            totals = [t + c for t, c in zip(totals, insert_batch(user_id, acc, batch, guessed, seen, conn))]
+            batch, guessed = [], []
+            if checkpoint:
+                db.checkpoint_import_job(job['job_id'], rows.offset, done, *totals, 'running', action_id, conn)
+                conn.commit()
+                db.begin_write(conn, user_id, resume=action_id)
+        if batch: totals = [t + c for t, c in zip(totals, insert_batch(user_id, acc, batch, guessed, seen, conn))]
+        if job: db.checkpoint_import_job(job['job_id'], rows.offset, done, *totals, 'done', action_id, conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally: conn.close()
+    # Newly imported categories feed the next round of rules
+    if totals[0]: categorizer.learn_rules(user_id)
+    return tuple(totals)
+
+def import_file(user_id, path, account_id=None, profile=None):
+    # Returns (added, skipped, auto, status); status is 'imported', 'resumed' or 'already imported'
+    columns = get_reader(path).header()
+    if profile is None and columns is not None and not DEFAULT_COLUMNS <= set(columns):
+        profile = detect_profile(user_id, columns)
+        if profile is None: raise ValueError(f"No import profile matches the columns: {', '.join(columns)}")
+    file_hash = file_digest(path)
+    job = db.get_import_job(user_id, file_hash)
+    if job and job['status'] == 'done': return 0, 0, 0, 'already imported'
+    status = 'resumed' if job and job['rows_done'] else 'imported'
+    if job is None:
+        db.start_import_job(user_id, file_hash, os.path.basename(path))
+        job = db.get_import_job(user_id, file_hash)
+    return (*import_rows(user_id, get_reader(path, job['byte_offset']), account_id, job, profile), status)
+
+if __name__ == '__main__':
+    # python importer.py duplicates: rows that share account, date, amount and description
+    if sys.argv[1:] != ['duplicates']:
+        print("usage: python importer.py duplicates")
+        sys.exit(1)
+    db.initialize_database()
+    conn = db.get_db_connection()
+    users = conn.execute("SELECT user_id, username FROM users").fetchall()
+    conn.close()
+    for u in users:
+        for r in db.get_duplicate_report(u['user_id']):
+            print(f"{u['username']}: {r['copies']}x {r['date']} {r['amount']:.2f} {r['description']!r} (ids {r['transaction_ids']})")
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import atexit
+import cProfile
+import inspect
+import sqlite3
+import functools
+import threading
+
+# Set FINANCIFY_METRICS=<path> to dump all metrics as JSON on exit,
+# FINANCIFY_SQL_TRACE=1 to time every SQL statement individually.
+METRICS_FILE = os.environ.get('FINANCIFY_METRICS')
+SQL_TRACE = os.environ.get('FINANCIFY_SQL_TRACE') == '1'
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class Metric:
+    __slots__ = ('count', 'total', 'max', 'rows', 'errors', 'hist')
+
+    def __init__(self):
+        self.count, self.total, self.max, self.rows, self.errors = 0, 0.0, 0.0, 0, 0
+        self.hist = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, ms, rows=None, error=False):
+        self.count += 1
+        self.total += ms
+        if ms > self.max: self.max = ms
+        if rows: self.rows += rows
+        if error: self.errors += 1
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.hist[i] += 1
+                return
+        self.hist[-1] += 1
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th call; good enough to tell 2 ms from 200 ms
+        target, seen = q * self.count, 0
+        for i, n in enumerate(self.hist):
+            seen += n
+            if seen >= target: return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+                'p50_ms': self.percentile(0.5), 'p95_ms': self.percentile(0.95), 'max_ms': round(self.max, 3),
+                'total_ms': round(self.total, 3), 'rows': self.rows, 'errors': self.errors,
+                'histogram': dict(zip([f"<={b}ms" for b in BUCKETS_MS] + ['>5000ms'], self.hist))}
+
+_metrics = {}
+_lock = threading.Lock()
+_profile_path = None
+
+def record(name, ms, rows=None, error=False):
+    with _lock:
+        m = _metrics.get(name)
+        if m is None: m = _metrics[name] = Metric()
+        m.record(ms, rows, error)
+
+def row_count(result):
+    if isinstance(result, list): return len(result)
+    return None
+
+def snapshot():
+    with _lock: return {name: m.to_dict() for name, m in sorted(_metrics.items())}
+
+def reset():
+    with _lock: _metrics.clear()
+
+def dump_json(path):
+    with open(path, 'w') as f: json.dump(snapshot(), f, indent=2)
+    return path
+
+def profile_next_action(path):
+    global _profile_path
+    _profile_path = path
+
+def _run(name, fn, args, kwargs, profile):
+    global _profile_path
+    prof = None
+    if profile and _profile_path:
+        path, _profile_path = _profile_path, None
+        prof = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        result = prof.runcall(fn, *args, **kwargs) if prof else fn(*args, **kwargs)
+    except Exception:
+        record(name, (time.perf_counter() - start) * 1000, error=True)
+        raise
+    finally:
+        if prof: prof.dump_stats(path)
+    record(name, (time.perf_counter() - start) * 1000, row_count(result))
+    return result
+
+def _run_iter(name, fn, args, kwargs):
+    # A generator does its work as it is consumed, so the time is from the call to the last row
+    # (the consumer's share included) and rows is what it yielded. Not profiled.
+    start, n, error = time.perf_counter(), 0, False
+    try:
+        for item in fn(*args, **kwargs):
+            n += 1
+            yield item
+    except Exception:
+        error = True
+        raise
+    finally: record(name, (time.perf_counter() - start) * 1000, n, error)
+
+def timed(name, profile=False):
+    def wrap(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs): return _run_iter(name, fn, args, kwargs)
+            inner.__instrumented__ = True
+            return inner
+        @functools.wraps(fn)
+        def inner(*args, **kwargs): return _run(name, fn, args, kwargs, profile)
+        inner.__instrumented__ = True
+        return inner
+    return wrap
+
+class timer:
+    def __init__(self, name): self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, (time.perf_counter() - self.start) * 1000, error=exc_type is not None)
+
+def instrument_module(namespace):
+    prefix = namespace['__name__'].split('.')[-1]
+    for name, fn in list(namespace.items()):
+        if name.startswith('_') or not inspect.isfunction(fn) or fn.__module__ != namespace['__name__']: continue
+        if getattr(fn, '__instrumented__', False): continue
+        namespace[name] = timed(f"{prefix}.{name}")(fn)
+
+def instrument_handlers(cls):
+    # UI entry points: event handlers and panel refreshes. Timer handlers are timed but never
+    # captured by profile_next_action, which is meant for the next thing the user does.
+    for name, fn in list(vars(cls).items()):
+        if inspect.isfunction(fn) and (name.startswith('On') or name == 'RefreshData'):
+            setattr(cls, name, timed(f"{cls.__name__}.{name}", profile=not name.endswith('Timer'))(fn))
+    return cls
+
+# --- SQL TRACING ---
+_SQL_WS = re.compile(r'\s+')
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|-?\b\d+(?:\.\d+)?\b")
+
+def sql_name(sql):
+    return 'sql: ' + _SQL_WS.sub(' ', sql).strip()[:100]
+
+def _trace_statement(sql):
+    # SQLite reports every statement it steps, including implicit BEGINs and each trigger
+    # step (repeated under the outer statement), so counts here exceed the "sql:" counts.
+    # The text has parameters bound in, so literals are folded back to "?"
+    record('sql.trace: ' + sql_name(_SQL_LITERAL.sub('?', sql))[5:], 0.0)
+
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try: return super().execute(sql, params)
+        finally: record(sql_name(sql), (time.perf_counter() - start) * 1000)
+
+    def executemany(self, sql, seq):
+        start = time.perf_counter()
+        try: return super().executemany(sql, seq)
+        finally: record(sql_name(sql), (time.perf_counter() - start) * 1000)
+
+class TracedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_trace_statement)
+
+    def cursor(self, factory=TracedCursor): return super().cursor(factory)
+    def execute(self, sql, params=()): return self.cursor().execute(sql, params)
+    def executemany(self, sql, seq): return self.cursor().executemany(sql, seq)
+
+if METRICS_FILE: atexit.register(dump_json, METRICS_FILE)
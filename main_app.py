@@ -1,6 +1,19 @@
 import wx
 import wx.adv 
 import database as db
+import importer
+import categorizer
+import scheduler
+import alerts
+import anomalies
+import audit
+import forecast
+import analytics
+import instrumentation
+import maintenance
+import backup
+import currency
+import charts
 from datetime import datetime
 import matplotlib
 matplotlib.use('WXAgg')
@@ -8,9 +21,10 @@ from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from matplotlib.figure import Figure
 import csv 
 import os
+import logging
 import webbrowser
-
-CATEGORIES = ['Food', 'Transport', 'Rent', 'Utilities', 'Salary', 'Entertainment', 'Shopping', 'Health', 'Education', 'Groceries', 'Other']
+from array import array
+from collections import OrderedDict
 
 COLOR_WHITE = '#FFFFFF'
 COLOR_BG = '#F5F7FA'
@@ -19,15 +33,19 @@ COLOR_TEXT_SUB = '#7F8C8D'
 COLOR_ACCENT = '#1565C0'
 COLOR_GREEN = '#27AE60'
 COLOR_RED = '#C0392B'
-COLOR_REMAINING = '#BDC3C7'
 
-def smart_date_parse(date_str):
-    formats = ['%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%y']
-    for fmt in formats:
-        try: return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
-        except ValueError: pass
-    return datetime.now().strftime('%Y-%m-%d')
+RECURRING_CHECK_MS = 10 * 60 * 1000
+MAINTENANCE_TICK_MS = 1000
+MAINTENANCE_BUSY_MS = 50
+ID_METRICS = wx.NewIdRef()
+ID_UNDO = wx.NewIdRef()
+ID_REDO = wx.NewIdRef()
+
+def category_names(user_id):
+    # For the category pickers: merged names are left out, their rows show under the target
+    return sorted((c['name'] for c in db.get_categories(user_id) if c['merged_into'] is None and c['name'] != db.TRANSFER_CATEGORY), key=str.lower)
 
+@instrumentation.instrument_handlers
 class MainFrame(wx.Frame):
     def __init__(self, user_id):
         super().__init__(None, title="Financify", size=(1200, 850)) 
@@ -36,7 +54,19 @@ class MainFrame(wx.Frame):
         self.SetBackgroundColour(COLOR_BG)
         self.Center()
         self.Maximize()
+        self.scheduler = scheduler.RecurringScheduler(user_id)
+        self.recurring_error = None
+        self.scheduler.run_due()
+        self.history = audit.UndoStack(user_id)
         self.InitUI()
+        self.recurring_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnRecurringTimer, self.recurring_timer)
+        self.recurring_timer.Start(RECURRING_CHECK_MS)
+        self.maintainers = [maintenance.Maintainer(p) for p in db.get_user_db_paths(user_id)]
+        self.maintenance_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnMaintenanceTimer, self.maintenance_timer)
+        self.maintenance_timer.StartOnce(MAINTENANCE_TICK_MS)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
 
     def InitUI(self):
         main_panel = wx.Panel(self)
@@ -56,6 +86,11 @@ class MainFrame(wx.Frame):
         main_panel.SetSizer(sizer)
         
         self.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.OnTabChanged)
+        self.Bind(wx.EVT_MENU, self.OnShowMetrics, id=ID_METRICS)
+        self.Bind(wx.EVT_MENU, self.OnUndo, id=ID_UNDO)
+        self.Bind(wx.EVT_MENU, self.OnRedo, id=ID_REDO)
+        self.SetAcceleratorTable(wx.AcceleratorTable([(wx.ACCEL_CTRL | wx.ACCEL_SHIFT, ord('M'), ID_METRICS),
+                                                      (wx.ACCEL_CTRL, ord('Z'), ID_UNDO), (wx.ACCEL_CTRL, ord('Y'), ID_REDO)]))
         self.dashboard_panel.RefreshData()
         self.Show()
 
@@ -65,10 +100,61 @@ class MainFrame(wx.Frame):
             current_page.RefreshData()
         event.Skip()
     
-    def RefreshAllTabs(self):
+    def RefreshAllTabs(self, alerts_current=False):
+        # alerts_current: the change already went through the dashboard's alert engine
+        if not alerts_current: self.dashboard_panel.alerts.invalidate()
+        self.history.sync()
         self.dashboard_panel.RefreshData()
         self.reports_panel.RefreshData()
 
+    def OnUndo(self, event):
+        # In a text field Ctrl+Z is the field's own undo
+        focus = wx.Window.FindFocus()
+        if isinstance(focus, wx.TextCtrl) and focus.CanUndo(): return focus.Undo()
+        self.StepHistory(self.history.undo, "Undo")
+
+    def OnRedo(self, event):
+        focus = wx.Window.FindFocus()
+        if isinstance(focus, wx.TextCtrl) and focus.CanRedo(): return focus.Redo()
+        self.StepHistory(self.history.redo, "Redo")
+
+    def StepHistory(self, fn, title):
+        with wx.BusyCursor(): ok, msg = fn()
+        if not ok: return wx.MessageBox(msg, title)
+        self.RefreshAllTabs()
+
+    def OnShowMetrics(self, event):
+        dlg = MetricsDialog(self)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def OnMaintenanceTimer(self, event):
+        # Each step is a few ms; come back sooner while there is work left
+        busy = False
+        try: busy = any(m.step() for m in self.maintainers)
+        except Exception:
+            instrumentation.record('maintenance.step', 0, error=True)
+            logging.exception("Maintenance step failed")
+        self.maintenance_timer.StartOnce(MAINTENANCE_BUSY_MS if busy else MAINTENANCE_TICK_MS)
+
+    def OnClose(self, event):
+        self.maintenance_timer.Stop()
+        self.recurring_timer.Stop()
+        for m in self.maintainers: m.close()
+        event.Skip()
+
+    def OnRecurringTimer(self, event):
+        try:
+            if self.scheduler.run_due(): self.RefreshAllTabs()
+            self.recurring_error = None
+        except Exception as e:
+            instrumentation.record('recurring.run_due', 0, error=True)
+            # The timer retries every few minutes; say so once, not on every failed tick
+            if str(e) != self.recurring_error:
+                self.recurring_error = str(e)
+                wx.MessageBox(f"Recurring transactions could not be posted and will be retried:\n{e}", "Recurring", wx.OK | wx.ICON_ERROR)
+
+@instrumentation.instrument_handlers
 class DashboardPanel(wx.Panel):
     def __init__(self, parent, user_id):
         super().__init__(parent)
@@ -76,6 +162,7 @@ class DashboardPanel(wx.Panel):
         self.SetBackgroundColour(COLOR_WHITE)
         self.account_map = {} 
         self.selected_category = None
+        self.alerts = alerts.BudgetAlerts(user_id)
         self.InitUI()
         self.LoadData()
 
@@ -140,18 +227,21 @@ class DashboardPanel(wx.Panel):
         form_sizer = wx.BoxSizer(wx.VERTICAL)
         form_sizer.Add(header_panel, 0, wx.EXPAND | wx.BOTTOM, 15)
         
-        grid_sizer = wx.FlexGridSizer(rows=6, cols=2, vgap=12, hgap=10)
+        grid_sizer = wx.FlexGridSizer(rows=8, cols=2, vgap=12, hgap=10)
         self.date_picker = wx.adv.DatePickerCtrl(panel, style=wx.adv.DP_DROPDOWN | wx.adv.DP_SHOWCENTURY)
         self.date_picker.SetValue(wx.DateTime.Now())
         self.type_choice = wx.Choice(panel, choices=['Expense', 'Income'])
         self.type_choice.SetSelection(0)
         self.amount_ctrl = wx.TextCtrl(panel, style=wx.TE_PROCESS_ENTER)
         self.amount_ctrl.SetHint("0.00")
+        self.account_choice = wx.Choice(panel)
         
         # --- FIXED: Removed SetHint here ---
-        self.category_choice = wx.ComboBox(panel, choices=CATEGORIES, style=wx.CB_DROPDOWN|wx.CB_READONLY)
+        self.category_choice = wx.ComboBox(panel, choices=category_names(self.user_id), style=wx.CB_DROPDOWN|wx.CB_READONLY)
         
         self.desc_ctrl = wx.TextCtrl(panel, size=(-1, 60), style=wx.TE_MULTILINE) 
+        self.tags_ctrl = wx.TextCtrl(panel)
+        self.tags_ctrl.SetHint("trip, work")
         
         def make_label(text): 
             t = wx.StaticText(panel, label=text)
@@ -163,8 +253,10 @@ class DashboardPanel(wx.Panel):
             (make_label("Date"), 0, wx.ALIGN_CENTER_VERTICAL), (self.date_picker, 1, wx.EXPAND),
             (make_label("Type"), 0, wx.ALIGN_CENTER_VERTICAL), (self.type_choice, 1, wx.EXPAND),
             (make_label("Amount"), 0, wx.ALIGN_CENTER_VERTICAL), (self.amount_ctrl, 1, wx.EXPAND),
+            (make_label("Account"), 0, wx.ALIGN_CENTER_VERTICAL), (self.account_choice, 1, wx.EXPAND),
             (make_label("Category"), 0, wx.ALIGN_CENTER_VERTICAL), (self.category_choice, 1, wx.EXPAND),
-            (make_label("Description"), 0, wx.ALIGN_TOP), (self.desc_ctrl, 1, wx.EXPAND)
+            (make_label("Description"), 0, wx.ALIGN_TOP), (self.desc_ctrl, 1, wx.EXPAND),
+            (make_label("Tags"), 0, wx.ALIGN_CENTER_VERTICAL), (self.tags_ctrl, 1, wx.EXPAND)
         ])
         grid_sizer.AddGrowableCol(1, 1)
         form_sizer.Add(grid_sizer, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 15)
@@ -188,7 +280,7 @@ class DashboardPanel(wx.Panel):
         main_sizer.Add(lbl, 0, wx.ALL, 20)
         
         budget_sizer = wx.BoxSizer(wx.HORIZONTAL)
-        budget_lbl = wx.StaticText(panel, label="Total Budget: ₹")
+        budget_lbl = wx.StaticText(panel, label=f"Total Budget: {currency.symbol()}")
         budget_lbl.SetFont(wx.Font(11, wx.FONTFAMILY_SWISS, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
         budget_sizer.Add(budget_lbl, 0, wx.ALIGN_CENTER_VERTICAL)
         self.budget_ctrl = wx.TextCtrl(panel, value="0.00", size=(100, -1))
@@ -198,13 +290,17 @@ class DashboardPanel(wx.Panel):
         budget_sizer.Add(set_btn, 0)
         main_sizer.Add(budget_sizer, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 20)
         
-        self.income_text = wx.StaticText(panel, label="Income: ₹0.00")
-        self.spent_text = wx.StaticText(panel, label="Spent: ₹0.00")
-        self.remaining_text = wx.StaticText(panel, label="Remaining: ₹0.00")
-        self.net_text = wx.StaticText(panel, label="Net Savings: ₹0.00")
-        for t in [self.income_text, self.spent_text, self.remaining_text, self.net_text]:
+        self.income_text = wx.StaticText(panel, label=f"Income: {currency.fmt(0)}")
+        self.spent_text = wx.StaticText(panel, label=f"Spent: {currency.fmt(0)}")
+        self.remaining_text = wx.StaticText(panel, label=f"Remaining: {currency.fmt(0)}")
+        self.net_text = wx.StaticText(panel, label=f"Net Savings: {currency.fmt(0)}")
+        self.projected_text = wx.StaticText(panel, label=f"Projected Spend: {currency.fmt(0)}")
+        for t in [self.income_text, self.spent_text, self.remaining_text, self.net_text, self.projected_text]:
             t.SetFont(wx.Font(13, wx.FONTFAMILY_SWISS, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
             main_sizer.Add(t, 0, wx.LEFT | wx.RIGHT | wx.BOTTOM, 12)
+        self.fx_text = wx.StaticText(panel, label="")
+        self.fx_text.SetForegroundColour(COLOR_RED)
+        main_sizer.Add(self.fx_text, 0, wx.LEFT | wx.RIGHT | wx.BOTTOM, 12)
         self.income_text.SetForegroundColour(COLOR_GREEN)
         self.spent_text.SetForegroundColour(COLOR_RED)
         panel.SetSizer(main_sizer)
@@ -223,6 +319,7 @@ class DashboardPanel(wx.Panel):
         self.category_list.InsertColumn(1, "Limit", width=100)
         self.category_list.InsertColumn(2, "Spent", width=100)
         self.category_list.InsertColumn(3, "Left", width=100)
+        self.category_list.InsertColumn(4, "Projected", width=100)
         self.category_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnCategorySelected)
         layout.Add(self.category_list, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 15)
         btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -233,6 +330,9 @@ class DashboardPanel(wx.Panel):
         self.delete_cat_btn.Bind(wx.EVT_BUTTON, self.OnDeleteCategory)
         self.delete_cat_btn.Disable()
         btn_sizer.Add(self.delete_cat_btn, 1, wx.LEFT, 5)
+        copy_btn = wx.Button(panel, label="Copy Plan")
+        copy_btn.Bind(wx.EVT_BUTTON, self.OnCopyPlan)
+        btn_sizer.Add(copy_btn, 1, wx.LEFT, 5)
         layout.Add(btn_sizer, 0, wx.EXPAND | wx.ALL, 15)
         panel.SetSizer(layout)
         return panel
@@ -255,7 +355,13 @@ class DashboardPanel(wx.Panel):
 
     def LoadData(self):
         accounts = db.get_accounts(self.user_id)
-        self.default_account_id = accounts[0]['account_id'] if accounts else None
+        selected = self.account_choice.GetSelection()
+        self.account_ids = [a['account_id'] for a in accounts]
+        self.account_choice.Set([f"{a['account_name']} ({a['currency']})" for a in accounts])
+        if accounts: self.account_choice.SetSelection(selected if 0 <= selected < len(accounts) else 0)
+        category = self.category_choice.GetValue()
+        self.category_choice.Set(category_names(self.user_id))
+        if category: self.category_choice.SetStringSelection(category)
 
     def RefreshData(self):
         self.LoadData()
@@ -264,62 +370,45 @@ class DashboardPanel(wx.Panel):
         data = db.get_dashboard_numbers(self.user_id, month, year)
         
         self.budget_ctrl.SetValue(f"{data['budget']:.2f}")
-        self.income_text.SetLabel(f"Income: ₹{data['income']:.2f}")
-        self.spent_text.SetLabel(f"Spent: ₹{data['spent']:.2f}")
-        self.remaining_text.SetLabel(f"Remaining: ₹{data['remaining']:.2f}")
-        self.net_text.SetLabel(f"Net Savings: ₹{data['net']:.2f}")
+        self.income_text.SetLabel(f"Income: {currency.fmt(data['income'])}")
+        self.spent_text.SetLabel(f"Spent: {currency.fmt(data['spent'])}")
+        self.remaining_text.SetLabel(f"Remaining: {currency.fmt(data['remaining'])}")
+        self.net_text.SetLabel(f"Net Savings: {currency.fmt(data['net'])}")
         
         if data['remaining'] < 0: self.remaining_text.SetForegroundColour(COLOR_RED)
         else: self.remaining_text.SetForegroundColour(COLOR_ACCENT) 
         if data['net'] < 0: self.net_text.SetForegroundColour(COLOR_RED)
         else: self.net_text.SetForegroundColour(COLOR_GREEN)
 
-        self.pie_axes.clear()
-        total_budget = data['budget']
-        expense_data = db.get_expense_data_for_pie_chart(self.user_id, month, year)
-        
-        labels, sizes, colors = [], [], []
-        std_colors = ['#3498DB', '#E74C3C', '#2ECC71', '#F1C40F', '#9B59B6', '#E67E22', '#1ABC9C', '#34495E']
-        
-        total_spent = 0
-        for i, row in enumerate(expense_data):
-            labels.append(row['category'])
-            sizes.append(row['total'])
-            colors.append(std_colors[i % len(std_colors)])
-            total_spent += row['total']
-            
-        if total_budget > 0:
-            remaining = total_budget - total_spent
-            if remaining > 0:
-                labels.append("Remaining")
-                sizes.append(remaining)
-                colors.append(COLOR_REMAINING)
-            self.pie_axes.set_title(f'Monthly Budget: ₹{total_budget:.0f}')
-        else:
-            self.pie_axes.set_title(f'Spending Breakdown')
+        self.forecast = forecast.project_month(self.user_id, today.date())
+        projected = self.forecast['total_projected']
+        self.projected_text.SetLabel(f"Projected Spend: {currency.fmt(projected)}")
+        if data['budget'] > 0 and projected > data['budget']: self.projected_text.SetForegroundColour(COLOR_RED)
+        else: self.projected_text.SetForegroundColour(COLOR_TEXT_SUB)
+        missing = db.get_rate_cache().missing
+        self.fx_text.SetLabel(f"No exchange rates for {', '.join(sorted(missing))}: counted 1:1" if missing else "")
 
-        if not sizes:
-            self.pie_axes.text(0.5, 0.5, 'No Data', ha='center', va='center')
-        else:
-            def my_autopct(pct): return '%1.1f%%' % pct if pct > 5 else '' 
-            wedges, texts, autotexts = self.pie_axes.pie(sizes, labels=None, autopct=my_autopct, startangle=90, colors=colors)
-            self.pie_axes.legend(wedges, labels, title="Categories", loc="center left", bbox_to_anchor=(0.9, 0, 0.5, 1))
+        self.pie_axes.clear()
+        charts.draw_budget_pie(self.pie_axes, db.get_expense_data_for_pie_chart(self.user_id, month, year), data['budget'], projected)
 
-        self.pie_figure.tight_layout()
-        self.pie_canvas.draw()
+        with instrumentation.timer('chart.pie_draw'):
+            self.pie_figure.tight_layout()
+            self.pie_canvas.draw()
         self.RefreshCategoryBudgets()
         self.Layout()
 
     def RefreshCategoryBudgets(self):
         self.category_list.DeleteAllItems()
         today = datetime.now()
-        cat_budgets = db.get_category_budgets_with_spending(self.user_id, today.month, today.year)
+        cat_budgets = self.alerts.rows(today.date())
         for index, item in enumerate(cat_budgets):
             remaining = item['budget'] - item['spent']
             self.category_list.InsertItem(index, item['category'])
-            self.category_list.SetItem(index, 1, f"₹{item['budget']:.2f}")
-            self.category_list.SetItem(index, 2, f"₹{item['spent']:.2f}")
-            self.category_list.SetItem(index, 3, f"₹{remaining:.2f}")
+            self.category_list.SetItem(index, 1, currency.fmt(item['budget']))
+            self.category_list.SetItem(index, 2, currency.fmt(item['spent']))
+            self.category_list.SetItem(index, 3, currency.fmt(remaining))
+            projected = self.forecast['projected'].get(item['category'], item['spent'])
+            self.category_list.SetItem(index, 4, currency.fmt(projected))
             if remaining < 0: self.category_list.SetItemTextColour(index, COLOR_RED)
             else: self.category_list.SetItemTextColour(index, COLOR_ACCENT)
         self.selected_category = None
@@ -333,6 +422,7 @@ class DashboardPanel(wx.Panel):
             amount_str = self.amount_ctrl.GetValue()
             category = self.category_choice.GetValue()
             description = self.desc_ctrl.GetValue()
+            tags = self.tags_ctrl.GetValue()
 
             if not amount_str: raise ValueError("Please enter an amount.")
             try: amount = float(amount_str)
@@ -340,19 +430,15 @@ class DashboardPanel(wx.Panel):
             if amount <= 0: raise ValueError("Amount must be greater than 0.")
             if not category: raise ValueError("Please select a category.")
 
-            if trans_type == 'Expense':
-                cat_budgets = db.get_category_budgets_with_spending(self.user_id, datetime.now().month, datetime.now().year)
-                this_cat = next((item for item in cat_budgets if item['category'] == category), None)
-                if this_cat and this_cat['budget'] > 0:
-                    if (this_cat['spent'] + float(amount)) > this_cat['budget']:
-                         wx.MessageBox(f"⚠️ Alert: This transaction exceeds your {category} budget!", "Budget Warning", wx.OK|wx.ICON_WARNING)
-
-            success, message, _ = db.add_transaction(self.user_id, self.default_account_id, date_str, amount, trans_type, category, description, tags="")
+            account_id = self.account_ids[self.account_choice.GetSelection()] if self.account_ids else None
+            success, message, _ = db.add_transaction(self.user_id, account_id, date_str, amount, trans_type, category, description, tags)
             if not success: raise Exception(message)
+            fired = self.alerts.record(account_id, date_str, amount, trans_type, category)
             
             wx.MessageBox("Transaction added successfully!", "Success", wx.OK | wx.ICON_INFORMATION)
+            if fired: wx.MessageBox("⚠️ " + "\n".join(alerts.describe(a) for a in fired), "Budget Warning", wx.OK | wx.ICON_WARNING)
             self.ClearForm()
-            wx.GetApp().GetTopWindow().RefreshAllTabs()
+            wx.GetApp().GetTopWindow().RefreshAllTabs(alerts_current=True)
         except Exception as e: wx.MessageBox(f"Error: {str(e)}", "Input Error", wx.OK | wx.ICON_ERROR)
 
     def ClearForm(self):
@@ -361,6 +447,7 @@ class DashboardPanel(wx.Panel):
         self.amount_ctrl.SetValue("")
         self.category_choice.SetSelection(wx.NOT_FOUND)
         self.desc_ctrl.SetValue("")
+        self.tags_ctrl.SetValue("")
 
     def OnSetBudget(self, event):
         try:
@@ -369,6 +456,7 @@ class DashboardPanel(wx.Panel):
             amount = float(val)
             if amount < 0: raise ValueError
             db.set_monthly_budget(self.user_id, datetime.now().month, datetime.now().year, amount)
+            self.alerts.invalidate()
             self.RefreshData()
         except ValueError: wx.MessageBox("Please enter a valid number for the budget.", "Error")
 
@@ -378,9 +466,8 @@ class DashboardPanel(wx.Panel):
     
     def OnAddEditCategory(self, event):
         today = datetime.now()
-        all_cats = set(CATEGORIES)
-        current_budgets = db.get_category_budgets_with_spending(self.user_id, today.month, today.year)
-        used_cats = {item['category'] for item in current_budgets}
+        all_cats = set(category_names(self.user_id))
+        used_cats = {item['category'] for item in self.alerts.rows(today.date())}
         available_cats = [c for c in all_cats if c not in used_cats and c != 'Salary']
         available_cats.sort()
         
@@ -390,19 +477,78 @@ class DashboardPanel(wx.Panel):
 
         dlg = CategoryBudgetDialog(self, available_cats)
         if dlg.ShowModal() == wx.ID_OK:
-            cat, amt = dlg.GetValues()
-            if cat and amt > 0:
-                db.set_category_budget(self.user_id, cat, amt, today.month, today.year)
-                self.RefreshData()
+            try:
+                cat, amt, levels = dlg.GetValues()
+                if cat and amt > 0:
+                    db.set_category_budget(self.user_id, cat, amt, today.month, today.year, levels)
+                    self.alerts.invalidate()
+                    self.RefreshData()
+            except ValueError as e: wx.MessageBox(str(e), "Error")
         dlg.Destroy()
+
+    def OnCopyPlan(self, event):
+        today = datetime.now()
+        months = wx.GetNumberFromUser("Copy this month's budgets to how many following months?\nMonths that already have a budget keep it.",
+                                      "Months", "Copy Budget Plan", 12, 1, 120, self)
+        if months < 1: return
+        success, message, _ = db.copy_budget_plan(self.user_id, today.month, today.year, alerts.following_months(today.month, today.year, months))
+        wx.MessageBox(message, "Copy Budget Plan" if success else "Error")
     
     def OnDeleteCategory(self, event):
         if not self.selected_category: return
         if wx.MessageBox(f"Remove budget limit for '{self.selected_category}'?", "Confirm Delete", wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
             db.delete_category_budget(self.user_id, self.selected_category, datetime.now().month, datetime.now().year)
+            self.alerts.invalidate()
             wx.MessageBox(f"Budget limit for '{self.selected_category}' has been removed.\nNote: If you have existing expenses, the category will remain in the list.", "Success")
             self.RefreshData()
 
+class TransactionListCtrl(wx.ListCtrl):
+    # Virtual list: holds the filtered ids and a few recently shown pages of rows, so memory
+    # stays flat however large the ledger is
+    COLUMNS = [("Date", 120, 'date'), ("Type", 100, None), ("Amount", 120, None), ("Category", 150, 'category'),
+               ("Account", 120, 'account_name'), ("Description", 300, 'description'), ("Tags", 150, 'tags')]
+    PAGE_ROWS = 200
+    CACHED_PAGES = 5
+
+    def __init__(self, parent, user_id):
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_HRULES | wx.LC_VRULES)
+        self.user_id, self.ids, self.pages = user_id, array('q'), OrderedDict()
+        for i, (name, width, _) in enumerate(self.COLUMNS):
+            self.InsertColumn(i, name, width=width, format=wx.LIST_FORMAT_RIGHT if name == "Amount" else wx.LIST_FORMAT_LEFT)
+        self.attrs = {}
+        for key, colour in [('Income', COLOR_GREEN), ('Expense', COLOR_RED), ('Transfer', COLOR_ACCENT)]:
+            self.attrs[key] = wx.ItemAttr()
+            self.attrs[key].SetTextColour(colour)
+
+    def Load(self, search_term=""):
+        self.ids = db.get_transaction_ids(self.user_id, search_term)
+        self.pages.clear()
+        self.SetItemCount(len(self.ids))
+        self.Refresh()
+
+    def GetRow(self, index):
+        page = index // self.PAGE_ROWS
+        if page in self.pages: self.pages.move_to_end(page)
+        else:
+            start = page * self.PAGE_ROWS
+            self.pages[page] = {r.transaction_id: r for r in db.get_transactions_by_ids(self.user_id, self.ids[start:start + self.PAGE_ROWS])}
+            if len(self.pages) > self.CACHED_PAGES: self.pages.popitem(last=False)
+        return self.pages[page].get(self.ids[index])
+
+    def OnGetItemText(self, item, col):
+        r = self.GetRow(item)
+        if r is None: return ""
+        field = self.COLUMNS[col][2]
+        if field: return r[field] or ""
+        if col == 1: return 'Transfer' if r.transfer_id else r.type
+        return f"{currency.symbol(r.currency)}{r.amount}" if r.type == 'Expense' else f"+{currency.symbol(r.currency)}{r.amount}"
+
+    def OnGetItemAttr(self, item):
+        r = self.GetRow(item)
+        if r is None: return None
+        return self.attrs['Transfer' if r.transfer_id else r.type]
+
+@instrumentation.instrument_handlers
 class ReportsPanel(wx.Panel):
     def __init__(self, parent, user_id):
         super().__init__(parent)
@@ -412,38 +558,55 @@ class ReportsPanel(wx.Panel):
 
     def InitUI(self):
         main_sizer = wx.BoxSizer(wx.VERTICAL)
+        top_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.bar_chart_panel = self.CreateBarChartPanel(self)
-        main_sizer.Add(self.bar_chart_panel, 1, wx.EXPAND | wx.ALL, 15)
+        top_sizer.Add(self.bar_chart_panel, 3, wx.EXPAND | wx.RIGHT, 10)
+        top_sizer.Add(self.CreateAnomalyPanel(self), 2, wx.EXPAND)
+        main_sizer.Add(top_sizer, 1, wx.EXPAND | wx.ALL, 15)
 
         toolbar_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.search_ctrl = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
-        self.search_ctrl.SetDescriptiveText("Search transactions...")
+        self.search_ctrl.SetDescriptiveText("Search, #tag, or category:Food amount>500 date:2026-01..2026-03 -desc:refund")
         self.search_ctrl.Bind(wx.EVT_TEXT_ENTER, self.OnSearch)
         self.search_ctrl.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.OnSearch)
         toolbar_sizer.Add(self.search_ctrl, 1, wx.EXPAND | wx.RIGHT, 10)
-        self.import_btn = wx.Button(self, label="Import CSV")
-        self.import_btn.Bind(wx.EVT_BUTTON, self.OnImportCSV)
+        self.import_btn = wx.Button(self, label="Import")
+        self.import_btn.Bind(wx.EVT_BUTTON, self.OnImport)
         toolbar_sizer.Add(self.import_btn, 0, wx.RIGHT, 5)
+        self.profiles_btn = wx.Button(self, label="Import Profiles")
+        self.profiles_btn.Bind(wx.EVT_BUTTON, self.OnImportProfiles)
+        toolbar_sizer.Add(self.profiles_btn, 0, wx.RIGHT, 5)
         self.export_btn = wx.Button(self, label="Export CSV")
         self.export_btn.Bind(wx.EVT_BUTTON, self.OnExportCSV)
         toolbar_sizer.Add(self.export_btn, 0, wx.RIGHT, 5)
+        self.accounts_btn = wx.Button(self, label="Accounts")
+        self.accounts_btn.Bind(wx.EVT_BUTTON, self.OnAccounts)
+        toolbar_sizer.Add(self.accounts_btn, 0, wx.RIGHT, 5)
+        self.categories_btn = wx.Button(self, label="Categories")
+        self.categories_btn.Bind(wx.EVT_BUTTON, self.OnCategories)
+        toolbar_sizer.Add(self.categories_btn, 0, wx.RIGHT, 5)
+        self.tags_btn = wx.Button(self, label="Tags")
+        self.tags_btn.Bind(wx.EVT_BUTTON, self.OnTagSpending)
+        toolbar_sizer.Add(self.tags_btn, 0, wx.RIGHT, 5)
+        self.recurring_btn = wx.Button(self, label="Recurring")
+        self.recurring_btn.Bind(wx.EVT_BUTTON, self.OnManageRecurring)
+        toolbar_sizer.Add(self.recurring_btn, 0, wx.RIGHT, 5)
         self.report_btn = wx.Button(self, label="HTML Report")
         self.report_btn.Bind(wx.EVT_BUTTON, self.OnGenerateReport)
         toolbar_sizer.Add(self.report_btn, 0, wx.RIGHT, 5)
+        self.history_btn = wx.Button(self, label="History")
+        self.history_btn.Bind(wx.EVT_BUTTON, self.OnHistory)
+        toolbar_sizer.Add(self.history_btn, 0, wx.RIGHT, 5)
+        self.backup_btn = wx.Button(self, label="Backups")
+        self.backup_btn.Bind(wx.EVT_BUTTON, self.OnBackups)
+        toolbar_sizer.Add(self.backup_btn, 0, wx.RIGHT, 5)
         self.reset_btn = wx.Button(self, label="Reset All Data")
         self.reset_btn.SetForegroundColour(COLOR_RED)
         self.reset_btn.Bind(wx.EVT_BUTTON, self.OnReset)
         toolbar_sizer.Add(self.reset_btn, 0)
         main_sizer.Add(toolbar_sizer, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
 
-        self.trans_list = wx.ListCtrl(self, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_VRULES)
-        self.trans_list.InsertColumn(0, "ID", width=0)
-        self.trans_list.InsertColumn(1, "Date", width=120)
-        self.trans_list.InsertColumn(2, "Type", width=100)
-        self.trans_list.InsertColumn(3, "Amount", width=120, format=wx.LIST_FORMAT_RIGHT)
-        self.trans_list.InsertColumn(4, "Category", width=150)
-        self.trans_list.InsertColumn(5, "Account", width=0)
-        self.trans_list.InsertColumn(6, "Description", width=300)
+        self.trans_list = TransactionListCtrl(self, self.user_id)
         main_sizer.Add(self.trans_list, 2, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 15)
         self.SetSizer(main_sizer)
         self.trans_list.Bind(wx.EVT_LIST_ITEM_RIGHT_CLICK, self.OnRightClickTransaction)
@@ -453,138 +616,249 @@ class ReportsPanel(wx.Panel):
         panel = wx.Panel(parent, style=wx.BORDER_SIMPLE)
         panel.SetBackgroundColour(COLOR_WHITE)
         sizer = wx.BoxSizer(wx.VERTICAL)
+        range_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.range_choice = wx.Choice(panel, choices=[name for name, _ in analytics.RANGES])
+        self.range_choice.SetSelection(0)
+        self.range_choice.Bind(wx.EVT_CHOICE, self.OnRangeChanged)
+        range_sizer.Add(self.range_choice, 0, wx.RIGHT, 5)
+        self.granularity_choice = wx.Choice(panel, choices=['Auto'] + [g.capitalize() for g in analytics.GRANULARITIES])
+        self.granularity_choice.SetSelection(0)
+        self.granularity_choice.Bind(wx.EVT_CHOICE, self.OnRangeChanged)
+        range_sizer.Add(self.granularity_choice, 0)
+        sizer.Add(range_sizer, 0, wx.ALIGN_RIGHT | wx.ALL, 5)
         self.bar_figure = Figure(figsize=(5, 2.5)) 
         self.bar_figure.set_facecolor(COLOR_WHITE)
         self.bar_axes = self.bar_figure.add_subplot(111) 
+        self.bar_figure.subplots_adjust(bottom=0.2)
         self.bar_canvas = FigureCanvas(panel, -1, self.bar_figure)
         sizer.Add(self.bar_canvas, 1, wx.EXPAND | wx.ALL, 5)
         panel.SetSizer(sizer)
         return panel
 
+    def CreateAnomalyPanel(self, parent):
+        panel = wx.Panel(parent, style=wx.BORDER_SIMPLE)
+        panel.SetBackgroundColour(COLOR_WHITE)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        title = wx.StaticText(panel, label="Unusual charges")
+        title.SetFont(wx.Font(11, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
+        sizer.Add(title, 0, wx.ALL, 5)
+        self.anomaly_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        for i, (name, width) in enumerate([("Date", 90), ("Amount", 100), ("Description", 160), ("Why", 220)]):
+            self.anomaly_list.InsertColumn(i, name, width=width, format=wx.LIST_FORMAT_RIGHT if name == "Amount" else wx.LIST_FORMAT_LEFT)
+        sizer.Add(self.anomaly_list, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        dismiss_btn = wx.Button(panel, label="Dismiss")
+        dismiss_btn.Bind(wx.EVT_BUTTON, self.OnDismissAnomaly)
+        btn_sizer.Add(dismiss_btn, 0, wx.RIGHT, 5)
+        check_btn = wx.Button(panel, label="Check All History")
+        check_btn.Bind(wx.EVT_BUTTON, self.OnCheckHistory)
+        btn_sizer.Add(check_btn, 0)
+        sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT | wx.ALL, 5)
+        panel.SetSizer(sizer)
+        return panel
+
+    def LoadAnomalies(self):
+        self.anomaly_list.DeleteAllItems()
+        self.anomalies = db.get_anomalies(self.user_id)
+        for i, a in enumerate(self.anomalies):
+            self.anomaly_list.InsertItem(i, a['date'])
+            self.anomaly_list.SetItem(i, 1, currency.fmt(abs(a['amount']), a['currency']))
+            self.anomaly_list.SetItem(i, 2, a['description'] or '')
+            self.anomaly_list.SetItem(i, 3, anomalies.describe(a))
+
+    def OnDismissAnomaly(self, event):
+        idx = self.anomaly_list.GetFirstSelected()
+        if idx == -1: return
+        a = self.anomalies[idx]
+        db.dismiss_anomaly(self.user_id, a['transaction_id'], a['kind'])
+        self.LoadAnomalies()
+
+    def OnCheckHistory(self, event):
+        with wx.BusyCursor(): rows, flags = anomalies.backfill(self.user_id)
+        self.LoadAnomalies()
+        wx.MessageBox(f"Checked {rows} expenses: {flags} look unusual.", "Unusual charges")
+
     def RefreshData(self, search_term=""):
-        bar_data = db.get_monthly_comparison_data(self.user_id)
+        months = analytics.RANGES[self.range_choice.GetSelection()][1]
+        granularity = None if self.granularity_choice.GetSelection() == 0 else self.granularity_choice.GetStringSelection().lower()
+        with db.read_snapshot(self.user_id) as snap: series = analytics.get_display_series(self.user_id, months, granularity, conn=snap)
         self.bar_axes.clear()
-        if not bar_data: 
-            self.bar_axes.text(0.5, 0.5, 'No Data Available', ha='center')
-        else:
-            import numpy as np
-            months = [r['month'] for r in bar_data]
-            income = [r['income'] for r in bar_data]
-            expense = [r['expense'] for r in bar_data]
-            x = np.arange(len(months))
-            width = 0.35
-            self.bar_axes.bar(x - width/2, income, width, label='Income', color=COLOR_GREEN)
-            self.bar_axes.bar(x + width/2, expense, width, label='Expense', color=COLOR_RED)
-            self.bar_axes.set_ylabel('Amount (₹)')
-            self.bar_axes.set_title('Income vs Expenses Trend')
-            self.bar_axes.set_xticks(x)
-            self.bar_axes.set_xticklabels(months)
-            self.bar_axes.legend()
-            self.bar_figure.autofmt_xdate()
-        self.bar_canvas.draw()
-        
-        self.trans_list.DeleteAllItems()
-        rows = db.get_transactions_by_filter(self.user_id, search_term)
-        for i, r in enumerate(rows):
-            self.trans_list.InsertItem(i, str(r['transaction_id']))
-            self.trans_list.SetItem(i, 1, r['date'])
-            self.trans_list.SetItem(i, 2, r['type'])
-            v = f"₹{r['amount']}" if r['type']=='Expense' else f"+₹{r['amount']}"
-            self.trans_list.SetItem(i, 3, v)
-            self.trans_list.SetItem(i, 4, r['category'])
-            self.trans_list.SetItem(i, 5, r['account_name'])
-            self.trans_list.SetItem(i, 6, r['description'])
-            if r['type'] == 'Income': self.trans_list.SetItemTextColour(i, COLOR_GREEN)
-            else: self.trans_list.SetItemTextColour(i, COLOR_RED)
+        charts.draw_trend(self.bar_axes, series)
+        with instrumentation.timer('chart.bar_draw'): self.bar_canvas.draw()
+        with instrumentation.timer('anomalies.scan'): anomalies.scan(self.user_id)
+        self.LoadAnomalies()
+        try:
+            with instrumentation.timer('list.transactions_populate'): self.trans_list.Load(search_term)
+        except ValueError as e: wx.MessageBox(f"Search: {e}", "Search", wx.OK | wx.ICON_WARNING)
     
     def OnSearch(self, event): self.RefreshData(self.search_ctrl.GetValue())
 
+    def OnRangeChanged(self, event): self.RefreshData(self.search_ctrl.GetValue())
+
     def OnRightClickTransaction(self, event):
-        self.selected_trans_id = int(self.trans_list.GetItemText(event.GetIndex(), 0))
+        self.selected_trans_id = self.trans_list.ids[event.GetIndex()]
         menu = wx.Menu()
         menu.Append(1, "Edit")
         menu.Append(2, "Delete")
         menu.Append(3, "Clone")
+        menu.Append(4, "Make Recurring")
+        menu.Append(5, "Add Tags to Selected")
+        menu.Append(6, "Remove Tags from Selected")
         self.Bind(wx.EVT_MENU, self.OnEdit, id=1)
         self.Bind(wx.EVT_MENU, self.OnDelete, id=2)
         self.Bind(wx.EVT_MENU, self.OnClone, id=3)
+        self.Bind(wx.EVT_MENU, self.OnMakeRecurring, id=4)
+        self.Bind(wx.EVT_MENU, lambda e: self.OnTagSelected(db.add_tags, "Add tags (comma separated)"), id=5)
+        self.Bind(wx.EVT_MENU, lambda e: self.OnTagSelected(db.remove_tags, "Remove tags (comma separated)"), id=6)
         self.PopupMenu(menu)
         menu.Destroy()
 
     def OnClone(self, event):
-        trans = [t for t in db.get_transactions_by_filter(self.user_id) if t['transaction_id'] == self.selected_trans_id][0]
+        trans = db.get_transaction_by_id(self.user_id, self.selected_trans_id)
+        if not trans: return
+        if trans['transfer_id']: return wx.MessageBox("Transfers are entered from Accounts > Transfer.", "Transfer")
         db.add_transaction(self.user_id, trans['account_id'], datetime.now().strftime('%Y-%m-%d'), 
-                           abs(trans['amount']), trans['type'], trans['category'], trans['description'] + " (Clone)", "")
+                           abs(trans['amount']), trans['type'], trans['category'], trans['description'] + " (Clone)", trans['tags'])
         wx.GetApp().GetTopWindow().RefreshAllTabs()
         wx.MessageBox("Transaction cloned successfully!", "Success")
 
+    def OnMakeRecurring(self, event):
+        trans = db.get_transaction_by_id(self.user_id, self.selected_trans_id)
+        if not trans: return
+        if trans['transfer_id']: return wx.MessageBox("Transfers can't be made recurring yet.", "Transfer")
+        dlg = RecurringDialog(self)
+        if dlg.ShowModal() == wx.ID_OK:
+            frequency, interval = dlg.GetValues()
+            success, message, _ = scheduler.create_rule_from_transaction(self.user_id, trans, frequency, interval)
+            if success:
+                top = wx.GetApp().GetTopWindow()
+                top.scheduler.reload()
+                if top.scheduler.run_due(): top.RefreshAllTabs()
+                wx.MessageBox(f"'{trans['description']}' will repeat {frequency.lower()}.", "Recurring")
+            else: wx.MessageBox(message, "Error", wx.ICON_ERROR)
+        dlg.Destroy()
+
+    def OnTagSelected(self, fn, prompt):
+        ids, i = [], self.trans_list.GetFirstSelected()
+        while i != -1:
+            ids.append(self.trans_list.ids[i])
+            i = self.trans_list.GetNextSelected(i)
+        with wx.TextEntryDialog(self, prompt, f"Tags ({len(ids)} transactions)") as dlg:
+            if dlg.ShowModal() != wx.ID_OK: return
+            ok, msg, _ = fn(self.user_id, ids, dlg.GetValue())
+        if not ok: wx.MessageBox(msg)
+        self.RefreshData(self.search_ctrl.GetValue())
+
+    def OnCategories(self, event):
+        dlg = CategoriesDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+        wx.GetApp().GetTopWindow().RefreshAllTabs()
+
+    def OnTagSpending(self, event):
+        dlg = TagSpendingDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def OnManageRecurring(self, event):
+        dlg = RecurringRulesDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+        wx.GetApp().GetTopWindow().scheduler.reload()
+
     def OnEdit(self, event):
-        trans = [t for t in db.get_transactions_by_filter(self.user_id) if t['transaction_id'] == self.selected_trans_id]
+        trans = db.get_transaction_by_id(self.user_id, self.selected_trans_id)
         if not trans: return
-        dlg = TransactionEditDialog(self, self.user_id, trans[0], db.get_accounts(self.user_id))
+        if trans['transfer_id']: return wx.MessageBox("This is one side of a transfer. Delete it and enter the transfer again.", "Transfer")
+        dlg = TransactionEditDialog(self, self.user_id, trans, db.get_accounts(self.user_id))
         if dlg.ShowModal() == wx.ID_OK: wx.GetApp().GetTopWindow().RefreshAllTabs()
         dlg.Destroy()
 
     def OnDelete(self, event):
-        if wx.MessageBox("Are you sure you want to delete this transaction?", "Confirm Delete", wx.YES_NO | wx.ICON_WARNING) == wx.YES:
+        if wx.MessageBox("Are you sure you want to delete this transaction?\nDeleting one side of a transfer deletes both.", "Confirm Delete", wx.YES_NO | wx.ICON_WARNING) == wx.YES:
             db.delete_transaction(self.selected_trans_id, self.user_id)
             wx.GetApp().GetTopWindow().RefreshAllTabs()
 
     def OnGenerateReport(self, event):
         path = os.path.abspath("report.html")
-        rows = db.get_transactions_by_filter(self.user_id)
-        html = "<html><body style='font-family: sans-serif; padding: 20px;'>"
-        html += "<h1 style='color: #2C3E50;'>Financify Transaction Report</h1>"
-        html += f"<p>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>"
-        html += "<table border='1' cellspacing='0' cellpadding='8' style='width:100%; border-collapse: collapse;'>"
-        html += "<tr style='background-color: #ECF0F1;'><th>Date</th><th>Type</th><th>Amount</th><th>Category</th><th>Description</th></tr>"
-        for r in rows:
-            color = "green" if r['type']=='Income' else "red"
-            html += f"<tr><td>{r['date']}</td><td>{r['type']}</td><td style='color:{color}; font-weight:bold;'>{r['amount']}</td><td>{r['category']}</td><td>{r['description']}</td></tr>"
-        html += "</table></body></html>"
-        with open(path, "w") as f: f.write(html)
+        # Written row by row so a large ledger never sits in memory as one string
+        with open(path, "w") as f:
+            f.write("<html><body style='font-family: sans-serif; padding: 20px;'>")
+            f.write("<h1 style='color: #2C3E50;'>Financify Transaction Report</h1>")
+            f.write(f"<p>Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>")
+            f.write("<table border='1' cellspacing='0' cellpadding='8' style='width:100%; border-collapse: collapse;'>")
+            f.write("<tr style='background-color: #ECF0F1;'><th>Date</th><th>Type</th><th>Amount</th><th>Category</th><th>Description</th></tr>")
+            with db.read_snapshot(self.user_id) as snap:
+                for r in db.iter_transactions(self.user_id, conn_ext=snap):
+                    color = "green" if r['type']=='Income' else "red"
+                    f.write(f"<tr><td>{r['date']}</td><td>{r['type']}</td><td style='color:{color}; font-weight:bold;'>{currency.symbol(r['currency'])}{r['amount']}</td><td>{r['category']}</td><td>{r['description']}</td></tr>")
+            f.write("</table></body></html>")
         webbrowser.open('file://' + path)
 
     def OnExportCSV(self, event):
         with wx.FileDialog(self, "Save CSV", wildcard="*.csv", style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dlg:
             if dlg.ShowModal() == wx.ID_CANCEL: return
             try:
-                rows = db.get_transactions_by_filter(self.user_id)
                 with open(dlg.GetPath(), 'w', newline='', encoding='utf-8') as f:
-                    w = csv.DictWriter(f, fieldnames=rows[0].keys())
+                    w = csv.DictWriter(f, fieldnames=db.TRANSACTION_FIELDS)
                     w.writeheader()
-                    for r in rows: w.writerow(dict(r))
+                    with db.read_snapshot(self.user_id) as snap:
+                        for r in db.iter_transactions(self.user_id, conn_ext=snap): w.writerow(dict(r))
                 wx.MessageBox("Data exported successfully!", "Export")
             except Exception as e: wx.MessageBox(str(e))
 
-    def OnImportCSV(self, event):
-        with wx.FileDialog(self, "Open CSV", wildcard="*.csv", style=wx.FD_OPEN) as dlg:
+    def OnImport(self, event):
+        wildcard = "Statements (*.csv;*.ofx;*.qfx;*.xlsx)|*.csv;*.ofx;*.qfx;*.xlsx|All files (*.*)|*.*"
+        with wx.FileDialog(self, "Open Statement", wildcard=wildcard, style=wx.FD_OPEN) as dlg:
             if dlg.ShowModal() == wx.ID_CANCEL: return
+            path = dlg.GetPath()
             try:
-                acc = db.get_accounts(self.user_id)[0]['account_id']
-                conn = db.get_db_connection()
-                conn.execute('BEGIN')
-                with open(dlg.GetPath(), 'r', encoding='utf-8-sig') as f:
-                    reader = csv.DictReader(f)
-                    reader.fieldnames = [name.lower().strip() for name in reader.fieldnames]
-                    for r in reader:
-                        d_str = smart_date_parse(r['date'])
-                        if not db.check_transaction_exists(self.user_id, d_str, abs(float(r['amount'])), r.get('description',''), conn):
-                            t_type = r.get('type', 'Expense').capitalize()
-                            if t_type not in ['Income', 'Expense']: t_type = 'Expense'
-                            db.add_transaction(self.user_id, acc, d_str, abs(float(r['amount'])), 
-                                               t_type, r.get('category','Other'), r.get('description', ''), "", conn)
-                conn.commit()
-                conn.close()
-                wx.MessageBox("CSV Imported successfully!", "Import")
+                # Unknown bank layout: map its columns once and the profile is picked up from then on
+                columns = importer.needs_profile(self.user_id, path)
+                if columns is not None:
+                    pdlg = ImportProfileDialog(self, columns, os.path.splitext(os.path.basename(path))[0])
+                    ok = pdlg.ShowModal() == wx.ID_OK
+                    if ok: db.save_import_profile(self.user_id, pdlg.GetValues())
+                    pdlg.Destroy()
+                    if not ok: return
+                accounts = db.get_accounts(self.user_id)
+                account_id = accounts[0]['account_id']
+                if len(accounts) > 1:
+                    with wx.SingleChoiceDialog(self, "Import into which account?", "Import", [f"{a['account_name']} ({a['currency']})" for a in accounts]) as adlg:
+                        if adlg.ShowModal() != wx.ID_OK: return
+                        account_id = accounts[adlg.GetSelection()]['account_id']
+                with wx.BusyCursor(): added, skipped, auto, status = importer.import_file(self.user_id, path, account_id)
+                if status == 'already imported': wx.MessageBox("This file has already been imported.", "Import")
+                else: wx.MessageBox(f"Statement {status} successfully!\n{added} added, {skipped} duplicates skipped, {auto} auto-categorized.", "Import")
                 wx.GetApp().GetTopWindow().RefreshAllTabs()
             except Exception as e: wx.MessageBox(str(e))
 
+    def OnAccounts(self, event):
+        dlg = AccountsDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+        wx.GetApp().GetTopWindow().RefreshAllTabs()
+
+    def OnImportProfiles(self, event):
+        dlg = ImportProfilesDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+
     def OnReset(self, event):
         if wx.MessageBox("⚠️ WARNING: This will permanently delete ALL your data.\nAre you sure?", "FACTORY RESET", wx.YES_NO|wx.ICON_ERROR) == wx.YES:
-            db.wipe_user_data(self.user_id)
+            with wx.BusyCursor(): db.wipe_user_data(self.user_id)
             wx.GetApp().GetTopWindow().RefreshAllTabs()
-            wx.MessageBox("All data has been wiped.", "Reset Complete")
+            wx.MessageBox("All data has been wiped.\nUndo (Ctrl+Z) brings back transactions, transfers and tags; a snapshot of everything\nwas saved first and can be restored from Backups.", "Reset Complete")
+
+    def OnHistory(self, event):
+        dlg = HistoryDialog(self, self.user_id)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def OnBackups(self, event):
+        dlg = BackupDialog(self, self.user_id)
+        if dlg.ShowModal() == wx.ID_OK: wx.GetApp().GetTopWindow().RefreshAllTabs()
+        dlg.Destroy()
 
 class CategoryBudgetDialog(wx.Dialog):
     def __init__(self, parent, available_categories):
@@ -598,9 +872,12 @@ class CategoryBudgetDialog(wx.Dialog):
         self.cat_choice = wx.Choice(panel, choices=available_categories)
         self.cat_choice.SetSelection(0)
         v_sizer.Add(self.cat_choice, 0, wx.EXPAND|wx.ALL, 10)
-        v_sizer.Add(wx.StaticText(panel, label="Budget Amount (₹)"), 0, wx.ALL, 10)
+        v_sizer.Add(wx.StaticText(panel, label=f"Budget Amount ({currency.symbol()})"), 0, wx.ALL, 10)
         self.amt_ctrl = wx.TextCtrl(panel)
         v_sizer.Add(self.amt_ctrl, 0, wx.EXPAND|wx.ALL, 10)
+        v_sizer.Add(wx.StaticText(panel, label="Alert at (% of budget)"), 0, wx.ALL, 10)
+        self.levels_ctrl = wx.TextCtrl(panel, value=", ".join(map(str, alerts.DEFAULT_LEVELS)))
+        v_sizer.Add(self.levels_ctrl, 0, wx.EXPAND|wx.ALL, 10)
         btn_sizer = wx.StdDialogButtonSizer()
         btn_sizer.AddButton(wx.Button(panel, wx.ID_OK))
         btn_sizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
@@ -616,8 +893,565 @@ class CategoryBudgetDialog(wx.Dialog):
     def GetValues(self):
         try: amt = float(self.amt_ctrl.GetValue())
         except ValueError: amt = 0.0
-        return self.cat_choice.GetStringSelection(), amt
+        levels = alerts.parse_levels(self.levels_ctrl.GetValue())
+        return self.cat_choice.GetStringSelection(), amt, None if levels == alerts.DEFAULT_LEVELS else ",".join(map(str, levels))
+
+class RecurringDialog(wx.Dialog):
+    def __init__(self, parent):
+        super().__init__(parent, title="Make Recurring")
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        v_sizer.Add(wx.StaticText(panel, label="Repeat"), 0, wx.ALL, 10)
+        self.freq_choice = wx.Choice(panel, choices=scheduler.FREQUENCIES)
+        self.freq_choice.SetStringSelection('Monthly')
+        v_sizer.Add(self.freq_choice, 0, wx.EXPAND|wx.ALL, 10)
+        v_sizer.Add(wx.StaticText(panel, label="Every"), 0, wx.ALL, 10)
+        self.interval_ctrl = wx.SpinCtrl(panel, min=1, max=365, initial=1)
+        v_sizer.Add(self.interval_ctrl, 0, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.StdDialogButtonSizer()
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_OK))
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
+        btn_sizer.Realize()
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_CENTER|wx.ALL, 20)
+        panel.SetSizer(v_sizer)
+        v_sizer.Fit(panel)
+        self.SetClientSize(panel.GetSize())
+        self.SetMinSize(self.GetSize())
+
+    def GetValues(self):
+        return self.freq_choice.GetStringSelection(), self.interval_ctrl.GetValue()
+
+@instrumentation.instrument_handlers
+class RecurringRulesDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Recurring Transactions", size=(700, 400))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.rule_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        for i, (name, width) in enumerate([("ID", 0), ("Next Due", 110), ("Repeat", 110), ("Amount", 100), ("Category", 120), ("Description", 220)]):
+            self.rule_list.InsertColumn(i, name, width=width)
+        v_sizer.Add(self.rule_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        stop_btn = wx.Button(panel, label="Stop Repeating")
+        stop_btn.Bind(wx.EVT_BUTTON, self.OnStop)
+        btn_sizer.Add(stop_btn, 0, wx.RIGHT, 10)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.rule_list.DeleteAllItems()
+        for i, r in enumerate(db.get_recurring_rules(self.user_id)):
+            every = r['frequency'] if r['interval'] == 1 else f"{r['frequency']} x{r['interval']}"
+            self.rule_list.InsertItem(i, str(r['rule_id']))
+            self.rule_list.SetItem(i, 1, r['next_due'])
+            self.rule_list.SetItem(i, 2, every)
+            self.rule_list.SetItem(i, 3, currency.fmt(r['amount'], r['currency']))
+            self.rule_list.SetItem(i, 4, r['category'])
+            self.rule_list.SetItem(i, 5, r['description'] or "")
+
+    def OnStop(self, event):
+        idx = self.rule_list.GetFirstSelected()
+        if idx == -1: return
+        db.delete_recurring_rule(int(self.rule_list.GetItemText(idx, 0)), self.user_id)
+        self.LoadData()
+
+class AccountDialog(wx.Dialog):
+    def __init__(self, parent):
+        super().__init__(parent, title="New Account")
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.name = wx.TextCtrl(panel)
+        self.type = wx.Choice(panel, choices=['Checking', 'Savings', 'Credit Card', 'Cash', 'Investment'])
+        self.type.SetSelection(0)
+        self.currency = wx.Choice(panel, choices=currency.CURRENCIES)
+        self.currency.SetStringSelection(currency.BASE_CURRENCY)
+        for label, ctrl in [("Name", self.name), ("Type", self.type), ("Currency", self.currency)]:
+            v_sizer.Add(wx.StaticText(panel, label=label), 0, wx.TOP|wx.LEFT, 10)
+            v_sizer.Add(ctrl, 0, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.StdDialogButtonSizer()
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_OK))
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
+        btn_sizer.Realize()
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_CENTER|wx.ALL, 20)
+        panel.SetSizer(v_sizer)
+        v_sizer.Fit(panel)
+        self.SetClientSize(panel.GetSize())
+        self.SetMinSize(self.GetSize())
+
+    def GetValues(self):
+        return self.name.GetValue().strip(), self.type.GetStringSelection(), self.currency.GetStringSelection()
+
+@instrumentation.instrument_handlers
+class CategoriesDialog(wx.Dialog):
+    # Renames and merges change one categories row; transactions keep their category_id
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Categories", size=(560, 460))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.cat_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        for i, (name, width) in enumerate([("ID", 0), ("Category", 260), ("Transactions", 100), ("Also matches", 150)]):
+            self.cat_list.InsertColumn(i, name, width=width)
+        v_sizer.Add(self.cat_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        for label, handler in [("Add", self.OnAdd), ("Rename", self.OnRename), ("Move Under", self.OnMove), ("Merge Into", self.OnMerge)]:
+            btn = wx.Button(panel, label=label)
+            btn.Bind(wx.EVT_BUTTON, handler)
+            btn_sizer.Add(btn, 0, wx.RIGHT, 10)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        cats = db.get_categories(self.user_id)
+        usage = db.get_category_usage(self.user_id)
+        live = [c for c in cats if c['merged_into'] is None]
+        self.rows = sorted(((db.category_path(c, cats), c) for c in live), key=lambda r: r[0].lower())
+        self.cat_list.DeleteAllItems()
+        for i, (path, c) in enumerate(self.rows):
+            self.cat_list.InsertItem(i, str(c['category_id']))
+            self.cat_list.SetItem(i, 1, path)
+            self.cat_list.SetItem(i, 2, str(usage.get(c['category_id'], 0)))
+            self.cat_list.SetItem(i, 3, ", ".join(a['name'] for a in cats if a['merged_into'] == c['category_id']))
+
+    def Selected(self):
+        idx = self.cat_list.GetFirstSelected()
+        return self.rows[idx][1] if idx != -1 else None
+
+    def PickOther(self, prompt, title, cat, none_label=None):
+        # Another category's id, 0 for none_label, None if cancelled
+        others = [(path, c) for path, c in self.rows if c['category_id'] != cat['category_id']]
+        choices = ([none_label] if none_label else []) + [path for path, _ in others]
+        with wx.SingleChoiceDialog(self, prompt, title, choices) as dlg:
+            if dlg.ShowModal() != wx.ID_OK: return None
+            i = dlg.GetSelection() - (1 if none_label else 0)
+            return others[i][1]['category_id'] if i >= 0 else 0
+
+    def Report(self, result):
+        ok, msg = result
+        if not ok: wx.MessageBox(msg, "Categories", wx.ICON_ERROR)
+        self.LoadData()
+
+    def OnAdd(self, event):
+        name = wx.GetTextFromUser("Name of the new category:", "Add Category", parent=self)
+        if name: self.Report(db.add_category(self.user_id, name))
+
+    def OnRename(self, event):
+        cat = self.Selected()
+        if not cat: return
+        name = wx.GetTextFromUser("New name:", "Rename Category", cat['name'], parent=self)
+        if name and name != cat['name']: self.Report(db.rename_category(self.user_id, cat['category_id'], name))
+
+    def OnMove(self, event):
+        cat = self.Selected()
+        if not cat: return
+        parent_id = self.PickOther(f"Put '{cat['name']}' under:", "Move Category", cat, "(top level)")
+        if parent_id is not None: self.Report(db.set_category_parent(self.user_id, cat['category_id'], parent_id or None))
+
+    def OnMerge(self, event):
+        cat = self.Selected()
+        if not cat: return
+        target_id = self.PickOther(f"Merge '{cat['name']}' into:", "Merge Categories", cat)
+        if not target_id: return
+        if wx.MessageBox("Its transactions, budgets and rules will count under the other category, and its name will still find them.",
+                         "Merge Categories", wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
+            self.Report(db.merge_category(self.user_id, cat['category_id'], target_id))
+
+class TagSpendingDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Spending by Tag", size=(480, 460))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.range_choice = wx.Choice(panel, choices=[label for label, _ in analytics.RANGES])
+        self.range_choice.SetSelection(0)
+        self.range_choice.Bind(wx.EVT_CHOICE, lambda e: self.LoadData())
+        v_sizer.Add(self.range_choice, 0, wx.ALL, 10)
+        self.tag_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES)
+        for i, (name, width) in enumerate([("Tag", 160), ("Month", 100), ("Spent", 140)]):
+            self.tag_list.InsertColumn(i, name, width=width, format=wx.LIST_FORMAT_RIGHT if name == "Spent" else wx.LIST_FORMAT_LEFT)
+        v_sizer.Add(self.tag_list, 1, wx.EXPAND|wx.LEFT|wx.RIGHT, 10)
+        v_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        today = datetime.now().date()
+        start = analytics.range_start(self.user_id, analytics.RANGES[self.range_choice.GetSelection()][1], today)
+        self.tag_list.DeleteAllItems()
+        for i, r in enumerate(db.get_tag_spending(self.user_id, start.strftime('%Y-%m'), today.strftime('%Y-%m'))):
+            self.tag_list.InsertItem(i, r['tag'])
+            self.tag_list.SetItem(i, 1, r['period'])
+            self.tag_list.SetItem(i, 2, currency.fmt(r['spent']))
+
+class TransferDialog(wx.Dialog):
+    def __init__(self, parent, accounts):
+        super().__init__(parent, title="Transfer Between Accounts")
+        self.accounts = accounts
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        names = [f"{a['account_name']} ({a['currency']})" for a in accounts]
+        self.from_choice = wx.Choice(panel, choices=names)
+        self.from_choice.SetSelection(0)
+        self.to_choice = wx.Choice(panel, choices=names)
+        self.to_choice.SetSelection(1)
+        self.date = wx.adv.DatePickerCtrl(panel, style=wx.adv.DP_DROPDOWN | wx.adv.DP_SHOWCENTURY)
+        self.amount = wx.TextCtrl(panel)
+        self.to_amount = wx.TextCtrl(panel)
+        self.to_amount.SetHint("Only if the currencies differ; blank uses the exchange rate")
+        self.desc = wx.TextCtrl(panel, value="Transfer")
+        for label, ctrl in [("From", self.from_choice), ("To", self.to_choice), ("Date", self.date), ("Amount", self.amount),
+                            ("Amount Received", self.to_amount), ("Description", self.desc)]:
+            v_sizer.Add(wx.StaticText(panel, label=label), 0, wx.TOP|wx.LEFT, 10)
+            v_sizer.Add(ctrl, 0, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.StdDialogButtonSizer()
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_OK))
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
+        btn_sizer.Realize()
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_CENTER|wx.ALL, 20)
+        panel.SetSizer(v_sizer)
+        v_sizer.Fit(panel)
+        self.SetClientSize(panel.GetSize())
+        self.SetMinSize(self.GetSize())
+
+    def GetValues(self):
+        return (self.accounts[self.from_choice.GetSelection()]['account_id'], self.accounts[self.to_choice.GetSelection()]['account_id'],
+                self.date.GetValue().FormatISODate(), self.amount.GetValue(), self.desc.GetValue().strip(), self.to_amount.GetValue().strip() or None)
+
+@instrumentation.instrument_handlers
+class AccountsDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Accounts", size=(760, 420))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.account_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        for i, (name, width) in enumerate([("ID", 0), ("Name", 180), ("Type", 110), ("Currency", 80), ("Balance", 130)]):
+            self.account_list.InsertColumn(i, name, width=width)
+        v_sizer.Add(self.account_list, 1, wx.EXPAND|wx.ALL, 10)
+        self.rates_text = wx.StaticText(panel, label="")
+        v_sizer.Add(self.rates_text, 0, wx.LEFT|wx.RIGHT, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        for label, handler in [("Add Account", self.OnAdd), ("Change Currency", self.OnChangeCurrency), ("Load Rates", self.OnLoadRates),
+                               ("Transfer", self.OnTransfer), ("Reconcile", self.OnReconcile)]:
+            btn = wx.Button(panel, label=label)
+            btn.Bind(wx.EVT_BUTTON, handler)
+            btn_sizer.Add(btn, 0, wx.RIGHT, 10)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.account_list.DeleteAllItems()
+        for i, a in enumerate(db.get_accounts(self.user_id)):
+            self.account_list.InsertItem(i, str(a['account_id']))
+            self.account_list.SetItem(i, 1, a['account_name'])
+            self.account_list.SetItem(i, 2, a['account_type'] or "")
+            self.account_list.SetItem(i, 3, a['currency'])
+            self.account_list.SetItem(i, 4, currency.fmt(a['current_balance'], a['currency']))
+        rates = [f"{r['currency']}/{r['quote']} {r['first']} to {r['last']}" for r in db.get_fx_summary()]
+        self.rates_text.SetLabel("Rates: " + ("; ".join(rates) if rates else "none loaded"))
+
+    def OnAdd(self, event):
+        dlg = AccountDialog(self)
+        if dlg.ShowModal() == wx.ID_OK:
+            ok, msg, _ = db.add_account(self.user_id, *dlg.GetValues())
+            if not ok: wx.MessageBox(msg)
+            self.LoadData()
+        dlg.Destroy()
+
+    def OnChangeCurrency(self, event):
+        idx = self.account_list.GetFirstSelected()
+        if idx == -1: return
+        with wx.SingleChoiceDialog(self, "Amounts in this account are in:", "Change Currency", currency.CURRENCIES) as dlg:
+            dlg.SetSelection(currency.CURRENCIES.index(self.account_list.GetItemText(idx, 3)) if self.account_list.GetItemText(idx, 3) in currency.CURRENCIES else 0)
+            if dlg.ShowModal() != wx.ID_OK: return
+            with wx.BusyCursor(): db.set_account_currency(int(self.account_list.GetItemText(idx, 0)), self.user_id, dlg.GetStringSelection())
+        self.LoadData()
+
+    def OnTransfer(self, event):
+        accounts = db.get_accounts(self.user_id)
+        if len(accounts) < 2: return wx.MessageBox("Add a second account first.", "Transfer")
+        dlg = TransferDialog(self, accounts)
+        if dlg.ShowModal() == wx.ID_OK:
+            ok, msg, _ = db.add_transfer(self.user_id, *dlg.GetValues())
+            if not ok: wx.MessageBox(msg, "Error", wx.ICON_ERROR)
+            self.LoadData()
+        dlg.Destroy()
+
+    def OnReconcile(self, event):
+        with wx.BusyCursor(): res = db.reconcile_balances(self.user_id)
+        if not res['accounts'] and not res['transfers']: return wx.MessageBox("All balances match the ledger.", "Reconcile")
+        lines = [f"{r['account_name']}: balance {r['current_balance']:.2f}, ledger {r['ledger']:.2f}" for r in res['accounts']]
+        lines += [f"Transfer {r['transfer_id']} on {r['date']} ({r['description']}) has unmatched sides" for r in res['transfers']]
+        if res['accounts'] and wx.MessageBox("\n".join(lines) + "\n\nReset the balances to the ledger totals?", "Reconcile", wx.YES_NO | wx.ICON_WARNING) == wx.YES:
+            db.reconcile_balances(self.user_id, fix=True)
+            self.LoadData()
+        elif not res['accounts']: wx.MessageBox("\n".join(lines), "Reconcile", wx.ICON_WARNING)
+
+    def OnLoadRates(self, event):
+        with wx.FileDialog(self, "Load Exchange Rates (date,currency,rate[,quote])", wildcard="*.csv", style=wx.FD_OPEN) as dlg:
+            if dlg.ShowModal() == wx.ID_CANCEL: return
+            try:
+                with wx.BusyCursor(): n = db.save_fx_rates(currency.read_rates_file(dlg.GetPath()))
+                wx.MessageBox(f"Loaded {n} rates.", "Exchange Rates")
+            except Exception as e: wx.MessageBox(str(e))
+        self.LoadData()
+
+class ImportProfileDialog(wx.Dialog):
+    def __init__(self, parent, columns, name=""):
+        super().__init__(parent, title="New Import Profile")
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        v_sizer.Add(wx.StaticText(panel, label="These columns were not recognised. Which column holds what?"), 0, wx.ALL, 10)
+        grid = wx.FlexGridSizer(cols=2, vgap=8, hgap=10)
+        grid.AddGrowableCol(1)
+        self.name = wx.TextCtrl(panel, value=name)
+        grid.Add(wx.StaticText(panel, label="Profile name"), 0, wx.ALIGN_CENTER_VERTICAL)
+        grid.Add(self.name, 1, wx.EXPAND)
+        self.choices = {}
+        for field, label in importer.PROFILE_FIELDS:
+            choice = wx.Choice(panel, choices=["(none)"] + columns)
+            guess = next((c for c in columns if label.split()[0].lower() in c), None)
+            if guess: choice.SetStringSelection(guess)
+            else: choice.SetSelection(0)
+            self.choices[field] = choice
+            grid.Add(wx.StaticText(panel, label=label), 0, wx.ALIGN_CENTER_VERTICAL)
+            grid.Add(choice, 1, wx.EXPAND)
+        self.date_format = wx.TextCtrl(panel)
+        self.date_format.SetHint("e.g. %d.%m.%Y, blank to detect")
+        grid.Add(wx.StaticText(panel, label="Date format"), 0, wx.ALIGN_CENTER_VERTICAL)
+        grid.Add(self.date_format, 1, wx.EXPAND)
+        v_sizer.Add(grid, 0, wx.EXPAND|wx.LEFT|wx.RIGHT, 10)
+        self.invert = wx.CheckBox(panel, label="Amounts are positive for money spent")
+        v_sizer.Add(self.invert, 0, wx.ALL, 10)
+        btn_sizer = wx.StdDialogButtonSizer()
+        ok_btn = wx.Button(panel, wx.ID_OK)
+        ok_btn.Bind(wx.EVT_BUTTON, self.OnOK)
+        btn_sizer.AddButton(ok_btn)
+        btn_sizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
+        btn_sizer.Realize()
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_CENTER|wx.ALL, 15)
+        panel.SetSizer(v_sizer)
+        v_sizer.Fit(panel)
+        self.SetClientSize(panel.GetSize())
+        self.SetMinSize(self.GetSize())
+
+    def GetValues(self):
+        values = {field: (c.GetStringSelection() if c.GetSelection() > 0 else None) for field, c in self.choices.items()}
+        values.update(name=self.name.GetValue().strip(), date_format=self.date_format.GetValue().strip() or None, invert_sign=self.invert.GetValue())
+        return values
+
+    def OnOK(self, event):
+        v = self.GetValues()
+        if not v['name'] or not v['date_col']: return wx.MessageBox("A name and the date column are required.")
+        if not (v['amount_col'] or v['debit_col'] or v['credit_col']): return wx.MessageBox("Pick the amount column, or the debit/credit columns.")
+        self.EndModal(wx.ID_OK)
+
+@instrumentation.instrument_handlers
+class ImportProfilesDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Import Profiles", size=(700, 350))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.profile_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        for i, (name, width) in enumerate([("ID", 0), ("Name", 150), ("Date", 110), ("Amount", 150), ("Description", 150), ("Date Format", 100)]):
+            self.profile_list.InsertColumn(i, name, width=width)
+        v_sizer.Add(self.profile_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        delete_btn = wx.Button(panel, label="Delete")
+        delete_btn.Bind(wx.EVT_BUTTON, self.OnDelete)
+        btn_sizer.Add(delete_btn, 0, wx.RIGHT, 10)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.profile_list.DeleteAllItems()
+        for i, p in enumerate(db.get_import_profiles(self.user_id)):
+            amount = p['amount_col'] or f"{p['debit_col'] or '-'} / {p['credit_col'] or '-'}"
+            self.profile_list.InsertItem(i, str(p['profile_id']))
+            self.profile_list.SetItem(i, 1, p['name'])
+            self.profile_list.SetItem(i, 2, p['date_col'])
+            self.profile_list.SetItem(i, 3, amount + (" (inverted)" if p['invert_sign'] else ""))
+            self.profile_list.SetItem(i, 4, p['description_col'] or "")
+            self.profile_list.SetItem(i, 5, p['date_format'] or "auto")
+
+    def OnDelete(self, event):
+        idx = self.profile_list.GetFirstSelected()
+        if idx == -1: return
+        db.delete_import_profile(int(self.profile_list.GetItemText(idx, 0)), self.user_id)
+        self.LoadData()
+
+@instrumentation.instrument_handlers
+class BackupDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="Backups", size=(600, 400))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.snap_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        self.snap_list.InsertColumn(0, "Snapshot", width=380)
+        self.snap_list.InsertColumn(1, "Reason", width=90)
+        self.snap_list.InsertColumn(2, "Size", width=80, format=wx.LIST_FORMAT_RIGHT)
+        v_sizer.Add(self.snap_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        backup_btn = wx.Button(panel, label="Back Up Now")
+        backup_btn.Bind(wx.EVT_BUTTON, self.OnBackupNow)
+        btn_sizer.Add(backup_btn, 0, wx.RIGHT, 5)
+        restore_btn = wx.Button(panel, label="Restore")
+        restore_btn.Bind(wx.EVT_BUTTON, self.OnRestore)
+        btn_sizer.Add(restore_btn, 0, wx.RIGHT, 5)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.snap_list.DeleteAllItems()
+        self.snapshots = backup.list_snapshots()
+        for i, s in enumerate(self.snapshots):
+            self.snap_list.InsertItem(i, s['name'])
+            self.snap_list.SetItem(i, 1, s['reason'])
+            self.snap_list.SetItem(i, 2, f"{s['size'] / 1e6:.1f} MB")
+
+    def RunWithProgress(self, title, fn, *args, **kwargs):
+        progress = wx.ProgressDialog(title, "Copying database...", maximum=100, parent=self, style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
+        try: return fn(*args, progress=lambda done, total: progress.Update(int(done * 99 / max(total, 1))), **kwargs)
+        finally: progress.Destroy()
+
+    def OnBackupNow(self, event):
+        for path in db.get_user_db_paths(self.user_id):
+            r = self.RunWithProgress("Backup", backup.create_snapshot, 'manual', db_path=path)
+        self.LoadData()
+        wx.MessageBox(f"Saved {r['bytes'] / 1e6:.1f} MB ({r['compressed_bytes'] / 1e6:.1f} MB compressed) in {r['seconds']} s, {r['total_mb_s']} MB/s.", "Backup")
+
+    def OnRestore(self, event):
+        idx = self.snap_list.GetFirstSelected()
+        if idx == -1: return
+        snap = self.snapshots[idx]
+        if wx.MessageBox(f"Replace ALL current data with '{snap['name']}'?\nA snapshot of the current state is taken first.", "Restore", wx.YES_NO | wx.ICON_WARNING) != wx.YES: return
+        r = self.RunWithProgress("Restore", backup.restore_snapshot, snap['path'])
+        wx.MessageBox(f"Restored {r['bytes'] / 1e6:.1f} MB in {r['seconds']} s.", "Restore")
+        self.EndModal(wx.ID_OK)
+
+class HistoryDialog(wx.Dialog):
+    def __init__(self, parent, user_id):
+        super().__init__(parent, title="History", size=(700, 450))
+        self.user_id = user_id
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.action_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES | wx.LC_SINGLE_SEL)
+        self.action_list.InsertColumn(0, "When", width=150)
+        self.action_list.InsertColumn(1, "Change", width=420)
+        self.action_list.InsertColumn(2, "Rows", width=70, format=wx.LIST_FORMAT_RIGHT)
+        v_sizer.Add(self.action_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        undo_btn = wx.Button(panel, label="Undo This")
+        undo_btn.Bind(wx.EVT_BUTTON, self.OnUndoSelected)
+        btn_sizer.Add(undo_btn, 0, wx.RIGHT, 5)
+        export_btn = wx.Button(panel, label="Export Ledger As Of")
+        export_btn.Bind(wx.EVT_BUTTON, self.OnExport)
+        btn_sizer.Add(export_btn, 0, wx.RIGHT, 5)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.action_list.DeleteAllItems()
+        self.actions = db.get_actions(self.user_id)
+        for i, a in enumerate(self.actions):
+            self.action_list.InsertItem(i, a['at'].replace('T', ' '))
+            self.action_list.SetItem(i, 1, a['label'])
+            self.action_list.SetItem(i, 2, str(a['changes']))
+
+    def OnUndoSelected(self, event):
+        idx = self.action_list.GetFirstSelected()
+        if idx == -1: return
+        a = self.actions[idx]
+        if wx.MessageBox(f"Undo '{a['label']}'?\nLater edits to the same transactions are overwritten.", "Undo", wx.YES_NO | wx.ICON_QUESTION) != wx.YES: return
+        with wx.BusyCursor(): ok, msg, _ = db.undo_action(self.user_id, a['action_id'])
+        if not ok: return wx.MessageBox(msg, "Undo", wx.ICON_ERROR)
+        wx.GetApp().GetTopWindow().RefreshAllTabs()
+        self.LoadData()
+
+    def OnExport(self, event):
+        idx = self.action_list.GetFirstSelected()
+        if idx == -1: return
+        a = self.actions[idx]
+        with wx.FileDialog(self, "Save ledger as of this change", wildcard="*.csv", defaultFile=f"ledger-{a['at'][:10]}.csv",
+                           style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dlg:
+            if dlg.ShowModal() == wx.ID_CANCEL: return
+            try:
+                with wx.BusyCursor(): n = audit.export_ledger_at(self.user_id, a['action_id'], dlg.GetPath())
+                wx.MessageBox(f"{n} transactions as they stood after '{a['label']}'.", "Export")
+            except Exception as e: wx.MessageBox(str(e))
+
+class MetricsDialog(wx.Dialog):
+    def __init__(self, parent):
+        super().__init__(parent, title="Performance Metrics", size=(900, 500), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.Center()
+        panel = wx.Panel(self)
+        v_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.metric_list = wx.ListCtrl(panel, style=wx.LC_REPORT | wx.LC_HRULES)
+        for i, (name, width) in enumerate([("Name", 360), ("Calls", 70), ("Mean ms", 80), ("p95 ms", 80), ("Max ms", 80), ("Total ms", 90), ("Rows", 80)]):
+            self.metric_list.InsertColumn(i, name, width=width, format=wx.LIST_FORMAT_LEFT if i == 0 else wx.LIST_FORMAT_RIGHT)
+        v_sizer.Add(self.metric_list, 1, wx.EXPAND|wx.ALL, 10)
+        btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        for label, handler in [("Refresh", self.OnRefresh), ("Reset", self.OnReset), ("Profile Next Action", self.OnProfileNext), ("Save JSON", self.OnSaveJSON)]:
+            btn = wx.Button(panel, label=label)
+            btn.Bind(wx.EVT_BUTTON, handler)
+            btn_sizer.Add(btn, 0, wx.RIGHT, 5)
+        btn_sizer.Add(wx.Button(panel, wx.ID_CANCEL, "Close"), 0)
+        v_sizer.Add(btn_sizer, 0, wx.ALIGN_RIGHT|wx.ALL, 10)
+        panel.SetSizer(v_sizer)
+        self.LoadData()
+
+    def LoadData(self):
+        self.metric_list.DeleteAllItems()
+        metrics = sorted(instrumentation.snapshot().items(), key=lambda kv: kv[1]['total_ms'], reverse=True)
+        for i, (name, m) in enumerate(metrics):
+            self.metric_list.InsertItem(i, name)
+            for col, key in enumerate(['count', 'mean_ms', 'p95_ms', 'max_ms', 'total_ms', 'rows'], start=1):
+                self.metric_list.SetItem(i, col, str(m[key]))
+
+    def OnRefresh(self, event): self.LoadData()
+
+    def OnReset(self, event):
+        instrumentation.reset()
+        self.LoadData()
+
+    def OnProfileNext(self, event):
+        with wx.FileDialog(self, "Save profile of next action", defaultFile="action.prof", wildcard="*.prof", style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dlg:
+            if dlg.ShowModal() == wx.ID_CANCEL: return
+            instrumentation.profile_next_action(dlg.GetPath())
+        self.EndModal(wx.ID_OK)
+
+    def OnSaveJSON(self, event):
+        with wx.FileDialog(self, "Save metrics", defaultFile="financify_metrics.json", wildcard="*.json", style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT) as dlg:
+            if dlg.ShowModal() == wx.ID_CANCEL: return
+            instrumentation.dump_json(dlg.GetPath())
 
+@instrumentation.instrument_handlers
 class TransactionEditDialog(wx.Dialog):
     def __init__(self, parent, user_id, t, accounts):
         # Using auto-fit logic instead of hardcoding height
@@ -628,9 +1462,10 @@ class TransactionEditDialog(wx.Dialog):
         self.date = wx.adv.DatePickerCtrl(panel)
         self.type = wx.Choice(panel, choices=['Expense', 'Income'])
         self.amt = wx.TextCtrl(panel)
-        self.cat = wx.ComboBox(panel, choices=CATEGORIES)
+        self.cat = wx.ComboBox(panel, choices=category_names(user_id))
         self.desc = wx.TextCtrl(panel, style=wx.TE_MULTILINE, size=(-1, 60))
-        for label, ctrl in [("Date", self.date), ("Type", self.type), ("Amount", self.amt), ("Category", self.cat), ("Description", self.desc)]:
+        self.tags = wx.TextCtrl(panel)
+        for label, ctrl in [("Date", self.date), ("Type", self.type), ("Amount", self.amt), ("Category", self.cat), ("Description", self.desc), ("Tags", self.tags)]:
             sizer.Add(wx.StaticText(panel, label=label), 0, wx.TOP|wx.LEFT, 10)
             sizer.Add(ctrl, 0, wx.EXPAND|wx.ALL, 10)
         self.LoadData()
@@ -657,14 +1492,16 @@ class TransactionEditDialog(wx.Dialog):
         self.amt.SetValue(str(abs(self.t['amount'])))
         self.cat.SetValue(self.t['category'])
         self.desc.SetValue(self.t['description'])
+        self.tags.SetValue(self.t['tags'] or "")
 
     def OnSave(self, e):
         try:
             v = float(self.amt.GetValue())
             if v <= 0: raise ValueError
-            acc_id = list(self.amap.values())[0]
+            acc_id = self.t['account_id']
             nd = {'date': self.date.GetValue().FormatISODate(), 'type': self.type.GetStringSelection(), 'amount': v,
-                  'account_id': acc_id, 'category': self.cat.GetValue(), 'description': self.desc.GetValue()}
+                  'account_id': acc_id, 'category': self.cat.GetValue(), 'description': self.desc.GetValue(), 'tags': self.tags.GetValue()}
             db.update_transaction(self.t['transaction_id'], self.user_id, nd)
+            if nd['category'] != self.t['category']: categorizer.record_correction(self.user_id, nd['description'], nd['category'])
             self.EndModal(wx.ID_OK)
         except: wx.MessageBox("Invalid Input", "Error", wx.ICON_ERROR)
\ No newline at end of file
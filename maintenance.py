@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import database as db
+
+IDLE_DELAY_S = 2.0          # only work after the app has been quiet this long
+SLICE_BUDGET_MS = 4.0       # upper bound for one idle step on the UI thread
+OPTIMIZE_EVERY = timedelta(hours=6)
+CHECK_EVERY = timedelta(days=1)
+ANALYSIS_LIMIT = 400        # rows sampled per index by ANALYZE, keeps it bounded on big tables
+
+def connect(path=None, check_same_thread=True):
+    # Maintenance never goes through get_db_connection, so it does not count as app activity
+    conn = sqlite3.connect(path or db.DB_NAME, isolation_level=None, timeout=0.05, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    return conn
+
+def log_task(conn, task, started, ms, result):
+    conn.execute("INSERT INTO maintenance_log (task, started_at, duration_ms, result) VALUES (?, ?, ?, ?)",
+                 (task, started.isoformat(timespec='seconds'), round(ms, 3), result))
+
+def last_runs(conn):
+    rows = conn.execute("SELECT task, MAX(started_at) FROM maintenance_log WHERE result != 'interrupted' GROUP BY task").fetchall()
+    return {task: datetime.fromisoformat(at) for task, at in rows}
+
+def freelist_count(conn):
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def needs_analyze(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None
+
+def run_optimize(conn):
+    if needs_analyze(conn):
+        conn.execute("ANALYZE")
+        return 'analyzed'
+    conn.execute("PRAGMA optimize")
+    return 'optimized'
+
+def run_quick_check(conn):
+    rows = conn.execute("PRAGMA quick_check").fetchall()
+    return 'ok' if rows == [('ok',)] else '; '.join(r[0] for r in rows[:5])
+
+class Maintainer:
+    # Cooperative maintenance for the UI thread: step() does at most one small slice of work
+    # and returns quickly. quick_check and optimize (an ANALYZE can take far longer than a
+    # slice on a big ledger) cannot be sliced, so they run one at a time on a worker thread
+    # that is interrupted as soon as the app opens a connection, then retried at the next quiet spell.
+    def __init__(self, path=None, budget_ms=SLICE_BUDGET_MS):
+        self.path = path or db.DB_NAME
+        self.budget_ms = budget_ms
+        self.pages = 32
+        self.vacuum_run = None
+        self.incremental = False
+        self.vacuum_floor = 0
+        self.last_activity = time.monotonic()
+        self.conn = None
+        self.last = {}
+        self.worker = None
+        self.worker_conn = None
+        self.results = []
+        db.CONNECT_HOOKS.append(self.on_activity)
+
+    def close(self):
+        if self.on_activity in db.CONNECT_HOOKS: db.CONNECT_HOOKS.remove(self.on_activity)
+        self.on_activity()
+        if self.conn: self.conn.close()
+
+    def on_activity(self):
+        self.last_activity = time.monotonic()
+        if self.worker_conn is not None:
+            try: self.worker_conn.interrupt()
+            except sqlite3.ProgrammingError: pass
+
+    def step(self):
+        if time.monotonic() - self.last_activity < IDLE_DELAY_S: return False
+        try:
+            if self.conn is None:
+                self.conn = connect(self.path)
+                self.last = last_runs(self.conn)
+                # Files made before auto_vacuum was set stay NONE until converted; vacuuming frees nothing there
+                self.incremental = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            while self.results: log_task(self.conn, *self.results.pop())
+            now = datetime.now()
+            if self.incremental and freelist_count(self.conn) > self.vacuum_floor: return self.vacuum_slice()
+            if self.vacuum_run: self.finish_vacuum()
+            if now - self.last.get('optimize', datetime.min) > OPTIMIZE_EVERY: return self.start_task('optimize', run_optimize)
+            if now - self.last.get('quick_check', datetime.min) > CHECK_EVERY: return self.start_task('quick_check', run_quick_check)
+        except sqlite3.OperationalError:
+            # Locked by a writer: that is user work, so back off until the next quiet spell
+            self.last_activity = time.monotonic()
+        return False
+
+    def vacuum_slice(self):
+        if self.vacuum_run is None: self.vacuum_run = [datetime.now(), 0.0, 0, 0]
+        before, t = freelist_count(self.conn), time.perf_counter()
+        # executescript steps the pragma to completion; execute() would free a single page
+        self.conn.executescript(f"PRAGMA incremental_vacuum({self.pages})")
+        ms = (time.perf_counter() - t) * 1000
+        after = freelist_count(self.conn)
+        self.vacuum_run[1] += ms
+        self.vacuum_run[2] += before - after
+        self.vacuum_run[3] += 1
+        if after >= before:
+            # Nothing freed: stop, and don't try again until more pages are free
+            self.vacuum_floor = after
+            self.finish_vacuum()
+            return True
+        self.vacuum_floor = 0
+        # Size the next slice so it lands on the budget
+        self.pages = max(1, min(4096, int(self.pages * self.budget_ms / max(ms, 0.1))))
+        return True
+
+    def finish_vacuum(self):
+        started, ms, pages, slices = self.vacuum_run
+        self.vacuum_run = None
+        log_task(self.conn, 'incremental_vacuum', started, ms, f"{pages} pages in {slices} slices")
+
+    def start_task(self, task, fn):
+        if self.worker and self.worker.is_alive(): return False
+        self.last[task] = datetime.now()
+        self.worker = threading.Thread(target=self.run_task, args=(task, fn), daemon=True)
+        self.worker.start()
+        return True
+
+    def run_task(self, task, fn):
+        started, t = datetime.now(), time.perf_counter()
+        try:
+            self.worker_conn = connect(self.path, check_same_thread=False)
+            result = fn(self.worker_conn)
+        except sqlite3.OperationalError:
+            # Interrupted, or locked by a writer: either way the app is busy
+            result = 'interrupted'
+            self.last.pop(task, None)
+        finally:
+            conn, self.worker_conn = self.worker_conn, None
+            if conn: conn.close()
+        self.results.append((task, started, (time.perf_counter() - t) * 1000, result))
+
+def get_status(path=None):
+    conn = connect(path)
+    wal = (path or db.DB_NAME) + '-wal'
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        status = {'auto_vacuum': ['none', 'full', 'incremental'][conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+                  'size_mb': round(conn.execute("PRAGMA page_count").fetchone()[0] * page_size / 1e6, 2),
+                  'free_mb': round(freelist_count(conn) * page_size / 1e6, 2),
+                  'analyzed': not needs_analyze(conn),
+                  'journal': conn.execute("PRAGMA journal_mode").fetchone()[0],
+                  'wal_mb': round(os.path.getsize(wal) / 1e6, 2) if os.path.exists(wal) else 0.0,
+                  'recent': conn.execute("SELECT task, started_at, duration_ms, result FROM maintenance_log ORDER BY log_id DESC LIMIT 10").fetchall()}
+    finally: conn.close()
+    return status
+
+def run_vacuum(conn):
+    before = freelist_count(conn)
+    conn.executescript("PRAGMA incremental_vacuum")
+    return f"{before - freelist_count(conn)} pages freed"
+
+def run_analyze(conn):
+    conn.execute("ANALYZE")
+    return 'analyzed'
+
+def run_checkpoint(conn):
+    # Folds the WAL back into the database and truncates it; waits out open read snapshots
+    busy, log, done = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return f"{done} of {log} pages" + (" (busy)" if busy else "")
+
+def run_convert(conn):
+    # One-off switch of an existing file to incremental auto-vacuum; a full rewrite that blocks writers
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return 'converted'
+
+CLI_TASKS = {'vacuum': ('incremental_vacuum', run_vacuum), 'analyze': ('optimize', run_analyze), 'optimize': ('optimize', run_optimize),
+             'check': ('quick_check', run_quick_check), 'convert': ('convert', run_convert), 'checkpoint': ('checkpoint', run_checkpoint)}
+
+def run_cli(task, path=None):
+    conn = connect(path)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    names = ['vacuum', 'optimize', 'check'] if task == 'all' else [task]
+    try:
+        for name in names:
+            log_name, fn = CLI_TASKS[name]
+            started, t = datetime.now(), time.perf_counter()
+            result = fn(conn)
+            ms = (time.perf_counter() - t) * 1000
+            log_task(conn, log_name, started, ms, result)
+            print(f"{os.path.basename(path or db.DB_NAME)} {name}: {result} in {ms:.1f} ms")
+    finally: conn.close()
+
+if __name__ == '__main__':
+    task = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    db.initialize_database()
+    for path in db.get_all_db_paths():
+        if task == 'status':
+            status = get_status(path)
+            print(os.path.basename(path))
+            for k, v in status.items():
+                if k != 'recent': print(f"  {k}: {v}")
+            for r in status['recent']: print("    ", *r)
+        else: run_cli(task, path)
@@ -0,0 +1,125 @@
+import re
+import calendar
+import functools
+from datetime import date, timedelta
+
+# Search box language: space-separated terms, all of which must match.
+#   category:Food,Groceries   account:Checking   type:expense   tag:trip or #trip
+#   date:2026-01..2026-03   date>=2026-02-15   amount>500   amount:100..250
+#   desc:"coffee shop"   -desc:refund (a leading - negates)   plain words as before
+# Amounts compare by size, so amount>500 matches a 600 expense as well as a 600 income.
+# category:Food also matches Food's subcategories and anything merged into them.
+
+FIELDS = {'category': 'category', 'cat': 'category', 'account': 'account', 'acct': 'account', 'date': 'date',
+          'amount': 'amount', 'amt': 'amount', 'type': 'type', 'desc': 'description', 'description': 'description', 'tag': 'tag'}
+RANGE_FIELDS = {'date', 'amount'}
+TOKEN = re.compile(r'(-?)(?:(\w+)(:|>=|<=|>|<|=))?("[^"]*"|\S+)')
+USER = object()  # placeholder for the user id in compiled params
+
+def parse(text):
+    terms = []
+    for neg, name, op, value in TOKEN.findall(text or ""):
+        value = value.strip('"')
+        field = FIELDS.get(name.lower()) if name else None
+        if name and not field:
+            # Not a field we know, e.g. a time like 10:30: search for the text
+            value, op = f"{name}{op}{value}", ''
+        elif not name and value.startswith('#'):
+            field, op, value = 'tag', ':', value[1:]
+        if op == '=': op = ':'
+        if field and op != ':' and field not in RANGE_FIELDS: raise ValueError(f"{name} only supports {name}:value")
+        if value: terms.append((bool(neg), field or '', op, value))
+    # Sorted so the same filter written in any order hits one cache entry
+    return tuple(sorted(terms))
+
+def compile_filter(text, category_ids):
+    # Returns (sql, params): sql is " AND ..." to follow "WHERE t.user_id = ?", params may hold USER.
+    # category_ids maps a list of names to their ids, subcategories and aliases included; they are
+    # resolved first so that the usual single id compiles to an equality, which walks
+    # idx_transactions_category in date order where an IN list would need a sort.
+    terms = tuple((neg, field, op, tuple(sorted(category_ids(in_list(value)[1]))) if field == 'category' else value)
+                  for neg, field, op, value in parse(text))
+    return _compile(terms)
+
+@functools.lru_cache(maxsize=256)
+def _compile(terms):
+    sql, params = [], []
+    for neg, field, op, value in terms:
+        clause, p = COMPILERS[field](op, value)
+        sql.append(f" AND ({clause}) IS NOT 1" if neg else f" AND {clause}")
+        params.extend(p)
+    return "".join(sql), tuple(params)
+
+def text_term(op, value):
+    like = f"%{value}%"
+    return ("(t.description LIKE ? OR t.category_id IN (SELECT c.category_id FROM categories c LEFT JOIN categories m ON m.category_id = c.merged_into "
+            "WHERE c.user_id = ? AND COALESCE(m.name, c.name) LIKE ?) OR t.account_id IN (SELECT account_id FROM accounts WHERE user_id = ? AND account_name LIKE ?))",
+            [like, USER, like, USER, like])
+
+def in_list(value):
+    values = [v.strip() for v in value.split(',') if v.strip()]
+    return ", ".join("?" * len(values)), values
+
+def category_term(op, ids):
+    if len(ids) == 1: return "t.category_id = ?", list(ids)
+    # Sorting a few categories' rows beats walking the whole ledger in date order, which the
+    # planner picks for an IN list unless told the match is rare
+    return f"unlikely(t.category_id IN ({', '.join('?' * len(ids))}))", list(ids)
+
+def account_term(op, value):
+    marks, values = in_list(value)
+    if len(values) == 1:
+        # A scalar subquery is a constant to the planner, so this walks idx_transactions_account
+        # already in date order. Picks the first account if two share the name.
+        return "t.account_id = (SELECT MIN(account_id) FROM accounts WHERE user_id = ? AND account_name = ? COLLATE NOCASE)", [USER] + values
+    return f"t.account_id IN (SELECT account_id FROM accounts WHERE user_id = ? AND account_name COLLATE NOCASE IN ({marks}))", [USER] + values
+
+def type_term(op, value):
+    if value.capitalize() not in ('Expense', 'Income'): raise ValueError("type is expense or income")
+    return "t.type = ?", [value.capitalize()]
+
+def description_term(op, value):
+    return "t.description LIKE ?", [f"%{value}%"]
+
+def tag_term(op, value):
+    return ("t.transaction_id IN (SELECT tt.transaction_id FROM tags g JOIN transaction_tags tt ON tt.tag_id = g.tag_id WHERE g.user_id = ? AND g.name = ?)",
+            [USER, value])
+
+def period(value):
+    # A year, month or day as [start, end) ISO dates
+    try:
+        parts = [int(p) for p in value.split('-')]
+        if len(parts) == 1: start, end = date(parts[0], 1, 1), date(parts[0] + 1, 1, 1)
+        elif len(parts) == 2: start = date(parts[0], parts[1], 1); end = start + timedelta(days=calendar.monthrange(*parts)[1])
+        elif len(parts) == 3: start = date(*parts); end = start + timedelta(days=1)
+        else: raise ValueError
+    except ValueError: raise ValueError(f"Not a date: {value} (use 2026, 2026-01 or 2026-01-15)")
+    return start.isoformat(), end.isoformat()
+
+def date_term(op, value):
+    # Half-open ranges on the raw column, so the date indexes can seek
+    if op == ':' and '..' in value:
+        lo, hi = value.split('..', 1)
+        sql, params = [], []
+        if lo: sql.append("t.date >= ?"); params.append(period(lo)[0])
+        if hi: sql.append("t.date < ?"); params.append(period(hi)[1])
+        if not sql: raise ValueError("date range needs a start or an end")
+        return " AND ".join(sql), params
+    start, end = period(value)
+    if op == ':': return "t.date >= ? AND t.date < ?", [start, end]
+    return {'>': ("t.date >= ?", [end]), '>=': ("t.date >= ?", [start]), '<': ("t.date < ?", [start]), '<=': ("t.date < ?", [end])}[op]
+
+def number(value):
+    try: return abs(float(value))
+    except ValueError: raise ValueError(f"Not an amount: {value}")
+
+def amount_term(op, value):
+    # Expenses are stored negative; abs(t.amount) matches the expression index on it
+    if op == ':' and '..' in value:
+        lo, hi = value.split('..', 1)
+        if not hi: return "abs(t.amount) >= ?", [number(lo or 0)]
+        return "abs(t.amount) BETWEEN ? AND ?", [number(lo or 0), number(hi)]
+    return f"abs(t.amount) {'=' if op == ':' else op} ?", [number(value)]
+
+COMPILERS = {'': text_term, 'category': category_term, 'account': account_term, 'type': type_term, 'description': description_term,
+             'tag': tag_term, 'date': date_term, 'amount': amount_term}
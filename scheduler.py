@@ -0,0 +1,88 @@
+import heapq
+import calendar
+from datetime import date, datetime, timedelta
+import database as db
+
+FREQUENCIES = ['Daily', 'Weekly', 'Monthly', 'Yearly']
+
+def add_months(d, months, anchor_day):
+    y, m = divmod(d.month - 1 + months, 12)
+    y, m = d.year + y, m + 1
+    return date(y, m, min(anchor_day, calendar.monthrange(y, m)[1]))
+
+def next_occurrence(due, frequency, interval=1, anchor_day=None):
+    if isinstance(due, str): due = datetime.strptime(due, '%Y-%m-%d').date()
+    interval = max(1, interval or 1)
+    anchor_day = anchor_day or due.day
+    if frequency == 'Daily': return due + timedelta(days=interval)
+    if frequency == 'Weekly': return due + timedelta(weeks=interval)
+    if frequency == 'Monthly': return add_months(due, interval, anchor_day)
+    if frequency == 'Yearly': return add_months(due, 12 * interval, anchor_day)
+    raise ValueError(f"Unknown frequency: {frequency}")
+
+def create_rule_from_transaction(user_id, trans, frequency, interval=1):
+    first = datetime.strptime(trans['date'], '%Y-%m-%d').date()
+    nxt = next_occurrence(first, frequency, interval)
+    return db.add_recurring_rule(user_id, trans['account_id'], trans['amount'], trans['type'], trans['category'],
+                                 trans['description'], frequency, interval, first.day, nxt.isoformat())
+
+class RecurringScheduler:
+    # Keeps a min-heap of (next_due, rule_id) for one user, so a timer tick is a peek at
+    # the top of the heap and only rules that are actually due are ever loaded.
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.heap = None
+
+    def reload(self):
+        self.heap = db.get_recurring_schedule(self.user_id)
+        heapq.heapify(self.heap)
+
+    def next_due(self):
+        if self.heap is None: self.reload()
+        return self.heap[0][0] if self.heap else None
+
+    def run_due(self, today=None):
+        if self.heap is None: self.reload()
+        today = (today or date.today()).isoformat()
+        if not self.heap or self.heap[0][0] > today: return 0
+
+        due_ids = set()
+        while self.heap and self.heap[0][0] <= today:
+            due_ids.add(heapq.heappop(self.heap)[1])
+
+        posted = 0
+        conn = db.get_db_connection(self.user_id)
+        try:
+            db.begin_write(conn, self.user_id, "Post recurring transactions")
+            rules = db.get_recurring_rules_by_id(due_ids, conn)
+            # Work queue holds every due occurrence across rules in date order, so a long
+            # catch-up posts transactions chronologically and touches each rule only when due.
+            queue = [(r['next_due'], rid) for rid, r in rules.items()]
+            heapq.heapify(queue)
+            next_due = {}
+            while queue and queue[0][0] <= today:
+                due, rid = heapq.heappop(queue)
+                r = rules[rid]
+                if r['end_date'] and due > r['end_date']:
+                    next_due[rid] = (due, 0)
+                    continue
+                if db.claim_recurring_occurrence(rid, due, conn):
+                    ok, msg, tid = db.add_transaction(self.user_id, r['account_id'], due, r['amount'], r['type'],
+                                                      r['category'], r['description'], "", conn)
+                    if not ok: raise Exception(msg)
+                    db.set_recurring_occurrence_transaction(rid, due, tid, conn)
+                    posted += 1
+                nxt = next_occurrence(due, r['frequency'], r['interval'], r['anchor_day']).isoformat()
+                next_due[rid] = (nxt, 1)
+                heapq.heappush(queue, (nxt, rid))
+            db.advance_recurring_rules([(d, active, rid) for rid, (d, active) in next_due.items()], conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self.reload()
+            raise
+        finally: conn.close()
+
+        for rid, (d, active) in next_due.items():
+            if active: heapq.heappush(self.heap, (d, rid))
+        return posted
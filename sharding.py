@@ -0,0 +1,82 @@
+import sys
+import time
+import sqlite3
+import database as db
+
+# Per-user ledger tables and how to select one user's rows from the shared database
+USER_TABLES = [
+    ('accounts', "user_id = ?"),
+    ('categories', "user_id = ?"),
+    ('transfers', "user_id = ?"),
+    ('transactions', "user_id = ?"),
+    ('tags', "user_id = ?"),
+    ('transaction_tags', "tag_id IN (SELECT tag_id FROM src.tags WHERE user_id = ?)"),
+    ('budgets', "user_id = ?"),
+    ('budget_alerts', "user_id = ?"),
+    ('category_rules', "user_id = ?"),
+    ('recurring_rules', "user_id = ?"),
+    ('recurring_occurrences', "rule_id IN (SELECT rule_id FROM src.recurring_rules WHERE user_id = ?)"),
+    ('import_jobs', "user_id = ?"),
+    ('import_profiles', "user_id = ?"),
+    ('anomalies', "user_id = ?"),
+    ('anomaly_scans', "user_id = ?"),
+    # The copy runs outside any action, so the audit triggers don't log the rows above
+    ('audit_actions', "user_id = ?"),
+    ('audit_log', "action_id IN (SELECT action_id FROM src.audit_actions WHERE user_id = ?)"),
+]
+
+def table_columns(conn, schema, table):
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def copy_user(user_id, src_path):
+    conn = db.get_db_connection(user_id)
+    conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+    copied = {}
+    try:
+        db.begin_write(conn)
+        for table, where in USER_TABLES:
+            src_cols = set(table_columns(conn, 'src', table))
+            if not src_cols: continue  # already purged from the shared file
+            cols = ', '.join(c for c in table_columns(conn, 'main', table) if c in src_cols)
+            # OR IGNORE keeps the split restartable: rows already moved are skipped
+            cur = conn.execute(f"INSERT OR IGNORE INTO main.{table} ({cols}) SELECT {cols} FROM src.{table} WHERE {where}", (user_id,))
+            copied[table] = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+    return copied
+
+def purge_shared_ledger(src_path):
+    conn = sqlite3.connect(src_path)
+    for table, _ in reversed(USER_TABLES): conn.execute(f"DROP TABLE IF EXISTS {table}")
+    for table in [*db.ROLLUPS, 'spending_stats']: conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+    conn.close()
+
+def split_database(buckets=0, purge=False):
+    src_path = db.DB_NAME
+    db.SHARDED, db.SHARD_BUCKETS = True, buckets
+    conn = sqlite3.connect(src_path)
+    user_ids = [r[0] for r in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+    conn.close()
+    for uid in user_ids:
+        t = time.perf_counter()
+        copied = copy_user(uid, src_path)
+        print(f"user {uid} -> {db.get_db_path(uid)}: {copied.get('transactions', 0)} transactions in {time.perf_counter() - t:.2f} s")
+    if purge: purge_shared_ledger(src_path)
+    return user_ids
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'split':
+        print("usage: python sharding.py split [buckets] [--purge]")
+        sys.exit(1)
+    args = [a for a in sys.argv[2:] if not a.startswith('--')]
+    buckets = int(args[0]) if args else 0
+    db.initialize_database()
+    split_database(buckets, purge='--purge' in sys.argv)
+    env = "FINANCIFY_STORAGE=sharded" + (f" FINANCIFY_SHARDS={buckets}" if buckets else "")
+    print(f"Done. Start the app with {env} to use the per-user files.")